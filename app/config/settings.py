@@ -13,6 +13,7 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 from pathlib import Path
 from decouple import config
 import os   
+import sys
 from datetime import timedelta
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -143,6 +144,91 @@ STATICFILES_DIRS = [
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+# Use a shared backend (e.g. django.core.cache.backends.redis.RedisCache) in
+# production so that version bumps are seen by every worker.
+
+CACHES = {
+    "default": {
+        "BACKEND": config("CACHE_BACKEND", default="django.core.cache.backends.locmem.LocMemCache"),
+        "LOCATION": config("CACHE_LOCATION", default="medilab"),
+    }
+}
+
+# Seconds a cached category/subcategory response is kept for one taxonomy version
+TAXONOMY_CACHE_TIMEOUT = config("TAXONOMY_CACHE_TIMEOUT", default=60 * 60, cast=int)
+
+# Product detail responses: seconds an entry is fresh, and how much longer a
+# stale copy may be served while a single request re-renders it
+PRODUCT_DETAIL_CACHE_TIMEOUT = config("PRODUCT_DETAIL_CACHE_TIMEOUT", default=5 * 60, cast=int)
+PRODUCT_DETAIL_CACHE_GRACE = config("PRODUCT_DETAIL_CACHE_GRACE", default=60, cast=int)
+
+# Shopping feeds (store.feeds): where product pages and media live publicly
+SITE_URL = config("SITE_URL", default="https://medilab.instaviv.com")
+FEED_PRODUCT_URL = config("FEED_PRODUCT_URL", default=SITE_URL + "/products/{id}")
+FEED_TITLE = config("FEED_TITLE", default="Medilab products")
+FEED_CURRENCY = config("FEED_CURRENCY", default="INR")
+
+# Product views are buffered per process and written to RecentView in batches
+# every RECENT_VIEWS_FLUSH_INTERVAL seconds by a thread of the serving process
+# (0: no thread, only when the buffer is full). Tests flush explicitly.
+RECENT_VIEWS_FLUSH_INTERVAL = config(
+    "RECENT_VIEWS_FLUSH_INTERVAL", default=0 if sys.argv[1:2] == ["test"] else 10, cast=int
+)
+RECENT_VIEWS_BUFFER_SIZE = config("RECENT_VIEWS_BUFFER_SIZE", default=5000, cast=int)
+RECENT_VIEWS_LIMIT = 20
+
+# Trending products (store.trending): signal weights, score half-life, how far
+# back events are read and how many products are ranked per list
+TRENDING_WEIGHTS = {"views": 1.0, "wishlist": 3.0, "sales": 5.0}
+TRENDING_HALF_LIFE_HOURS = config("TRENDING_HALF_LIFE_HOURS", default=72, cast=float)
+TRENDING_WINDOW_DAYS = config("TRENDING_WINDOW_DAYS", default=30, cast=int)
+TRENDING_SIZE = 50
+TRENDING_CACHE_TIMEOUT = config("TRENDING_CACHE_TIMEOUT", default=5 * 60, cast=int)
+
+# "Also bought" recommendations: neighbours kept per product, the fewest shared
+# orders that count, and the largest order considered (pairs grow quadratically)
+RECOMMENDATION_NEIGHBOURS = 12
+RECOMMENDATION_MIN_SUPPORT = config("RECOMMENDATION_MIN_SUPPORT", default=2, cast=int)
+RECOMMENDATION_MAX_ORDER_SIZE = 50
+
+# Key-value store for active guest carts (store.cart_store). Point BACKEND at
+# store.cart_store.RedisCartStore and LOCATION at a redis:// URL in production;
+# the in-memory default keeps carts per worker process, so it is refused with DEBUG off.
+CART_STORE = {
+    "BACKEND": config("CART_STORE_BACKEND", default="store.cart_store.MemoryCartStore"),
+    "LOCATION": config("CART_STORE_LOCATION", default=""),
+}
+# Seconds a stored cart lives after its last change
+CART_STORE_TTL = config("CART_STORE_TTL", default=14 * 24 * 60 * 60, cast=int)
+
+# Seconds a user's cart summary (header badge) is cached; cart writes delete it
+CART_SUMMARY_CACHE_TIMEOUT = config("CART_SUMMARY_CACHE_TIMEOUT", default=10 * 60, cast=int)
+
+# Seconds stock stays reserved for an unpaid online order; see the
+# release_reservations command for the sweeper that frees expired holds
+STOCK_RESERVATION_TTL = config("STOCK_RESERVATION_TTL", default=15 * 60, cast=int)
+
+# Search facets: lower bounds of the price buckets and seconds results are shared
+FACET_PRICE_BUCKETS = [0, 100, 250, 500, 1000, 2500]
+FACETS_CACHE_TIMEOUT = config("FACETS_CACHE_TIMEOUT", default=60, cast=int)
+
+# Postgres text search configuration used for the product search vector
+PRODUCT_SEARCH_CONFIG = config("PRODUCT_SEARCH_CONFIG", default="english")
+
+# In-process autocomplete index: entry cap, seconds before a worker rebuilds it and
+# how often the worker's refresher thread checks whether it has to
+SUGGEST_INDEX_MAX_ENTRIES = config("SUGGEST_INDEX_MAX_ENTRIES", default=200_000, cast=int)
+SUGGEST_INDEX_MAX_AGE = config("SUGGEST_INDEX_MAX_AGE", default=15 * 60, cast=int)
+SUGGEST_INDEX_POLL_INTERVAL = config("SUGGEST_INDEX_POLL_INTERVAL", default=5, cast=int)
+
+# Product image variants (bounding boxes) and the formats each one is encoded in.
+# Variants are rendered in a process pool; 0 workers renders them inline.
+PRODUCT_IMAGE_VARIANTS = {"thumb": (160, 160), "card": (500, 400), "zoom": (1600, 1600)}
+PRODUCT_IMAGE_FORMATS = ("webp", "jpeg")
+IMAGE_PROCESS_WORKERS = config("IMAGE_PROCESS_WORKERS", default=2, cast=int)
+
 # Static files (CSS, JavaScript, Images)
 # https://docs.djangoproject.com/en/5.2/howto/static-files/
 
@@ -323,3 +409,13 @@ CORS_ALLOW_ALL_ORIGINS = True
 RAZORPAY_KEY_ID = config("RAZORPAY_KEY_ID")
 RAZORPAY_KEY_SECRET = config("RAZORPAY_KEY_SECRET")
 RAZORPAY_WEBHOOK_SECRET=config("RAZORPAY_WEBHOOK_SECRET")
+RAZORPAY_API_URL = config("RAZORPAY_API_URL", default="https://api.razorpay.com/v1")
+# (connect, read) seconds for gateway calls, and keep-alive connections kept per worker
+RAZORPAY_TIMEOUT = (3.05, 10)
+RAZORPAY_POOL_SIZE = config("RAZORPAY_POOL_SIZE", default=4, cast=int)
+
+# Payment outbox worker (orders.outbox): attempts before an order is failed and
+# the backoff between them (doubling from the base, capped at the max), in seconds
+PAYMENT_OUTBOX_MAX_ATTEMPTS = config("PAYMENT_OUTBOX_MAX_ATTEMPTS", default=8, cast=int)
+PAYMENT_OUTBOX_BACKOFF = config("PAYMENT_OUTBOX_BACKOFF", default=2, cast=int)
+PAYMENT_OUTBOX_MAX_BACKOFF = config("PAYMENT_OUTBOX_MAX_BACKOFF", default=5 * 60, cast=int)
@@ -2,6 +2,7 @@ from rest_framework import serializers
 from orders.models import Order, OrderItem
 from store.models import Product
 from accounts.models import Address
+from store.api.serializers import SparseFieldsetMixin
 
 class CreateOrderSerializer(serializers.Serializer):
     address_id = serializers.IntegerField()
@@ -13,9 +14,10 @@ class CreateOrderSerializer(serializers.Serializer):
 # -------------------------------
 # ORDER ITEM SERIALIZER
 # -------------------------------
-class OrderItemSerializer(serializers.ModelSerializer):
+class OrderItemSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     product_name = serializers.CharField(source="product.name", read_only=True)
     product_image = serializers.ImageField(source="product.image", read_only=True)
+    field_relations = {"product_name": "product", "product_image": "product"}
 
     class Meta:
         model = OrderItem
@@ -25,10 +27,11 @@ class OrderItemSerializer(serializers.ModelSerializer):
 # -------------------------------
 # LIGHTWEIGHT ORDER LIST SERIALIZER
 # -------------------------------
-class OrderListSerializer(serializers.ModelSerializer):
+class OrderListSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     total_items = serializers.IntegerField(source="items.count", read_only=True)
     status_display = serializers.CharField(source="get_status_display", read_only=True)
     payment_display = serializers.CharField(source="get_payment_method_display", read_only=True)
+    field_prefetches = {"total_items": "items"}
 
     class Meta:
         model = Order
@@ -47,11 +50,14 @@ class OrderListSerializer(serializers.ModelSerializer):
 # -------------------------------
 # DETAILED ORDER SERIALIZER
 # -------------------------------
-class OrderDetailSerializer(serializers.ModelSerializer):
+class OrderDetailSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     items = OrderItemSerializer(many=True, read_only=True)
     shipping_address = serializers.CharField(source="shipping_address.full_address", read_only=True)
     status_display = serializers.CharField(source="get_status_display", read_only=True)
     payment_display = serializers.CharField(source="get_payment_method_display", read_only=True)
+    expandable_fields = {"items": {"serializer": OrderItemSerializer, "many": True}}
+    default_expand = ("items",)
+    field_relations = {"shipping_address": "shipping_address"}
 
     class Meta:
         model = Order
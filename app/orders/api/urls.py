@@ -1,10 +1,13 @@
 from django.urls import path
-from orders.api.views import CreateOrderAPIView, UserOrderDetailAPIView, UserOrdersAPIView, razorpay_webhook
+from orders.api.views import (
+    CreateOrderAPIView, OrderPaymentStatusAPIView, UserOrderDetailAPIView, UserOrdersAPIView, razorpay_webhook,
+)
 
 urlpatterns = [
     path("create-order/", CreateOrderAPIView.as_view(), name="create-order"),
     path("my-orders/", UserOrdersAPIView.as_view(), name="my-orders"),
     path("my-orders/<int:order_id>/", UserOrderDetailAPIView.as_view(), name="my-order-detail"),
+    path("my-orders/<int:order_id>/payment/", OrderPaymentStatusAPIView.as_view(), name="order-payment-status"),
     path("razorpay/webhook/", razorpay_webhook, name="razorpay_webhook"),
 
 ]
@@ -5,12 +5,12 @@ from rest_framework.permissions import IsAuthenticated
 from rest_framework import status
 from drf_yasg.utils import swagger_auto_schema
 from drf_yasg import openapi
-from store.models import Cart
-from orders.models import Order, OrderItem, Payment
+from orders.models import Order, OrderItem, Payment, PaymentOutbox
+from orders.services import CheckoutError, CheckoutService, OutOfStock, capture_order, fail_order
 from accounts.models import Address
 from django.conf import settings
-import razorpay
 from django.shortcuts import get_object_or_404
+from django.urls import reverse
 
 
 import hmac
@@ -31,9 +31,11 @@ class CreateOrderAPIView(APIView):
         operation_description="Place an order using the selected address and payment method.",
         request_body=CreateOrderSerializer,
         responses={
-            201: openapi.Response(description="Order successfully created"),
+            201: openapi.Response(description="Order successfully created (cash on delivery)"),
+            202: openapi.Response(description="Order created; poll status_url for the Razorpay order"),
             400: openapi.Response(description="Bad Request"),
             404: openapi.Response(description="Address or Cart not found"),
+            409: openapi.Response(description="Not enough stock for some items"),
             500: openapi.Response(description="Server Error"),
         },
     )
@@ -51,81 +53,25 @@ class CreateOrderAPIView(APIView):
         except Address.DoesNotExist:
             return Response({"error": "Invalid address ID!"}, status=status.HTTP_404_NOT_FOUND)
 
-        # Get user's cart
         try:
-            cart = Cart.objects.get(user=user)
-        except Cart.DoesNotExist:
-            return Response({"error": "Cart not found!"}, status=status.HTTP_404_NOT_FOUND)
-
-        if cart.items.count() == 0:
-            return Response({"error": "Cart is empty!"}, status=status.HTTP_400_BAD_REQUEST)
-
-        # Calculate total price
-        total = sum(item.subtotal for item in cart.items.all())
-
-        # Create order
-        order = Order.objects.create(
-            user=user,
-            shipping_address=shipping_address,
-            total_price=total,
-            payment_method=payment_method,
-        )
-
-        # Create order items
-        for item in cart.items.all():
-            OrderItem.objects.create(
-                order=order,
-                product=item.product,
-                quantity=item.quantity,
-                price=item.product.price,
-            )
-
-        # Clear cart after placing order
-        cart.items.all().delete()
+            order = CheckoutService(user, shipping_address, payment_method).place_order()
+        except OutOfStock as e:
+            return Response({"error": e.message, "items": e.shortages}, status=e.status_code)
+        except CheckoutError as e:
+            return Response({"error": e.message}, status=e.status_code)
 
-        # If payment method is Razorpay → create Razorpay order
+        # If payment method is Razorpay → the outbox worker creates the Razorpay order
         if payment_method == "RAZORPAY":
-            client = razorpay.Client(auth=(settings.RAZORPAY_KEY_ID, settings.RAZORPAY_KEY_SECRET))
-
-            payment_data = client.order.create({
-                "amount": int(order.total_price * 100),
-                "currency": "INR",
-                "payment_capture": 1,
-            })
-
-            # Save Razorpay order ID
-            order.razorpay_order_id = payment_data["id"]
-            order.save()
-
-            # Create payment record
-            Payment.objects.create(
-                user=user,
-                order=order,
-                payment_method=payment_method,
-                amount=order.total_price,
-                status="PENDING",
-            )
-
             return Response({
                 "success": True,
                 "payment_type": "ONLINE",
                 "order_id": order.id,
-                "razorpay_order_id": payment_data["id"],
-                "amount": payment_data["amount"],
-                "currency": payment_data["currency"],
-                "razorpay_key": settings.RAZORPAY_KEY_ID
-            }, status=status.HTTP_201_CREATED)
+                "status_url": reverse("order-payment-status", args=[order.id]),
+                "message": "Order placed. Poll status_url for the payment details."
+            }, status=status.HTTP_202_ACCEPTED)
 
-        # If payment method is COD → no Razorpay, just mark as PENDING
+        # If payment method is COD → no Razorpay; the PENDING payment is collected later
         else:
-            Payment.objects.create(
-                user=user,
-                order=order,
-                payment_method=payment_method,
-                amount=order.total_price,
-                status="PENDING",  # COD payments are collected later
-            )
-
             return Response({
                 "success": True,
                 "payment_type": "COD",
@@ -140,6 +86,70 @@ class CreateOrderAPIView(APIView):
 
 
 
+# -------------------------------
+# ORDER PAYMENT STATUS API
+# -------------------------------
+class OrderPaymentStatusAPIView(APIView):
+    permission_classes = [IsAuthenticated]
+    # Seconds a client should wait before polling again
+    RETRY_AFTER = 1
+
+    @swagger_auto_schema(
+        operation_summary="Get Order Payment Status",
+        operation_description="Poll after placing an online order until its Razorpay order has been created.",
+        responses={
+            200: openapi.Response(description="Razorpay order ready, or payment could not be initiated"),
+            202: openapi.Response(description="Razorpay order not created yet; retry after Retry-After seconds"),
+            404: openapi.Response(description="Order not found"),
+        },
+    )
+    def get(self, request, order_id):
+        order = get_object_or_404(
+            Order.objects.select_related("outbox").only(
+                "id", "user_id", "total_price", "payment_method", "status", "razorpay_order_id", "outbox__status"
+            ),
+            id=order_id,
+            user=request.user,
+        )
+        try:
+            outbox_status = order.outbox.status
+        except PaymentOutbox.DoesNotExist:
+            outbox_status = None
+
+        if order.payment_method != "RAZORPAY":
+            return Response({"success": True, "payment_type": "COD", "order_id": order.id, "status": order.status})
+
+        if outbox_status == "PENDING":
+            response = Response({
+                "success": True,
+                "payment_type": "ONLINE",
+                "order_id": order.id,
+                "status": "PENDING",
+            }, status=status.HTTP_202_ACCEPTED)
+            response["Retry-After"] = str(self.RETRY_AFTER)
+            return response
+
+        if not order.razorpay_order_id:
+            return Response({
+                "success": False,
+                "payment_type": "ONLINE",
+                "order_id": order.id,
+                "status": order.status,
+                "error": "Payment could not be initiated. Please place the order again.",
+            }, status=status.HTTP_200_OK)
+
+        return Response({
+            "success": True,
+            "payment_type": "ONLINE",
+            "order_id": order.id,
+            "status": order.status,
+            "razorpay_order_id": order.razorpay_order_id,
+            "amount": int(order.total_price * 100),
+            "currency": "INR",
+            "razorpay_key": settings.RAZORPAY_KEY_ID
+        }, status=status.HTTP_200_OK)
+
+
 # -------------------------------
 # USER ORDERS LIST API
 # -------------------------------
@@ -156,17 +166,14 @@ class UserOrdersAPIView(APIView):
         page = int(request.GET.get("page", 1))
         limit = int(request.GET.get("limit", 5))
 
-        orders_qs = (
-            Order.objects.filter(user=user)
-            .select_related("shipping_address")
-            .prefetch_related("items", "items__product")
-            .order_by("-created_at")
+        orders_qs = OrderListSerializer.optimize_queryset(
+            Order.objects.filter(user=user).order_by("-created_at"), request
         )
 
         paginator = Paginator(orders_qs, limit)
         orders = paginator.get_page(page)
 
-        serializer = OrderListSerializer(orders, many=True)
+        serializer = OrderListSerializer(orders, many=True, context={"request": request})
 
         return Response({
             "success": True,
@@ -191,13 +198,12 @@ class UserOrderDetailAPIView(APIView):
     def get(self, request, order_id):
         user = request.user
         order = get_object_or_404(
-            Order.objects.select_related("shipping_address")
-            .prefetch_related("items", "items__product"),
+            OrderDetailSerializer.optimize_queryset(Order.objects.all(), request),
             id=order_id,
             user=user
         )
 
-        serializer = OrderDetailSerializer(order)
+        serializer = OrderDetailSerializer(order, context={"request": request})
         return Response({
             "success": True,
             "order": serializer.data
@@ -224,7 +230,7 @@ def razorpay_webhook(request):
         digestmod=hashlib.sha256
     ).hexdigest()
 
-    if received_signature != generated_signature:
+    if not hmac.compare_digest(received_signature or "", generated_signature):
         return JsonResponse({"error": "Invalid signature"}, status=400)
 
     # Parse webhook payload
@@ -234,32 +240,18 @@ def razorpay_webhook(request):
 
     # Extract payment details
     razorpay_payment_id = payment_data.get("id")
-    amount = payment_data.get("amount") / 100
-    status = payment_data.get("status")
     order_id = payment_data.get("order_id")  # Razorpay order ID
 
-    try:
-        payment = Payment.objects.get(razorpay_payment_id=razorpay_payment_id)
-    except Payment.DoesNotExist:
-        return JsonResponse({"error": "Payment not found"}, status=404)
+    # Payment rows don't know the Razorpay ids; the order carries the one we created
+    order = Order.objects.filter(razorpay_order_id=order_id).only("id").first() if order_id else None
+    if order is None:
+        return JsonResponse({"error": "Order not found"}, status=404)
 
-    # Handle events
+    # Handle events; both are idempotent, Razorpay retries deliveries
     if event == "payment.captured":
-        payment.status = "SUCCESS"
-        payment.save()
-
-        # Update Order Status
-        order = Order.objects.get(id=payment.order.id)
-        order.status = "CONFIRMED"
-        order.save()
+        capture_order(order.id, razorpay_payment_id)
 
     elif event == "payment.failed":
-        payment.status = "FAILED"
-        payment.save()
-
-        # Update Order Status
-        order = Order.objects.get(id=payment.order.id)
-        order.status = "FAILED"
-        order.save()
+        fail_order(order.id)
 
     return JsonResponse({"status": "ok"}, status=200)
@@ -0,0 +1,55 @@
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+
+class GatewayError(Exception):
+    def __init__(self, message, retryable=True):
+        super().__init__(message)
+        self.retryable = retryable
+
+
+class RazorpayGateway:
+    """
+    Minimal Razorpay Orders API client on one requests.Session, so calls
+    reuse pooled keep-alive connections instead of a new TLS handshake
+    each, and every call has a connect and read timeout.
+    """
+
+    def __init__(self, base_url, key_id, key_secret, timeout=None, pool_size=None):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout or settings.RAZORPAY_TIMEOUT
+        self.session = requests.Session()
+        self.session.auth = (key_id, key_secret)
+        # Retries are the outbox's job, with backoff; the adapter must not retry on its own
+        adapter = HTTPAdapter(pool_maxsize=pool_size or settings.RAZORPAY_POOL_SIZE, max_retries=0)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def create_order(self, amount, currency, receipt):
+        """Create a gateway order for amount (in paise); returns the order entity."""
+        try:
+            response = self.session.post(
+                f"{self.base_url}/orders",
+                json={"amount": amount, "currency": currency, "receipt": receipt, "payment_capture": 1},
+                timeout=self.timeout,
+            )
+        except requests.RequestException as exc:
+            raise GatewayError(f"{type(exc).__name__}: {exc}")
+        if response.status_code == 429 or response.status_code >= 500:
+            raise GatewayError(f"HTTP {response.status_code}: {response.text[:200]}")
+        if response.status_code >= 400:
+            # A rejected request fails the same way every time
+            raise GatewayError(f"HTTP {response.status_code}: {response.text[:200]}", retryable=False)
+        return response.json()
+
+
+_gateways = {}
+
+
+def get_gateway():
+    """The process's gateway client for the configured account."""
+    key = (settings.RAZORPAY_API_URL, settings.RAZORPAY_KEY_ID, settings.RAZORPAY_KEY_SECRET)
+    if key not in _gateways:
+        _gateways[key] = RazorpayGateway(*key)
+    return _gateways[key]
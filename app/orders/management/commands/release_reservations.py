@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from orders.services import release_expired_reservations
+
+
+class Command(BaseCommand):
+    help = "Cancel unpaid online orders whose stock holds expired and free the stock (run every minute or so)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500, help="Orders released per transaction")
+
+    def handle(self, *args, **options):
+        cancelled = release_expired_reservations(options["batch_size"])
+        self.stdout.write(self.style.SUCCESS(f"Released the stock of {cancelled} expired orders"))
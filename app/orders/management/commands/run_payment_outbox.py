@@ -0,0 +1,31 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from orders.outbox import process_outbox
+
+
+class Command(BaseCommand):
+    help = "Create the Razorpay orders of new online orders from the payment outbox (long-running worker)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--once", action="store_true", help="Work off one batch and exit")
+        parser.add_argument("--batch-size", type=int, default=50, help="Entries claimed per round")
+        parser.add_argument(
+            "--workers", type=int, default=settings.RAZORPAY_POOL_SIZE, help="Concurrent gateway calls per round"
+        )
+        parser.add_argument("--interval", type=float, default=1.0, help="Seconds to sleep when nothing is due")
+
+    def handle(self, *args, **options):
+        while True:
+            counts = process_outbox(options["batch_size"], options["workers"])
+            if counts:
+                self.stdout.write(", ".join(f"{status.lower()}: {n}" for status, n in sorted(counts.items())))
+            if options["once"]:
+                break
+            if not counts:
+                time.sleep(options["interval"])
+            # Like a request boundary: drop broken or expired connections between rounds
+            close_old_connections()
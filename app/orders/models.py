@@ -59,6 +59,29 @@ class OrderItem(TimeStampModel):
     
 
 
+# --------------------------
+# STOCK RESERVATION MODEL
+# --------------------------
+class StockReservation(models.Model):
+    """
+    Units held for an unpaid online order until expires_at. The sum of the
+    active holds of a product is mirrored in Product.reserved_quantity, so
+    reading what is available never has to aggregate this table.
+    """
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name="reservations")
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name="reservations")
+    quantity = models.PositiveIntegerField()
+    expires_at = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=["order", "product"], name="unique_order_reservation")]
+        indexes = [models.Index(fields=["expires_at"], name="reservation_expiry")]
+
+    def __str__(self):
+        return f"{self.quantity} x {self.product_id} for order {self.order_id}"
+
+
 # --------------------------
 # PAYMENT MODEL
 # --------------------------
@@ -78,3 +101,31 @@ class Payment(TimeStampModel):
 
     def __str__(self):
         return f"Payment {self.id} - {self.status}"
+
+
+# --------------------------
+# PAYMENT OUTBOX MODEL
+# --------------------------
+class PaymentOutbox(TimeStampModel):
+    """
+    A gateway order still to be created for an online order. Written in the
+    checkout transaction and worked off by the payment outbox worker
+    (orders.outbox), so the checkout request never waits on Razorpay.
+    """
+    STATUS_CHOICES = (
+        ("PENDING", "Pending"),
+        ("DONE", "Done"),
+        ("FAILED", "Failed"),
+    )
+
+    order = models.OneToOneField(Order, on_delete=models.CASCADE, related_name="outbox")
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default="PENDING")
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField()
+    last_error = models.TextField(blank=True, default="")
+
+    class Meta:
+        indexes = [models.Index(fields=["status", "next_attempt_at"], name="outbox_due")]
+
+    def __str__(self):
+        return f"Outbox {self.order_id} - {self.status}"
@@ -0,0 +1,102 @@
+import logging
+import random
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from orders.gateway import GatewayError, get_gateway
+from orders.models import Order, PaymentOutbox
+from orders.services import fail_order
+
+logger = logging.getLogger(__name__)
+
+# A claimed entry is hidden from other workers this long; longer than any gateway call
+CLAIM_LEASE = timedelta(seconds=60)
+
+
+def backoff(attempts):
+    """Seconds before retry number attempts + 1: doubling, capped, with jitter."""
+    delay = min(settings.PAYMENT_OUTBOX_BACKOFF * 2 ** (attempts - 1), settings.PAYMENT_OUTBOX_MAX_BACKOFF)
+    return delay * random.uniform(0.8, 1.2)
+
+
+def claim(batch_size, now):
+    """Take up to batch_size due entries and lease them, skipping ones another worker holds."""
+    with transaction.atomic():
+        entries = list(
+            PaymentOutbox.objects.select_for_update(skip_locked=True, of=("self",))
+            .select_related("order")
+            .filter(status="PENDING", next_attempt_at__lte=now)
+            .order_by("next_attempt_at")[:batch_size]
+        )
+        PaymentOutbox.objects.filter(pk__in=[entry.pk for entry in entries]).update(
+            attempts=F("attempts") + 1, next_attempt_at=now + CLAIM_LEASE
+        )
+    for entry in entries:
+        entry.attempts += 1
+    return entries
+
+
+def deliver(entry):
+    """Create the gateway order of one entry and record the outcome. Returns the entry's new status."""
+    order = entry.order
+    if order.status != "PENDING":
+        # Cancelled meanwhile, e.g. its stock hold expired while the gateway was down
+        return finish(entry, "FAILED", f"order is {order.status}")
+    try:
+        data = get_gateway().create_order(
+            amount=int(order.total_price * 100), currency="INR", receipt=f"order-{order.pk}"
+        )
+    except GatewayError as exc:
+        if exc.retryable and entry.attempts < settings.PAYMENT_OUTBOX_MAX_ATTEMPTS:
+            PaymentOutbox.objects.filter(pk=entry.pk).update(
+                next_attempt_at=timezone.now() + timedelta(seconds=backoff(entry.attempts)),
+                last_error=str(exc),
+                updated_at=timezone.now(),
+            )
+            return "PENDING"
+        logger.warning("Giving up on the gateway order of order %s: %s", order.pk, exc)
+        fail_order(order.pk)
+        return finish(entry, "FAILED", str(exc))
+
+    with transaction.atomic():
+        # The sweeper may have cancelled the order and freed its stock during the call;
+        # then the gateway order must not reach the client
+        updated = Order.objects.filter(pk=order.pk, status="PENDING").update(
+            razorpay_order_id=data["id"], updated_at=timezone.now()
+        )
+        if not updated:
+            status = Order.objects.filter(pk=order.pk).values_list("status", flat=True).first()
+            return finish(entry, "FAILED", f"order is {status} (gateway order {data['id']} unused)")
+        return finish(entry, "DONE")
+
+
+def finish(entry, status, error=""):
+    PaymentOutbox.objects.filter(pk=entry.pk).update(status=status, last_error=error, updated_at=timezone.now())
+    return status
+
+
+def deliver_in_thread(entry):
+    try:
+        return deliver(entry)
+    finally:
+        connection.close()
+
+
+def process_outbox(batch_size=50, workers=1, now=None):
+    """
+    Work off one batch of due entries and return {status: count}. With
+    workers > 1 the gateway calls of the batch run concurrently, sharing
+    the gateway's connection pool.
+    """
+    entries = claim(batch_size, now or timezone.now())
+    if workers > 1 and len(entries) > 1:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            statuses = list(pool.map(deliver_in_thread, entries))
+    else:
+        statuses = [deliver(entry) for entry in entries]
+    return {status: statuses.count(status) for status in set(statuses)}
@@ -0,0 +1,261 @@
+import logging
+from collections import Counter
+from datetime import timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Value, When
+from django.db.models.functions import Now
+from django.utils import timezone
+
+from orders.models import Order, OrderItem, Payment, PaymentOutbox, StockReservation
+from store.cards import refresh_product_cards
+from store.models import Cart, CartItem, Product
+from store.services import cart_summary_cache, product_detail_cache
+
+logger = logging.getLogger(__name__)
+
+
+class CheckoutError(Exception):
+    status_code = 400
+
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.message = message
+        if status_code is not None:
+            self.status_code = status_code
+
+
+class OutOfStock(CheckoutError):
+    status_code = 409
+
+    def __init__(self, shortages):
+        super().__init__("Some items are no longer available in the requested quantity.")
+        # [{"product_id", "name", "requested", "available"}]
+        self.shortages = shortages
+
+
+def per_product(quantities):
+    """CASE expression giving each product's amount from {product_id: n}."""
+    return Case(
+        *[When(pk=product_id, then=Value(quantity)) for product_id, quantity in quantities.items()],
+        output_field=IntegerField(),
+    )
+
+
+def decrement_stock(quantities):
+    """
+    Take {product_id: n} out of stock with one conditional UPDATE:
+        quantity = quantity - n WHERE quantity - reserved_quantity >= n
+    Returns whether every product had enough. updated_at moves too, so the
+    detail validators (ETag, Last-Modified) change with the stock.
+    """
+    needed = per_product(quantities)
+    updated = Product.objects.filter(
+        pk__in=list(quantities), is_active=True, quantity__gte=F("reserved_quantity") + needed
+    ).update(quantity=F("quantity") - needed, updated_at=Now())
+    return updated == len(quantities)
+
+
+def reserve_stock(quantities):
+    """Hold {product_id: n} the same way: reserved_quantity + n, only where that much is available."""
+    needed = per_product(quantities)
+    updated = Product.objects.filter(
+        pk__in=list(quantities), is_active=True, quantity__gte=F("reserved_quantity") + needed
+    ).update(reserved_quantity=F("reserved_quantity") + needed, updated_at=Now())
+    return updated == len(quantities)
+
+
+def settle_holds(holds, take=False):
+    """
+    Drop the holds [(product_id, n)] from reserved_quantity in one UPDATE;
+    with take, the units leave stock as well (a captured payment).
+    """
+    quantities = Counter()
+    for product_id, quantity in holds:
+        quantities[product_id] += quantity
+    if not quantities:
+        return []
+    released = per_product(quantities)
+    changes = {"reserved_quantity": F("reserved_quantity") - released, "updated_at": Now()}
+    if take:
+        changes["quantity"] = F("quantity") - released
+    Product.objects.filter(pk__in=list(quantities)).update(**changes)
+    return list(quantities)
+
+
+def stock_changed(product_ids):
+    # The stock UPDATEs bypass Product signals: refresh what is derived from stock
+    refresh_product_cards(product_ids)
+    for pk in product_ids:
+        product_detail_cache.bump(pk)
+
+
+class CheckoutService:
+    """
+    Turn a user's cart into an order in one transaction: stock is taken
+    (cash on delivery) or held until the payment is captured (online) with
+    a conditional UPDATE, the order items are bulk inserted and the cart is
+    emptied, or nothing happens at all. Concurrent checkouts of the last
+    units can't both succeed; the loser gets OutOfStock. Online orders also
+    get a PaymentOutbox entry in the same transaction; the gateway order is
+    created later by the outbox worker, never inside the request.
+    """
+
+    def __init__(self, user, shipping_address, payment_method):
+        self.user = user
+        self.shipping_address = shipping_address
+        self.payment_method = payment_method
+
+    def place_order(self):
+        with transaction.atomic():
+            # A double-submitted checkout waits here and then finds the cart empty
+            cart = Cart.objects.select_for_update().filter(user=self.user).first()
+            if cart is None:
+                raise CheckoutError("Cart not found!", status_code=404)
+            quantities = dict(CartItem.objects.filter(cart=cart).values_list("product_id", "quantity"))
+            if not quantities:
+                raise CheckoutError("Cart is empty!")
+
+            products = self.lock_products(quantities)
+            self.check_stock(quantities, products)
+            # Online payments only hold the stock until they are captured
+            take = reserve_stock if self.payment_method == "RAZORPAY" else decrement_stock
+            if not take(quantities):
+                # check_stock saw enough under the row locks, so this can't happen
+                raise CheckoutError("Stock changed during checkout, please retry.", status_code=409)
+
+            prices = {pk: Decimal(str(product["price"])).quantize(Decimal("0.01")) for pk, product in products.items()}
+            order = Order.objects.create(
+                user=self.user,
+                shipping_address=self.shipping_address,
+                total_price=sum(prices[pk] * quantity for pk, quantity in quantities.items()),
+                payment_method=self.payment_method,
+            )
+            OrderItem.objects.bulk_create([
+                OrderItem(order=order, product_id=pk, quantity=quantity, price=prices[pk])
+                for pk, quantity in sorted(quantities.items())
+            ])
+            if self.payment_method == "RAZORPAY":
+                expires_at = timezone.now() + timedelta(seconds=settings.STOCK_RESERVATION_TTL)
+                StockReservation.objects.bulk_create([
+                    StockReservation(order=order, product_id=pk, quantity=quantity, expires_at=expires_at)
+                    for pk, quantity in sorted(quantities.items())
+                ])
+                PaymentOutbox.objects.create(order=order, next_attempt_at=timezone.now())
+            # Through the related manager the deleted items carry their cart, so the
+            # CartItem signal needs no owner lookup per row; stock_changed invalidates the summary
+            cart.items.all().delete()
+            Payment.objects.create(
+                user=self.user,
+                order=order,
+                payment_method=self.payment_method,
+                amount=order.total_price,
+                status="PENDING",
+            )
+            transaction.on_commit(lambda: self.stock_changed(list(quantities)))
+        return order
+
+    def lock_products(self, quantities):
+        # Locked in id order, so two checkouts sharing products can't deadlock
+        rows = (
+            Product.objects.select_for_update()
+            .filter(pk__in=list(quantities))
+            .order_by("pk")
+            .values("pk", "name", "price", "quantity", "reserved_quantity", "is_active")
+        )
+        return {row["pk"]: row for row in rows}
+
+    def check_stock(self, quantities, products):
+        shortages = []
+        for product_id, requested in sorted(quantities.items()):
+            product = products.get(product_id)
+            available = product["quantity"] - product["reserved_quantity"] if product and product["is_active"] else 0
+            if available < requested:
+                shortages.append({
+                    "product_id": product_id,
+                    "name": product["name"] if product else None,
+                    "requested": requested,
+                    "available": available,
+                })
+        if shortages:
+            raise OutOfStock(shortages)
+
+    def stock_changed(self, product_ids):
+        stock_changed(product_ids)
+        cart_summary_cache.invalidate(self.user.pk)
+
+
+def capture_order(order_id, payment_id=None):
+    """
+    The payment of an online order was captured: its holds become real
+    stock decrements and the order is paid. Safe to call more than once.
+    """
+    with transaction.atomic():
+        order = Order.objects.select_for_update().filter(pk=order_id).first()
+        if order is None or order.is_paid:
+            return order
+        holds = list(order.reservations.values_list("product_id", "quantity"))
+        if holds:
+            product_ids = settle_holds(holds, take=True)
+            order.reservations.all().delete()
+        else:
+            # The hold ran out before the money came in; take what is still there
+            quantities = dict(order.items.values_list("product_id", "quantity"))
+            product_ids = list(quantities)
+            if not decrement_stock(quantities):
+                logger.warning("Order %s was paid after its stock hold expired and is oversold", order.pk)
+        order.status = "PAID"
+        order.is_paid = True
+        order.razorpay_payment_id = payment_id or order.razorpay_payment_id
+        order.save(update_fields=["status", "is_paid", "razorpay_payment_id", "updated_at"])
+        Payment.objects.filter(order=order).update(status="SUCCESS", payment_id=order.razorpay_payment_id)
+        transaction.on_commit(lambda: stock_changed(product_ids))
+    return order
+
+
+def fail_order(order_id, status="FAILED"):
+    """The payment failed or never came: free the holds and close the order."""
+    with transaction.atomic():
+        order = Order.objects.select_for_update().filter(pk=order_id, status="PENDING").first()
+        if order is None:
+            return None
+        product_ids = settle_holds(order.reservations.values_list("product_id", "quantity"))
+        order.reservations.all().delete()
+        order.status = status
+        order.save(update_fields=["status", "updated_at"])
+        Payment.objects.filter(order=order).update(status="FAILED")
+        transaction.on_commit(lambda: stock_changed(product_ids))
+    return order
+
+
+def release_expired_reservations(batch_size=500, now=None):
+    """
+    Cancel the unpaid orders whose holds expired, batch_size orders per
+    transaction, and return how many were cancelled. Orders being captured
+    right now are locked and skipped; their capture wins.
+    """
+    now = now or timezone.now()
+    cancelled = 0
+    while True:
+        with transaction.atomic():
+            expired = (
+                StockReservation.objects.filter(expires_at__lte=now)
+                .order_by("expires_at")
+                .values_list("order_id", flat=True)[:batch_size]
+            )
+            order_ids = list(
+                Order.objects.select_for_update(skip_locked=True)
+                .filter(pk__in=set(expired), status="PENDING")
+                .values_list("pk", flat=True)
+            )
+            if not order_ids:
+                return cancelled
+            holds = StockReservation.objects.filter(order_id__in=order_ids)
+            product_ids = settle_holds(holds.values_list("product_id", "quantity"))
+            holds.delete()
+            Order.objects.filter(pk__in=order_ids).update(status="CANCELLED", updated_at=now)
+            Payment.objects.filter(order_id__in=order_ids).update(status="FAILED", updated_at=now)
+            transaction.on_commit(lambda product_ids=product_ids: stock_changed(product_ids))
+        cancelled += len(order_ids)
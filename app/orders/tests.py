@@ -1,3 +1,374 @@
-from django.test import TestCase
+import hashlib
+import io
+import hmac
+import json
+import threading
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 
-# Create your tests here.
+from django.db import connection
+from django.core.management import call_command
+from django.test import TestCase, TransactionTestCase, override_settings, skipUnlessDBFeature
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from accounts.models import Address, User
+from orders.models import Order, OrderItem, Payment, PaymentOutbox, StockReservation
+from orders.outbox import claim, deliver, process_outbox
+from orders.services import CheckoutService, OutOfStock, capture_order
+from store.models import Cart, CartItem, Category, Product, ProductCard, SubCategory
+
+
+class CheckoutFixture:
+    """A small catalog and helpers to give a user a filled cart."""
+
+    def make_catalog(self, stock=10):
+        self.category = Category.objects.create(name="Medicines")
+        self.sub_category = SubCategory.objects.create(name="Tablets", category=self.category)
+        self.products = [
+            Product.objects.create(
+                name=f"Paracetamol {i}", sku=f"PARA-{i}", price=10 + i, quantity=stock, description="",
+                category=self.category, sub_category=self.sub_category,
+            )
+            for i in range(3)
+        ]
+
+    def make_customer(self, mobile, items):
+        user = User.objects.create_user(mobile=mobile, password=None)
+        address = Address.objects.create(
+            user=user, name="A", phone=mobile, pincode="110001", address="x", city="Delhi", state="Delhi"
+        )
+        cart = Cart.objects.create(user=user)
+        CartItem.objects.bulk_create([CartItem(cart=cart, product=product, quantity=n) for product, n in items])
+        return user, address
+
+
+class CheckoutTests(CheckoutFixture, TestCase):
+
+    def setUp(self):
+        self.make_catalog()
+        first, second, _ = self.products
+        self.user, self.address = self.make_customer("9100000000", [(first, 2), (second, 10)])
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def checkout(self):
+        return self.client.post(reverse("create-order"), {"address_id": self.address.id, "payment_method": "COD"}, format="json")
+
+    def test_checkout_takes_stock_and_empties_the_cart(self):
+        first, second, _ = self.products
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.checkout()
+        self.assertEqual(response.status_code, 201)
+
+        order = Order.objects.get(pk=response.json()["order_id"])
+        self.assertEqual(order.total_price, 2 * 10 + 10 * 11)
+        self.assertEqual(
+            list(order.items.order_by("product_id").values_list("product_id", "quantity", "price")),
+            [(first.id, 2, 10), (second.id, 10, 11)],
+        )
+        self.assertEqual(Payment.objects.get(order=order).amount, order.total_price)
+        self.assertFalse(CartItem.objects.exists())
+        self.assertEqual(dict(Product.objects.values_list("id", "quantity"))[first.id], 8)
+        # The UPDATE bypasses signals; the listing card still learns about it
+        self.assertFalse(ProductCard.objects.get(pk=second.id).in_stock)
+
+        self.assertEqual(self.checkout().status_code, 400)  # cart is empty now
+
+    def test_checkout_changes_the_product_detail_validators(self):
+        first = self.products[0]
+        url = reverse("product-detail", args=[first.id])
+        before = self.client.get(url)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.checkout()
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=before["ETag"])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["quantity"], 8)
+        self.assertNotEqual(response["ETag"], before["ETag"])
+
+    def test_query_count_does_not_grow_with_the_cart(self):
+        def queries():
+            with self.assertNumQueries(11):
+                CheckoutService(self.user, self.address, "COD").place_order()
+
+        queries()
+        first, _, third = self.products
+        CartItem.objects.bulk_create([CartItem(cart=self.user.cart, product=product) for product in (first, third)])
+        queries()
+
+    def test_shortage_changes_nothing(self):
+        first, second, _ = self.products
+        Product.objects.filter(pk=second.pk).update(quantity=9)
+        response = self.checkout()
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()["items"], [
+            {"product_id": second.id, "name": second.name, "requested": 10, "available": 9},
+        ])
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(CartItem.objects.count(), 2)
+        self.assertEqual(dict(Product.objects.values_list("id", "quantity"))[first.id], 10)
+
+
+@override_settings(RAZORPAY_WEBHOOK_SECRET="whsec")
+class StockReservationTests(CheckoutFixture, TestCase):
+
+    def setUp(self):
+        self.make_catalog(stock=5)
+        self.product = self.products[0]
+
+    def place_online_order(self, mobile, quantity):
+        user, address = self.make_customer(mobile, [(self.product, quantity)])
+        with self.captureOnCommitCallbacks(execute=True):
+            return CheckoutService(user, address, "RAZORPAY").place_order()
+
+    def stock(self):
+        product = Product.objects.get(pk=self.product.pk)
+        return product.quantity, product.reserved_quantity
+
+    def webhook(self, event, order):
+        body = json.dumps({
+            "event": event,
+            "payload": {"payment": {"entity": {"id": "pay_1", "order_id": order.razorpay_order_id, "amount": 1000}}},
+        })
+        signature = hmac.new(b"whsec", body.encode(), hashlib.sha256).hexdigest()
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(
+                reverse("razorpay_webhook"), body, content_type="application/json", HTTP_X_RAZORPAY_SIGNATURE=signature
+            )
+
+    def test_online_orders_hold_stock_until_captured(self):
+        order = self.place_online_order("9300000000", 3)
+        self.assertEqual(self.stock(), (5, 3))
+        self.assertEqual(Product.objects.get(pk=self.product.pk).available_quantity, 2)
+        with self.assertRaises(OutOfStock):
+            self.place_online_order("9300000001", 3)
+
+        Order.objects.filter(pk=order.pk).update(razorpay_order_id="order_1")
+        order.refresh_from_db()
+        self.assertEqual(self.webhook("payment.captured", order).status_code, 200)
+        self.assertEqual(self.stock(), (2, 0))
+        order.refresh_from_db()
+        self.assertEqual((order.status, order.is_paid, order.razorpay_payment_id), ("PAID", True, "pay_1"))
+        self.assertEqual(Payment.objects.get(order=order).status, "SUCCESS")
+        self.assertFalse(StockReservation.objects.exists())
+
+        # a redelivered webhook changes nothing
+        capture_order(order.pk, "pay_1")
+        self.assertEqual(self.stock(), (2, 0))
+
+    def test_holds_survive_saves_of_stale_instances(self):
+        stale = Product.objects.get(pk=self.product.pk)
+        url = reverse("product-detail", args=[self.product.pk])
+        before = self.client.get(url)
+        self.place_online_order("9300000003", 2)
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=before["ETag"])
+        self.assertEqual((response.status_code, response.json()["available_quantity"]), (200, 3))
+
+        stale.name = "Renamed"
+        stale.save()  # e.g. an admin edit of a form loaded before the hold
+        self.assertEqual(self.stock(), (5, 2))
+        self.assertEqual(Product.objects.get(pk=self.product.pk).name, "Renamed")
+
+    def test_failed_payment_frees_the_hold(self):
+        order = self.place_online_order("9300000002", 4)
+        Order.objects.filter(pk=order.pk).update(razorpay_order_id="order_2")
+        order.refresh_from_db()
+        self.webhook("payment.failed", order)
+        self.assertEqual(self.stock(), (5, 0))
+        self.assertEqual(Order.objects.get(pk=order.pk).status, "FAILED")
+
+    def test_sweeper_releases_expired_holds(self):
+        orders = [self.place_online_order(f"930000001{i}", 1) for i in range(3)]
+        StockReservation.objects.filter(order__in=orders[:2]).update(expires_at=timezone.now() - timedelta(seconds=1))
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command("release_reservations", batch_size=1, stdout=io.StringIO())
+        self.assertEqual(self.stock(), (5, 1))
+        self.assertEqual(
+            list(Order.objects.order_by("pk").values_list("status", flat=True)), ["CANCELLED", "CANCELLED", "PENDING"]
+        )
+        self.assertTrue(ProductCard.objects.get(pk=self.product.pk).in_stock)
+
+
+class StubGateway:
+    """
+    A local stand-in for the Razorpay Orders API. Answers POST /orders with
+    the queued (status, body) responses, then with a created order, and
+    records each request with the client port it came from.
+    """
+
+    def __init__(self):
+        self.responses = []
+        self.requests = []
+        gateway = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # keep-alive
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                gateway.requests.append({"body": body, "auth": self.headers["Authorization"], "port": self.client_address[1]})
+                status, payload = gateway.responses.pop(0) if gateway.responses else (
+                    200, {"id": f"order_stub{len(gateway.requests)}", "amount": body["amount"], "currency": body["currency"]}
+                )
+                data = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}/v1"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@override_settings(RAZORPAY_KEY_ID="rzp_test", RAZORPAY_KEY_SECRET="secret", PAYMENT_OUTBOX_MAX_ATTEMPTS=3)
+class PaymentOutboxTests(CheckoutFixture, TestCase):
+
+    def setUp(self):
+        self.gateway = StubGateway()
+        self.addCleanup(self.gateway.stop)
+        gateway_settings = override_settings(RAZORPAY_API_URL=self.gateway.url)
+        gateway_settings.enable()
+        self.addCleanup(gateway_settings.disable)
+        self.make_catalog(stock=5)
+        self.product = self.products[0]
+
+    def place_online_order(self, mobile, quantity=2):
+        user, address = self.make_customer(mobile, [(self.product, quantity)])
+        self.client = APIClient()
+        self.client.force_authenticate(user)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                reverse("create-order"), {"address_id": address.id, "payment_method": "RAZORPAY"}, format="json"
+            )
+        self.assertEqual(response.status_code, 202)
+        return Order.objects.get(pk=response.data["order_id"]), response
+
+    def poll(self, order):
+        return self.client.get(reverse("order-payment-status", args=[order.pk]))
+
+    def outbox(self, order):
+        return PaymentOutbox.objects.get(order=order)
+
+    def test_checkout_answers_before_the_gateway_and_the_worker_creates_the_order(self):
+        order, response = self.place_online_order("9400000000")
+        self.assertEqual(response.data["status_url"], reverse("order-payment-status", args=[order.pk]))
+        self.assertEqual(self.gateway.requests, [])
+        self.assertEqual(self.poll(order).status_code, 202)
+
+        call_command("run_payment_outbox", once=True, workers=1, stdout=io.StringIO())
+        response = self.poll(order)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            {key: response.data[key] for key in ("razorpay_order_id", "amount", "currency", "razorpay_key")},
+            {"razorpay_order_id": "order_stub1", "amount": 2000, "currency": "INR", "razorpay_key": "rzp_test"},
+        )
+        self.assertEqual(self.gateway.requests[0]["body"]["receipt"], f"order-{order.pk}")
+        self.assertTrue(self.gateway.requests[0]["auth"].startswith("Basic "))
+        self.assertEqual((self.outbox(order).status, self.outbox(order).attempts), ("DONE", 1))
+
+        # the next call reuses the pooled keep-alive connection
+        second, _ = self.place_online_order("9400000001")
+        process_outbox()
+        self.assertEqual(Order.objects.get(pk=second.pk).razorpay_order_id, "order_stub2")
+        self.assertEqual(len({request["port"] for request in self.gateway.requests}), 1)
+
+    def test_gateway_errors_are_retried_with_backoff(self):
+        order, _ = self.place_online_order("9400000002")
+        self.gateway.responses = [(500, {"error": "down"}), (429, {"error": "slow down"})]
+
+        self.assertEqual(process_outbox(), {"PENDING": 1})
+        entry = self.outbox(order)
+        self.assertEqual((entry.status, entry.attempts), ("PENDING", 1))
+        self.assertIn("HTTP 500", entry.last_error)
+        # not due again before the backoff has passed
+        self.assertEqual(process_outbox(), {})
+
+        self.assertEqual(process_outbox(now=entry.next_attempt_at), {"PENDING": 1})
+        entry = self.outbox(order)
+        delay = (entry.next_attempt_at - entry.updated_at).total_seconds()
+        self.assertTrue(3 <= delay <= 5, delay)  # 2s doubled, +-20% jitter
+
+        self.assertEqual(process_outbox(now=entry.next_attempt_at), {"DONE": 1})
+        self.assertEqual(Order.objects.get(pk=order.pk).razorpay_order_id, "order_stub3")
+
+    def test_giving_up_fails_the_order_and_frees_the_hold(self):
+        order, _ = self.place_online_order("9400000003")
+        self.gateway.responses = [(503, {})] * 3
+        for _ in range(3):
+            with self.captureOnCommitCallbacks(execute=True):
+                process_outbox(now=timezone.now() + timedelta(hours=1))
+
+        self.assertEqual((self.outbox(order).status, self.outbox(order).attempts), ("FAILED", 3))
+        self.assertEqual(Order.objects.get(pk=order.pk).status, "FAILED")
+        product = Product.objects.get(pk=self.product.pk)
+        self.assertEqual((product.quantity, product.reserved_quantity), (5, 0))
+        response = self.poll(order)
+        self.assertEqual((response.status_code, response.data["success"]), (200, False))
+
+    def test_order_cancelled_during_the_call_gets_no_gateway_order(self):
+        order, _ = self.place_online_order("9400000005")
+        [entry] = claim(10, timezone.now())
+        # the sweeper cancels the order while the gateway call is in flight
+        Order.objects.filter(pk=order.pk).update(status="CANCELLED")
+
+        self.assertEqual(deliver(entry), "FAILED")
+        self.assertIsNone(Order.objects.get(pk=order.pk).razorpay_order_id)
+        self.assertIn("order is CANCELLED", self.outbox(order).last_error)
+        self.assertEqual(self.poll(order).data["success"], False)
+
+    def test_rejected_requests_are_not_retried(self):
+        order, _ = self.place_online_order("9400000004")
+        self.gateway.responses = [(400, {"error": {"code": "BAD_REQUEST_ERROR"}})]
+        self.assertEqual(process_outbox(), {"FAILED": 1})
+        self.assertEqual(len(self.gateway.requests), 1)
+        self.assertEqual(Order.objects.get(pk=order.pk).status, "FAILED")
+
+
+@skipUnlessDBFeature("has_select_for_update")
+class ConcurrentCheckoutTests(CheckoutFixture, TransactionTestCase):
+    """Many customers race for a product with little stock; it must never go negative."""
+    customers = 12
+    stock = 5
+
+    def test_parallel_checkouts_do_not_oversell(self):
+        self.make_catalog(stock=self.stock)
+        product = self.products[0]
+        customers = [
+            self.make_customer(f"92000000{i:02d}", [(product, 1)]) for i in range(self.customers)
+        ]
+        start = threading.Barrier(self.customers)
+        results = []
+
+        def checkout(user, address):
+            try:
+                start.wait()
+                CheckoutService(user, address, "COD").place_order()
+                results.append("ok")
+            except OutOfStock:
+                results.append("out of stock")
+            except Exception as exc:  # surfaced by the assertion below
+                results.append(repr(exc))
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=checkout, args=customer) for customer in customers]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(sorted(results), ["ok"] * self.stock + ["out of stock"] * (self.customers - self.stock))
+        self.assertEqual(Product.objects.get(pk=product.pk).quantity, 0)
+        self.assertEqual(OrderItem.objects.filter(product=product).count(), self.stock)
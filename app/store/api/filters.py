@@ -0,0 +1,41 @@
+import django_filters
+from rest_framework.filters import BaseFilterBackend
+from rest_framework.settings import api_settings
+
+from store.models import ProductCard
+from store.search import get_product_search
+
+
+# --- Product Filter ---
+class ProductFilter(django_filters.FilterSet):
+    min_price = django_filters.NumberFilter(field_name="price", lookup_expr="gte")
+    max_price = django_filters.NumberFilter(field_name="price", lookup_expr="lte")
+    category = django_filters.NumberFilter(field_name="category_id")
+    sub_category = django_filters.NumberFilter(field_name="sub_category_id")
+    brand = django_filters.NumberFilter(field_name="brand_id")
+
+    class Meta:
+        model = ProductCard
+        fields = ["category", "sub_category", "brand"]
+
+
+# --- Product Full-Text Search ---
+class ProductFullTextSearchFilter(BaseFilterBackend):
+    """
+    Full-text search over name, brand and description using store.search.
+    Results are ordered by relevance unless the client asks for an explicit
+    ?ordering=, so list it after OrderingFilter. Views over a model other
+    than Product point search_vector_field at the product's vector.
+    """
+    search_param = api_settings.SEARCH_PARAM
+    ordering_param = api_settings.ORDERING_PARAM
+
+    def filter_queryset(self, request, queryset, view):
+        text = request.query_params.get(self.search_param, "").strip()
+        if not text:
+            return queryset
+        vector_field = getattr(view, "search_vector_field", "search_vector")
+        queryset = get_product_search().search(queryset, text, vector_field)
+        if not request.query_params.get(self.ordering_param):
+            queryset = queryset.order_by("-search_rank", "-created_at")
+        return queryset
@@ -0,0 +1,225 @@
+import hashlib
+from functools import lru_cache
+
+from django.db.models import Count, Exists, Max, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date, quote_etag
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+
+from store.api.serializers import SparseFieldsetMixin, split_param
+from store.models import CartItem, Wishlist
+
+
+def make_etag(*parts):
+    return quote_etag(hashlib.md5("|".join(map(str, parts)).encode()).hexdigest())
+
+
+@lru_cache
+def known_names(serializer_class, param):
+    """Top-level names ?fields= (or ?expand=) can pick from serializer_class."""
+    expandable = frozenset(getattr(serializer_class, "expandable_fields", {}))
+    return expandable | frozenset(serializer_class().fields) if param == "fields" else expandable
+
+
+def canonical_path(serializer_class, path, param):
+    """path with unknown names dropped, or None when its first name is unknown."""
+    name, _, rest = path.partition(".")
+    if name not in known_names(serializer_class, param):
+        return None
+    nested = getattr(serializer_class, "expandable_fields", {}).get(name, {}).get("serializer")
+    if not rest or not (nested and issubclass(nested, SparseFieldsetMixin)):
+        return name
+    # Unknown nested names still replace the nested defaults, hence the placeholder
+    return f"{name}.{canonical_path(nested, rest, param) or '?'}"
+
+
+def response_shape(request, serializer_class):
+    """
+    ?fields= / ?expand= in canonical form for cache keys: deduped, sorted and
+    limited to names the serializer knows, so reordering or padding the
+    parameters can't mint new cache entries. "*" stands for an absent
+    parameter, which renders differently from one naming nothing known.
+    """
+    parts = []
+    for param in ("fields", "expand"):
+        paths = split_param(request, param)
+        if param == "fields" and not paths:
+            # A blank ?fields= renders every field, like an absent one
+            paths = None
+        if paths is None:
+            parts.append("*")
+            continue
+        known = {canonical_path(serializer_class, path, param) for path in paths}
+        parts.append(",".join(sorted(known - {None})))
+    return ":".join(parts)
+
+
+class ConditionalGetMixin:
+    """
+    ETag / Last-Modified support for GET. Validators come from a single
+    aggregate (row count and max of validator_fields) over the filtered
+    queryset, so a 304 is answered without loading or serializing rows.
+    Views over large result sets set validator_cache instead: a
+    VersionedCache bumped by every write they depend on, whose version is
+    the ETag, so no query runs at all.
+    """
+    validator_fields = ("updated_at",)
+    validator_cache = None
+
+    def is_conditional(self, request):
+        return True
+
+    def get(self, request, *args, **kwargs):
+        if not self.is_conditional(request):
+            return super().get(request, *args, **kwargs)
+        etag, last_modified = self.get_validators(request)
+        not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if not_modified is not None:
+            return not_modified
+
+        response = super().get(request, *args, **kwargs)
+        if response.status_code == 200:
+            response["ETag"] = etag
+            if last_modified:
+                response["Last-Modified"] = http_date(last_modified)
+        return response
+
+    def get_validator_queryset(self):
+        queryset = self.filter_queryset(self.get_queryset())
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        if lookup_url_kwarg in self.kwargs:
+            queryset = queryset.filter(**{self.lookup_field: self.kwargs[lookup_url_kwarg]})
+        return queryset
+
+    def get_validators(self, request):
+        """Return (etag, last_modified timestamp or None) for this request."""
+        if self.validator_cache is not None:
+            return make_etag(request.build_absolute_uri(), self.validator_cache.get_version()), None
+        latest = {f"latest_{i}": Max(field) for i, field in enumerate(self.validator_fields)}
+        # Counting joined rows also catches deletes, e.g. of a product's images
+        stats = self.get_validator_queryset().order_by().aggregate(rows=Count("pk"), **latest)
+        stamps = [stats[key] for key in latest if stats[key] is not None]
+        last_modified = int(max(stamps).timestamp()) if stamps else None
+        etag = make_etag(request.build_absolute_uri(), stats["rows"], *(stats[key] for key in latest))
+        return etag, last_modified
+
+
+class SparseFieldsetViewMixin:
+    """Join and prefetch only what the serializer renders for ?fields= / ?expand=."""
+
+    def get_queryset(self):
+        return self.get_serializer_class().optimize_queryset(super().get_queryset(), self.request)
+
+
+class UserProductStateMixin:
+    """
+    ?user_state=1 adds is_wishlisted and cart_quantity for the authenticated
+    user to every product of the page, as EXISTS / subquery columns of the
+    same SELECT. Such responses are per user, so they skip the shared
+    ETag validators and are marked private.
+    """
+    user_state_param = "user_state"
+
+    def wants_user_state(self):
+        flag = self.request.query_params.get(self.user_state_param, "").lower()
+        return flag in ("1", "true", "yes") and self.request.user.is_authenticated
+
+    def is_conditional(self, request):
+        return not self.wants_user_state() and super().is_conditional(request)
+
+    def annotate_user_state(self, queryset):
+        user = self.request.user
+        return queryset.annotate(
+            is_wishlisted=Exists(Wishlist.objects.filter(user=user, product_id=OuterRef("pk"))),
+            cart_quantity=Coalesce(
+                Subquery(CartItem.objects.filter(cart__user=user, product_id=OuterRef("pk")).values("quantity")[:1]),
+                Value(0),
+            ),
+        )
+
+    def paginate_queryset(self, queryset):
+        # Annotated here rather than in get_queryset, so facets and validators
+        # keep aggregating the plain queryset
+        if self.wants_user_state():
+            queryset = self.annotate_user_state(queryset)
+        return super().paginate_queryset(queryset)
+
+    def list(self, request, *args, **kwargs):
+        # Unpaginated lists never reach paginate_queryset; they also bypass a
+        # CachedListMixin further down, whose entries are shared by everyone
+        if self.paginator is None and self.wants_user_state():
+            queryset = self.annotate_user_state(self.filter_queryset(self.get_queryset()))
+            return Response(self.get_serializer(queryset, many=True).data)
+        return super().list(request, *args, **kwargs)
+
+    def get(self, request, *args, **kwargs):
+        response = super().get(request, *args, **kwargs)
+        if self.user_state_param in request.query_params:
+            # The same URL is shared or per user depending on who asks
+            patch_vary_headers(response, ["Authorization"])
+        if self.wants_user_state():
+            patch_cache_control(response, private=True)
+        return response
+
+
+class CachedListMixin:
+    """
+    Serve list() from a VersionedCache as pre-rendered JSON bytes, so a cache
+    hit skips both the ORM and DRF serialization.
+    """
+    response_cache = None
+
+    def get_validators(self, request):
+        # The cache version changes on every write, so it is the validator
+        etag = make_etag(request.build_absolute_uri(), self.response_cache.get_version())
+        return etag, None
+
+    def get_cache_key(self, request):
+        # Image fields are rendered as absolute URLs, so the host is part of the key
+        shape = response_shape(request, self.get_serializer_class())
+        return f"{self.__class__.__name__}:{request.get_host()}:{shape}"
+
+    def list(self, request, *args, **kwargs):
+        def render():
+            response = super(CachedListMixin, self).list(request, *args, **kwargs)
+            return JSONRenderer().render(response.data)
+
+        body = self.response_cache.get_or_set(self.get_cache_key(request), render)
+        return HttpResponse(body, content_type="application/json")
+
+
+class CachedRetrieveMixin:
+    """
+    Serve retrieve() as pre-rendered JSON from a ProductDetailCache-style
+    per-object cache. The entry also carries the ETag / Last-Modified that
+    ConditionalGetMixin computed when it was rendered, so a hit, 304 or
+    200, runs no queries at all.
+    """
+    detail_cache = None
+
+    def get_cache_shape(self, request):
+        # Host for absolute image URLs, plus the requested fields/expand
+        return f"{request.get_host()}:{response_shape(request, self.get_serializer_class())}"
+
+    def get_cached_entry(self, request):
+        if not hasattr(self, "_cached_entry"):
+            def build():
+                etag, last_modified = super(CachedRetrieveMixin, self).get_validators(request)
+                response = super(CachedRetrieveMixin, self).retrieve(request, *self.args, **self.kwargs)
+                return {"body": JSONRenderer().render(response.data), "etag": etag, "last_modified": last_modified}
+
+            lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+            self._cached_entry = self.detail_cache.get_or_build(
+                self.kwargs[lookup_url_kwarg], self.get_cache_shape(request), build
+            )
+        return self._cached_entry
+
+    def get_validators(self, request):
+        entry = self.get_cached_entry(request)
+        return entry["etag"], entry["last_modified"]
+
+    def retrieve(self, request, *args, **kwargs):
+        return HttpResponse(self.get_cached_entry(request)["body"], content_type="application/json")
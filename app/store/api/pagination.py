@@ -0,0 +1,147 @@
+import base64
+import binascii
+import json
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class ProductPagination(PageNumberPagination):
+    page_size = 10  # Default items per page
+    page_size_query_param = "page_size"  # Allow client to control items per page
+    max_page_size = 100  # Limit max items per page
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination keyed on (ordering field, pk). Each page is a single
+    indexed range scan: no COUNT(*) and no OFFSET, however deep the client
+    scrolls. Cursors are opaque base64 tokens bound to the ordering they
+    were issued for.
+    """
+    page_size = api_settings.PAGE_SIZE or 10
+    page_size_query_param = "page_size"
+    max_page_size = 100
+    cursor_query_param = "cursor"
+    keyset_fields = ("created_at", "price", "search_rank")
+    default_ordering = "-created_at"
+    invalid_cursor_message = "Invalid cursor"
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.ordering = self.get_ordering(queryset)
+        field = self.ordering.lstrip("-")
+        descending = self.ordering.startswith("-")
+
+        cursor = self.decode_cursor(request)
+        backwards = cursor is not None and cursor["d"] == "prev"
+        # Walking forwards through a descending order means "smaller than the cursor"
+        smaller = descending != backwards
+        if cursor is not None:
+            lookup = "lt" if smaller else "gt"
+            queryset = queryset.filter(
+                Q(**{f"{field}__{lookup}": cursor["v"]})
+                | Q(**{field: cursor["v"], f"pk__{lookup}": cursor["pk"]})
+            )
+        direction = "-" if smaller else ""
+        queryset = queryset.order_by(f"{direction}{field}", f"{direction}pk")
+
+        rows = list(queryset[:self.page_size + 1])
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if backwards:
+            rows.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next, self.has_previous = has_more, cursor is not None
+        self.page = rows
+        return rows
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(max(size, 1), self.max_page_size)
+
+    def get_ordering(self, queryset):
+        ordering = queryset.query.order_by
+        if ordering and isinstance(ordering[0], str) and ordering[0].lstrip("-") in self.keyset_fields:
+            return ordering[0]
+        return self.default_ordering
+
+    def encode_cursor(self, row, direction):
+        field = self.ordering.lstrip("-")
+        value = getattr(row, field)
+        payload = {
+            "o": self.ordering,
+            "v": value.isoformat() if hasattr(value, "isoformat") else value,
+            "pk": row.pk,
+            "d": direction,
+        }
+        token = base64.urlsafe_b64encode(json.dumps(payload, separators=(",", ":")).encode())
+        return token.decode().rstrip("=")
+
+    def decode_cursor(self, request):
+        token = request.query_params.get(self.cursor_query_param)
+        if not token:
+            return None
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)))
+            if payload["o"] != self.ordering or payload["d"] not in ("next", "prev"):
+                raise ValueError
+            if self.ordering.lstrip("-") == "created_at":
+                payload["v"] = parse_datetime(payload["v"])
+                if payload["v"] is None:
+                    raise ValueError
+            else:
+                payload["v"] = float(payload["v"])
+            payload["pk"] = int(payload["pk"])
+        except (binascii.Error, ValueError, TypeError, KeyError, AttributeError):
+            raise NotFound(self.invalid_cursor_message)
+        return payload
+
+    def get_link(self, row, direction):
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(row, direction))
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.get_link(self.page[-1], "next")
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return remove_query_param(self.request.build_absolute_uri(), self.cursor_query_param)
+        return self.get_link(self.page[0], "prev")
+
+    def get_paginated_response(self, data):
+        return Response({
+            "next": self.get_next_link(),
+            "previous": self.get_previous_link(),
+            "results": data,
+        })
+
+
+class ProductListPagination(BasePagination):
+    """
+    Keyset pagination by default; clients that need totals opt into page
+    numbers (and the COUNT(*) that comes with them) by passing ?page=.
+    """
+    def paginate_queryset(self, queryset, request, view=None):
+        if ProductPagination.page_query_param in request.query_params:
+            self.paginator = ProductPagination()
+        else:
+            self.paginator = KeysetPagination()
+        return self.paginator.paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        return self.paginator.get_paginated_response(data)
@@ -1,42 +1,217 @@
+from django.conf import settings
+from django.core.files.storage import default_storage
 from rest_framework import serializers
-from store.models import Category, SubCategory, Product, Image,Wishlist,Cart,CartItem
+from store.models import Category, SubCategory, Product, ProductCard, Image,Wishlist,Cart,CartItem
 from accounts.api.serializers import UserRegisterSerializer
 
-class ImageSerializer(serializers.ModelSerializer):
-    """Serializer for product images."""
+
+def split_param(request, name):
+    """Comma separated query parameter as a set, or None when it is absent."""
+    if request is None or name not in request.query_params:
+        return None
+    return {value.strip() for value in request.query_params[name].split(",") if value.strip()}
+
+
+def scope_paths(paths, prefix):
+    """First path segment of every dotted path under prefix, e.g. items.product -> items."""
+    if paths is None:
+        return None
+    return {path[len(prefix):].split(".", 1)[0] for path in paths if path.startswith(prefix) and path != prefix}
+
+
+class SparseFieldsetMixin:
+    """
+    ?fields=id,name limits the payload to those fields and ?expand=product
+    nests the listed expandable_fields. Relations that are not expanded are
+    rendered as ids when the id is on the row and left out otherwise, unless
+    a to-many relation is named in ?fields=.
+    Without ?expand= the default_expand relations are nested, as before.
+    Nested serializers are addressed with dotted paths: fields=items.quantity,
+    expand=items.product.
+
+    Use optimize_queryset() in the view so that only the relations the
+    response reads are joined or prefetched.
+    """
+    # name -> {"serializer": class, "many": bool, "source": dotted attribute path}
+    expandable_fields = {}
+    default_expand = ()
+    # name -> to-one orm path the field reads through (select_related)
+    field_relations = {}
+    # name -> to-many orm path the field reads through (prefetch_related)
+    field_prefetches = {}
+
+    @classmethod
+    def get_requested(cls, request, prefix=""):
+        """(fields or None for all, relations to expand) at this nesting level."""
+        fields = scope_paths(split_param(request, "fields"), prefix) or None
+        expand = scope_paths(split_param(request, "expand"), prefix)
+        if expand is None:
+            expand = set(cls.default_expand)
+        if fields is not None:
+            # A to-many relation asked for by name has no id form to fall back to
+            expand |= {name for name, spec in cls.expandable_fields.items() if spec.get("many")}
+            expand &= fields
+        return fields, expand
+
+    @classmethod
+    def get_relations(cls, request, prefix=""):
+        """select_related and prefetch_related paths needed for this request."""
+        fields, expand = cls.get_requested(request, prefix)
+        select = [path for name, path in cls.field_relations.items() if fields is None or name in fields]
+        prefetch = [path for name, path in cls.field_prefetches.items() if fields is None or name in fields]
+        for name in expand & set(cls.expandable_fields):
+            spec = cls.expandable_fields[name]
+            path = spec.get("source", name).replace(".", "__")
+            nested_select, nested_prefetch = [], []
+            if issubclass(spec["serializer"], SparseFieldsetMixin):
+                nested_select, nested_prefetch = spec["serializer"].get_relations(request, f"{prefix}{name}.")
+            nested_select = [f"{path}__{nested}" for nested in nested_select]
+            nested_prefetch = [f"{path}__{nested}" for nested in nested_prefetch]
+            if spec.get("many"):
+                # Everything below a to-many relation is fetched with it
+                prefetch += [path, *nested_select, *nested_prefetch]
+            else:
+                select += [path, *nested_select]
+                prefetch += nested_prefetch
+        return select, prefetch
+
+    @classmethod
+    def optimize_queryset(cls, queryset, request):
+        select, prefetch = cls.get_relations(request)
+        if select:
+            queryset = queryset.select_related(*select)
+        if prefetch:
+            queryset = queryset.prefetch_related(*prefetch)
+        return queryset
+
+    @property
+    def field_path(self):
+        names, node = [], self
+        while node.parent is not None:
+            if node.field_name:
+                names.append(node.field_name)
+            node = node.parent
+        return "".join(f"{name}." for name in reversed(names))
+
+    def get_fields(self):
+        fields = super().get_fields()
+        requested, expand = self.get_requested(self.context.get("request"), self.field_path)
+        for name, spec in self.expandable_fields.items():
+            if name not in fields:
+                continue
+            options = {"source": spec["source"]} if "source" in spec else {}
+            if name in expand:
+                fields[name] = spec["serializer"](many=spec.get("many", False), read_only=True, **options)
+            elif spec.get("many"):
+                del fields[name]
+            else:
+                # The id of the relation itself, read off the row without following source
+                fields[name] = serializers.PrimaryKeyRelatedField(read_only=True)
+        if requested is not None:
+            fields = {name: field for name, field in fields.items() if name in requested}
+        return fields
+
+
+class ImageSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
+    """Serializer for product images: the original plus a srcset per format."""
+    srcset = serializers.SerializerMethodField()
+
     class Meta:
         model = Image
-        fields = ["id", "image"]
+        fields = ["id", "image", "srcset"]
+
+    def get_srcset(self, obj):
+        """{"webp": "<url> 160w, <url> 500w, ...", "jpeg": ...}; empty until the variants exist."""
+        request = self.context.get("request")
+        variants = sorted(
+            (entry for name, entry in obj.variants.items() if name != "source"), key=lambda entry: entry["width"]
+        )
+        srcset = {}
+        for fmt in settings.PRODUCT_IMAGE_FORMATS:
+            candidates = []
+            for entry in variants:
+                if entry.get(fmt):
+                    url = default_storage.url(entry[fmt])
+                    candidates.append(f"{request.build_absolute_uri(url) if request else url} {entry['width']}w")
+            if candidates:
+                srcset[fmt] = ", ".join(candidates)
+        return srcset
 
 
-class SubCategorySerializer(serializers.ModelSerializer):
+class SubCategorySerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     """Serializer for subcategories under a category."""
     class Meta:
         model = SubCategory
         fields = ["id", "name","image"]
 
 
-class CategorySerializer(serializers.ModelSerializer):
+class CategorySerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     """Serializer for categories including their subcategories."""
     sub_categories = SubCategorySerializer(many=True, read_only=True)
+    expandable_fields = {"sub_categories": {"serializer": SubCategorySerializer, "many": True}}
+    default_expand = ("sub_categories",)
 
     class Meta:
         model = Category
         fields = ["id", "name", "image", "sub_categories"]
 
 
-class ProductSerializer(serializers.ModelSerializer):
+class ProductSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     """Serializer for products with related images and subcategory info."""
     images = ImageSerializer(many=True, read_only=True)  # Better naming
     sub_category = serializers.StringRelatedField()  # To show subcategory name instead of ID
     category = serializers.CharField(source="sub_category.category.name", read_only=True)  # Auto fetch category name
+    expandable_fields = {"images": {"serializer": ImageSerializer, "many": True}}
+    default_expand = ("images",)
+    field_relations = {"sub_category": "sub_category", "category": "sub_category__category"}
+    # Stock left once the holds of unpaid online orders are taken out
+    available_quantity = serializers.IntegerField(read_only=True)
 
     class Meta:
         model = Product
-        fields = "__all__"
+        exclude = ["search_vector", "reserved_quantity"]
+
+
+
+class ProductCardSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
+    """Listing tile for a product, read from the denormalized ProductCard table."""
+    id = serializers.IntegerField(source="product_id", read_only=True)
+    thumbnail = serializers.SerializerMethodField()
+    brand = serializers.CharField(source="brand_name", read_only=True)
+    category = serializers.CharField(source="category_name", read_only=True)
+    sub_category = serializers.CharField(source="sub_category_name", read_only=True)
+    # Only rendered when the view annotated them (?user_state=1)
+    is_wishlisted = serializers.BooleanField(read_only=True)
+    cart_quantity = serializers.IntegerField(read_only=True)
+
+    class Meta:
+        model = ProductCard
+        fields = [
+            "id", "name", "price", "old_price", "thumbnail", "brand", "category", "sub_category", "in_stock",
+            "is_wishlisted", "cart_quantity",
+        ]
 
+    def get_thumbnail(self, obj):
+        if not obj.thumbnail:
+            return None
+        url = default_storage.url(obj.thumbnail)
+        request = self.context.get("request")
+        return request.build_absolute_uri(url) if request else url
 
 
+class SuggestQuerySerializer(serializers.Serializer):
+    q = serializers.CharField(max_length=64)
+    limit = serializers.IntegerField(default=8, min_value=1, max_value=20)
+
+
+class RecentlyViewedQuerySerializer(serializers.Serializer):
+    limit = serializers.IntegerField(default=settings.RECENT_VIEWS_LIMIT, min_value=1, max_value=settings.RECENT_VIEWS_LIMIT)
+
+
+class TrendingQuerySerializer(serializers.Serializer):
+    category = serializers.IntegerField(required=False, help_text="Category id; omit for the global list")
+    limit = serializers.IntegerField(default=20, min_value=1, max_value=settings.TRENDING_SIZE)
+
 
 class WishListCreateDeleteSerializer(serializers.ModelSerializer):
     product_id = serializers.IntegerField()
@@ -46,12 +221,27 @@ class WishListCreateDeleteSerializer(serializers.ModelSerializer):
         extra_kwargs = {"user": {"required": False, "allow_null": True},"product": {"required": False, "allow_null": True}}
 
 
-class WishListSerializer(serializers.ModelSerializer):
-    user = UserRegisterSerializer()
-    product = ProductSerializer()
+class WishListBulkSerializer(serializers.Serializer):
+    add = serializers.ListField(child=serializers.IntegerField(min_value=1), required=False, default=list, max_length=200)
+    remove = serializers.ListField(child=serializers.IntegerField(min_value=1), required=False, default=list, max_length=200)
+
+    def validate(self, attrs):
+        if set(attrs["add"]) & set(attrs["remove"]):
+            raise serializers.ValidationError("A product can't be both added and removed")
+        return attrs
+
+
+class WishListSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
+    """A wishlist entry with its product as a listing card."""
+    expandable_fields = {
+        "user": {"serializer": UserRegisterSerializer},
+        "product": {"serializer": ProductCardSerializer, "source": "product.card"},
+    }
+    default_expand = ("product",)
+
     class Meta:
         model = Wishlist
-        fields = "__all__"
+        fields = ["id", "user", "product", "created_at"]
 
 class AddCartItemInputSerializer(serializers.Serializer):
     product_id = serializers.IntegerField()
@@ -61,10 +251,34 @@ class UpdateCartItemInputSerializer(serializers.Serializer):
     item_id = serializers.IntegerField()
     action = serializers.ChoiceField(choices=['add', 'remove'])
 
+class CartOperationSerializer(serializers.Serializer):
+    op = serializers.ChoiceField(choices=["set", "increment", "decrement", "remove"])
+    product_id = serializers.IntegerField()
+    # The new quantity for set, the step for increment/decrement; unused by remove
+    quantity = serializers.IntegerField(default=1, min_value=0)
 
-class CartItemSerializer(serializers.ModelSerializer):
+    def validate(self, attrs):
+        if attrs["op"] in ("increment", "decrement") and attrs["quantity"] < 1:
+            raise serializers.ValidationError({"quantity": "Must be at least 1 for increment and decrement."})
+        return attrs
+
+
+class CartBatchInputSerializer(serializers.Serializer):
+    operations = CartOperationSerializer(many=True, allow_empty=False, max_length=100)
+
+
+class UpdateGuestCartItemInputSerializer(serializers.Serializer):
+    product_id = serializers.IntegerField()
+    action = serializers.ChoiceField(choices=['add', 'remove'])
+
+
+class CartItemSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     product = ProductSerializer(read_only=True)
     product_id = serializers.IntegerField(write_only=True)
+    expandable_fields = {"product": {"serializer": ProductSerializer}}
+    default_expand = ("product",)
+    # subtotal is quantity * product.price
+    field_relations = {"subtotal": "product"}
 
     class Meta:
         model = CartItem
@@ -72,9 +286,11 @@ class CartItemSerializer(serializers.ModelSerializer):
         read_only_fields = ["subtotal"]
 
 
-class CartSerializer(serializers.ModelSerializer):
+class CartSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     items = CartItemSerializer(many=True, read_only=True)
     total_price = serializers.ReadOnlyField()
+    expandable_fields = {"items": {"serializer": CartItemSerializer, "many": True}}
+    default_expand = ("items",)
 
     class Meta:
         model = Cart
@@ -84,7 +300,8 @@ class CartSerializer(serializers.ModelSerializer):
     
 class MergeCartItemSerializer(serializers.Serializer):
     product_id = serializers.IntegerField()
-    quantity = serializers.IntegerField(default=1)
+    quantity = serializers.IntegerField(default=1, min_value=1)
 
 class MergeCartInputSerializer(serializers.Serializer):
-    items = MergeCartItemSerializer(many=True)
+    items = MergeCartItemSerializer(many=True, required=False)
+    guest_token = serializers.CharField(required=False, help_text="Token of a guest cart kept by the server")
@@ -7,8 +7,18 @@ from store.api.views import (
     ProductListBySubCategoryView,
     ProductDetailView,
     ProductSearchView,
+    ProductSuggestView,
+    ProductFeedView,
+    RecentlyViewedView,
+    TrendingProductsView,
+    AlsoBoughtView,
     WishListAPIView,
-    CartView
+    WishListBulkView,
+    WishListIdsView,
+    CartView,
+    CartBatchView,
+    CartSummaryView,
+    GuestCartView,
     
 )
 
@@ -18,8 +28,18 @@ urlpatterns = [
     path("subcategories/", SubCategoryListView.as_view(), name="subcategory-list"),
     path("subcategories/<int:subcategory_id>/products/", ProductListBySubCategoryView.as_view(), name="product-by-subcategory"),
     path("products/<int:pk>/", ProductDetailView.as_view(), name="product-detail"),
+    path("products/<int:pk>/also-bought/", AlsoBoughtView.as_view(), name="product-also-bought"),
     path("products/search/", ProductSearchView.as_view(), name="product-search"),
+    path("products/suggest/", ProductSuggestView.as_view(), name="product-suggest"),
+    path("products/trending/", TrendingProductsView.as_view(), name="product-trending"),
+    path("products/recently-viewed/", RecentlyViewedView.as_view(), name="recently-viewed"),
+    path("products/feed.<str:feed_format>", ProductFeedView.as_view(), name="product-feed"),
     path('wishlist/add-to-wishlist/',WishListAPIView.as_view(),name = "add-to-wishlist"),
+    path("wishlist/bulk/", WishListBulkView.as_view(), name="wishlist-bulk"),
+    path("wishlist/ids/", WishListIdsView.as_view(), name="wishlist-ids"),
     path("cart/", CartView.as_view(), name="cart"),
+    path("cart/batch/", CartBatchView.as_view(), name="cart-batch"),
+    path("cart/summary/", CartSummaryView.as_view(), name="cart-summary"),
+    path("cart/guest/", GuestCartView.as_view(), name="guest-cart"),
     path("cart/merge/", MergeCartView.as_view(), name="merge-cart"),
 ]
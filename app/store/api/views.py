@@ -1,26 +1,61 @@
 from rest_framework import generics, status,filters
 from rest_framework.response import Response
 from drf_yasg.utils import swagger_auto_schema
-from store.models import Cart, CartItem, Category, SubCategory, Product,Wishlist
-from store.api.serializers import AddCartItemInputSerializer, CartSerializer, CategorySerializer, MergeCartInputSerializer, SubCategorySerializer, ProductSerializer, UpdateCartItemInputSerializer,WishListCreateDeleteSerializer,WishListSerializer
-from django_filters.rest_framework import DjangoFilterBackend, FilterSet
-import django_filters
+from store.models import Cart, CartItem, Category, SubCategory, Product, ProductCard, Wishlist
+from store.api.serializers import AddCartItemInputSerializer, CartBatchInputSerializer, CartSerializer, CategorySerializer, MergeCartInputSerializer, SubCategorySerializer, ProductCardSerializer, ProductSerializer, RecentlyViewedQuerySerializer, SuggestQuerySerializer, TrendingQuerySerializer, UpdateCartItemInputSerializer,UpdateGuestCartItemInputSerializer,WishListBulkSerializer,WishListCreateDeleteSerializer,WishListSerializer
+from django_filters.rest_framework import DjangoFilterBackend
 from drf_yasg import openapi
 from rest_framework.views import APIView
-from rest_framework.permissions import IsAuthenticated
-from rest_framework.pagination import PageNumberPagination
+from rest_framework.permissions import AllowAny, IsAdminUser, IsAuthenticated
+from django.db import transaction
+from django.db.models import F
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.utils.dateparse import parse_datetime
 from django.shortcuts import get_object_or_404
-
+from store.api.filters import ProductFilter, ProductFullTextSearchFilter
+from store.api.mixins import CachedListMixin, CachedRetrieveMixin, ConditionalGetMixin, SparseFieldsetViewMixin, UserProductStateMixin
+from store.api.pagination import KeysetPagination, ProductListPagination
+from store.cart_store import get_cart_store, guest_owner, new_guest_token
+from store.feeds import ProductFeed
+from store.recent_views import recent_views, recently_viewed_ids
+from store.trending import trending_cache
+from store.services import ProductFacets, card_versions, cart_summary_cache, product_detail_cache, taxonomy_cache
+from store.suggest import get_suggestion_index
+
+LISTING_PARAMETERS = [
+    openapi.Parameter("ordering", openapi.IN_QUERY, description="Sort by price or created_at (use -price for desc)", type=openapi.TYPE_STRING),
+    openapi.Parameter("cursor", openapi.IN_QUERY, description="Opaque cursor from the next/previous link", type=openapi.TYPE_STRING),
+    openapi.Parameter("page", openapi.IN_QUERY, description="Page number; switches to page-number pagination with a total count", type=openapi.TYPE_INTEGER),
+    openapi.Parameter("page_size", openapi.IN_QUERY, description="Items per page (max 100)", type=openapi.TYPE_INTEGER),
+]
+FIELDSET_PARAMETERS = [
+    openapi.Parameter("fields", openapi.IN_QUERY, description="Comma separated fields to return, dotted for nested ones (items.quantity)", type=openapi.TYPE_STRING),
+    openapi.Parameter("expand", openapi.IN_QUERY, description="Comma separated relations to nest (product, items.product); others are returned as ids or left out", type=openapi.TYPE_STRING),
+]
+WISHLIST_PARAMETERS = [
+    openapi.Parameter("cursor", openapi.IN_QUERY, description="Opaque cursor from the next/previous link", type=openapi.TYPE_STRING),
+    openapi.Parameter("page_size", openapi.IN_QUERY, description="Items per page (max 100)", type=openapi.TYPE_INTEGER),
+]
+# Stock a cart may take: the holds of unpaid online orders are already spoken for
+AVAILABLE = F("quantity") - F("reserved_quantity")
+
+USER_STATE_PARAMETERS = [
+    openapi.Parameter("user_state", openapi.IN_QUERY, description="Add is_wishlisted and cart_quantity for the signed-in user to every product", type=openapi.TYPE_BOOLEAN),
+]
 
 
 # 1. Get all categories (ListAPIView)
-class CategoryListView(generics.ListAPIView):
+class CategoryListView(CachedListMixin, ConditionalGetMixin, SparseFieldsetViewMixin, generics.ListAPIView):
     queryset = Category.objects.all()
     serializer_class = CategorySerializer
+    response_cache = taxonomy_cache
 
     @swagger_auto_schema(
         operation_description="Get a list of all categories",
-        responses={200: CategorySerializer(many=True)}
+        responses={200: CategorySerializer(many=True)},
+        manual_parameters=FIELDSET_PARAMETERS
     )
     def get(self, request, *args, **kwargs):
         try:
@@ -33,13 +68,15 @@ class CategoryListView(generics.ListAPIView):
 
 
 # 2. Get all subcategories (ListAPIView)
-class SubCategoryListView(generics.ListAPIView):
+class SubCategoryListView(CachedListMixin, ConditionalGetMixin, generics.ListAPIView):
     queryset = SubCategory.objects.all()
     serializer_class = SubCategorySerializer
+    response_cache = taxonomy_cache
 
     @swagger_auto_schema(
         operation_description="Get a list of all subcategories",
-        responses={200: SubCategorySerializer(many=True)}
+        responses={200: SubCategorySerializer(many=True)},
+        manual_parameters=FIELDSET_PARAMETERS
     )
     def get(self, request, *args, **kwargs):
         try:
@@ -54,16 +91,22 @@ class SubCategoryListView(generics.ListAPIView):
 
 
 # 3. Get products under a specific subcategory (ListAPIView)
-class ProductListBySubCategoryView(generics.ListAPIView):
-    serializer_class = ProductSerializer
+class ProductListBySubCategoryView(UserProductStateMixin, ConditionalGetMixin, generics.ListAPIView):
+    serializer_class = ProductCardSerializer
+    filter_backends = [filters.OrderingFilter]
+    ordering_fields = ["price", "created_at"]
+    ordering = ["-created_at"]
+    pagination_class = ProductListPagination
+    validator_cache = card_versions
 
     def get_queryset(self):
         subcategory_id = self.kwargs.get("subcategory_id")
-        return Product.objects.filter(sub_category_id=subcategory_id, is_active=True)
+        return ProductCard.objects.filter(sub_category_id=subcategory_id, is_active=True)
 
     @swagger_auto_schema(
         operation_description="Get all active products under a specific subcategory",
-        responses={200: ProductSerializer(many=True)}
+        responses={200: ProductCardSerializer(many=True)},
+        manual_parameters=LISTING_PARAMETERS + FIELDSET_PARAMETERS + USER_STATE_PARAMETERS
     )
     def get(self, request, *args, **kwargs):
         try:
@@ -75,16 +118,22 @@ class ProductListBySubCategoryView(generics.ListAPIView):
             )
 
 
-class ProductListByCategoryView(generics.ListAPIView):
-    serializer_class = ProductSerializer
+class ProductListByCategoryView(UserProductStateMixin, ConditionalGetMixin, generics.ListAPIView):
+    serializer_class = ProductCardSerializer
+    filter_backends = [filters.OrderingFilter]
+    ordering_fields = ["price", "created_at"]
+    ordering = ["-created_at"]
+    pagination_class = ProductListPagination
+    validator_cache = card_versions
 
     def get_queryset(self):
         category_id = self.kwargs.get("category_id")
-        return Product.objects.filter(category_id=category_id, is_active=True)
+        return ProductCard.objects.filter(category_id=category_id, is_active=True)
 
     @swagger_auto_schema(
         operation_description="Get all active products under a specific subcategory",
-        responses={200: ProductSerializer(many=True)}
+        responses={200: ProductCardSerializer(many=True)},
+        manual_parameters=LISTING_PARAMETERS + FIELDSET_PARAMETERS + USER_STATE_PARAMETERS
     )
     def get(self, request, *args, **kwargs):
         try:
@@ -96,17 +145,24 @@ class ProductListByCategoryView(generics.ListAPIView):
             )
 
 # 4. Get single product details (RetrieveAPIView)
-class ProductDetailView(generics.RetrieveAPIView):
-    queryset = Product.objects.all()
+class ProductDetailView(CachedRetrieveMixin, ConditionalGetMixin, SparseFieldsetViewMixin, generics.RetrieveAPIView):
+    queryset = Product.objects.defer("search_vector")
     serializer_class = ProductSerializer
     lookup_field = "pk"
+    detail_cache = product_detail_cache
+    # Everything the detail payload is rendered from
+    validator_fields = ("updated_at", "images__updated_at", "sub_category__updated_at", "sub_category__category__updated_at")
 
     @swagger_auto_schema(
         operation_description="Get detailed information of a single product",
-        responses={200: ProductSerializer()}
+        responses={200: ProductSerializer()},
+        manual_parameters=FIELDSET_PARAMETERS
     )
     def get(self, request, *args, **kwargs):
         try:
+            if request.user.is_authenticated:
+                # Buffered in memory and written in batches; see store.recent_views
+                recent_views.record(request.user.id, kwargs["pk"])
             return super().get(request, *args, **kwargs)
         except Exception as e:
             return Response(
@@ -114,45 +170,32 @@ class ProductDetailView(generics.RetrieveAPIView):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-class ProductPagination(PageNumberPagination):
-    page_size = 10  # Default items per page
-    page_size_query_param = "page_size"  # Allow client to control items per page
-    max_page_size = 100  # Limit max items per page
-
-# --- Product Filter ---
-class ProductFilter(django_filters.FilterSet):
-    min_price = django_filters.NumberFilter(field_name="price", lookup_expr="gte")
-    max_price = django_filters.NumberFilter(field_name="price", lookup_expr="lte")
-    category = django_filters.NumberFilter(field_name="category_id")
-    sub_category = django_filters.NumberFilter(field_name="sub_category_id")
-    brand = django_filters.NumberFilter(field_name="brand_id")
-
-    class Meta:
-        model = Product
-        fields = ["category", "sub_category", "brand"]
-
 # --- Product Search API ---
-class ProductSearchView(generics.ListAPIView):
-    queryset = Product.objects.filter(is_active=True)
-    serializer_class = ProductSerializer
-    filter_backends = [filters.SearchFilter, filters.OrderingFilter, DjangoFilterBackend]
+class ProductSearchView(UserProductStateMixin, ConditionalGetMixin, generics.ListAPIView):
+    queryset = ProductCard.objects.filter(is_active=True)
+    serializer_class = ProductCardSerializer
+    search_vector_field = "product__search_vector"
+    filter_backends = [DjangoFilterBackend, filters.OrderingFilter, ProductFullTextSearchFilter]
     filterset_class = ProductFilter
-    search_fields = ["name", "description", "brand__name"]
     ordering_fields = ["price", "created_at"]
     ordering = ["-created_at"]
-    pagination_class = ProductPagination  # ✅ Added pagination here
+    pagination_class = ProductListPagination  # Keyset by default, ?page= for page numbers
+    validator_cache = card_versions
 
     @swagger_auto_schema(
         operation_description="Search, filter, and sort products.",
-        responses={200: ProductSerializer(many=True)},
+        responses={200: ProductCardSerializer(many=True)},
         manual_parameters=[
-            openapi.Parameter("search", openapi.IN_QUERY, description="Search by name, description, brand", type=openapi.TYPE_STRING),
+            openapi.Parameter("search", openapi.IN_QUERY, description="Full-text search by name, brand, description (prefix match, ranked by relevance unless ordering is given)", type=openapi.TYPE_STRING),
             openapi.Parameter("category", openapi.IN_QUERY, description="Filter by category ID", type=openapi.TYPE_INTEGER),
             openapi.Parameter("sub_category", openapi.IN_QUERY, description="Filter by sub-category ID", type=openapi.TYPE_INTEGER),
             openapi.Parameter("brand", openapi.IN_QUERY, description="Filter by brand ID", type=openapi.TYPE_INTEGER),
             openapi.Parameter("min_price", openapi.IN_QUERY, description="Minimum price", type=openapi.TYPE_NUMBER),
             openapi.Parameter("max_price", openapi.IN_QUERY, description="Maximum price", type=openapi.TYPE_NUMBER),
-            openapi.Parameter("ordering", openapi.IN_QUERY, description="Sort by price or created_at (use -price for desc)", type=openapi.TYPE_STRING),
+            openapi.Parameter("facets", openapi.IN_QUERY, description="Include brand/category/price facet counts for the whole result set", type=openapi.TYPE_BOOLEAN),
+            *LISTING_PARAMETERS,
+            *FIELDSET_PARAMETERS,
+            *USER_STATE_PARAMETERS,
         ]
     )
     def get(self, request, *args, **kwargs):
@@ -163,8 +206,161 @@ class ProductSearchView(generics.ListAPIView):
                 {"status": "400", "message": str(e)},
                 status=status.HTTP_400_BAD_REQUEST
             )
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(queryset)
+        serializer = self.get_serializer(page, many=True)
+        response = self.get_paginated_response(serializer.data)
+        if request.query_params.get("facets", "").lower() in ("1", "true", "yes"):
+            response.data["facets"] = ProductFacets().get(queryset, request.query_params)
+        return response
         
 
+# --- Product Autocomplete API ---
+class ProductSuggestView(APIView):
+
+    @swagger_auto_schema(
+        operation_description="Typo-tolerant autocomplete over product, brand and category names.",
+        manual_parameters=[
+            openapi.Parameter("q", openapi.IN_QUERY, description="What the user has typed so far", type=openapi.TYPE_STRING, required=True),
+            openapi.Parameter("limit", openapi.IN_QUERY, description="Number of suggestions (max 20)", type=openapi.TYPE_INTEGER),
+        ]
+    )
+    def get(self, request):
+        serializer = SuggestQuerySerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        query = serializer.validated_data["q"]
+        results = get_suggestion_index().suggest(query, serializer.validated_data["limit"])
+        return Response({"q": query, "results": results})
+
+
+# --- Also Bought API ---
+class AlsoBoughtView(generics.ListAPIView):
+    """Neighbours precomputed by the update_recommendations command."""
+    serializer_class = ProductCardSerializer
+    pagination_class = None
+
+    def get_queryset(self):
+        return ProductCard.objects.filter(
+            is_active=True, product__neighbour_of__product_id=self.kwargs["pk"]
+        ).order_by("product__neighbour_of__rank")
+
+    @swagger_auto_schema(
+        operation_description="Products frequently bought together with this one, most similar first.",
+        manual_parameters=FIELDSET_PARAMETERS,
+        responses={200: ProductCardSerializer(many=True)},
+    )
+    def get(self, request, *args, **kwargs):
+        try:
+            return super().get(request, *args, **kwargs)
+        except Exception as e:
+            return Response(
+                {"status": "400", "message": str(e)},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+
+# --- Trending Products API ---
+class TrendingProductsView(UserProductStateMixin, CachedListMixin, ConditionalGetMixin, generics.ListAPIView):
+    """Serves the ranking precomputed by the compute_trending command."""
+    serializer_class = ProductCardSerializer
+    response_cache = trending_cache
+    pagination_class = None
+
+    def get_params(self):
+        serializer = TrendingQuerySerializer(data=self.request.query_params)
+        serializer.is_valid(raise_exception=True)
+        return serializer.validated_data
+
+    def get_queryset(self):
+        params = self.get_params()
+        return ProductCard.objects.filter(
+            is_active=True,
+            product__trending__category_id=params.get("category"),
+            product__trending__rank__lte=params["limit"],
+        ).order_by("product__trending__rank")
+
+    def get_cache_key(self, request):
+        params = self.get_params()
+        return f"{super().get_cache_key(request)}:{params.get('category')}:{params['limit']}"
+
+    @swagger_auto_schema(
+        operation_description="Trending products by recent views, wishlist adds and sales, globally or in one category.",
+        manual_parameters=[
+            openapi.Parameter("category", openapi.IN_QUERY, description="Category id; omit for the global list", type=openapi.TYPE_INTEGER),
+            openapi.Parameter("limit", openapi.IN_QUERY, description="Number of products (max 50)", type=openapi.TYPE_INTEGER),
+            *FIELDSET_PARAMETERS,
+            *USER_STATE_PARAMETERS,
+        ],
+        responses={200: ProductCardSerializer(many=True)},
+    )
+    def get(self, request, *args, **kwargs):
+        try:
+            return super().get(request, *args, **kwargs)
+        except Exception as e:
+            return Response(
+                {"status": "400", "message": str(e)},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+
+# --- Recently Viewed API ---
+class RecentlyViewedView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    @swagger_auto_schema(
+        tags=["recently-viewed"],
+        operation_description="The logged-in user's most recently viewed products, newest first.",
+        manual_parameters=[
+            openapi.Parameter("limit", openapi.IN_QUERY, description="Number of products (max 20)", type=openapi.TYPE_INTEGER),
+        ],
+        responses={200: ProductCardSerializer(many=True)},
+    )
+    def get(self, request):
+        serializer = RecentlyViewedQuerySerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        ids = recently_viewed_ids(request.user.id, serializer.validated_data["limit"])
+        cards = ProductCard.objects.filter(is_active=True).in_bulk(ids)
+        results = ProductCardSerializer([cards[pk] for pk in ids if pk in cards], many=True, context={"request": request})
+        return Response({"results": results.data})
+
+
+# --- Product Feed API ---
+class ProductFeedView(APIView):
+    """Streams the active catalog as a shopping feed; see store.feeds."""
+    permission_classes = [IsAdminUser]
+
+    @swagger_auto_schema(
+        tags=["feeds"],
+        operation_description="Stream the active catalog as a CSV, JSONL or XML feed, gzipped when accepted.",
+        manual_parameters=[
+            openapi.Parameter("since", openapi.IN_QUERY, description="Only products changed after this ISO timestamp; use the X-Feed-Generated-At of the previous feed", type=openapi.TYPE_STRING),
+        ]
+    )
+    def get(self, request, feed_format):
+        since = request.query_params.get("since")
+        if since:
+            since = parse_datetime(since)
+            if since is None:
+                return Response({"status": "400", "message": "since must be an ISO 8601 timestamp"}, status=status.HTTP_400_BAD_REQUEST)
+            if timezone.is_naive(since):
+                since = timezone.make_aware(since)
+        try:
+            feed = ProductFeed(feed_format, since=since, media_base_url=request.build_absolute_uri("/"))
+        except ValueError as e:
+            return Response({"status": "400", "message": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        generated_at = timezone.now()
+        compress = "gzip" in request.META.get("HTTP_ACCEPT_ENCODING", "")
+        response = StreamingHttpResponse(feed.iter_bytes(compress), content_type=f"{feed.content_type}; charset=utf-8")
+        if compress:
+            response["Content-Encoding"] = "gzip"
+        patch_vary_headers(response, ["Accept-Encoding"])
+        response["Content-Disposition"] = f'inline; filename="products.{feed_format}"'
+        response["X-Feed-Generated-At"] = generated_at.isoformat()
+        return response
+
 
 # TODO: WishList
 
@@ -172,47 +368,88 @@ class ProductSearchView(generics.ListAPIView):
 class WishListAPIView(APIView):
     permission_classes = [IsAuthenticated]
     
-    @swagger_auto_schema(tags = ['wishlist'])
+    @swagger_auto_schema(tags = ['wishlist'],manual_parameters = WISHLIST_PARAMETERS + FIELDSET_PARAMETERS)
     def get(self,request,*args, **kwargs):
-        queryset = Wishlist.objects.filter(user = request.user)
-        serializer = WishListSerializer(queryset,many = True)
-        return Response(serializer.data,status = 200)
+        # Newest first, a keyset page at a time off the (user, -created_at) index
+        queryset = WishListSerializer.optimize_queryset(Wishlist.objects.filter(user = request.user), request)
+        paginator = KeysetPagination()
+        page = paginator.paginate_queryset(queryset,request,view = self)
+        serializer = WishListSerializer(page,many = True,context = {"request": request})
+        return paginator.get_paginated_response(serializer.data)
 
     @swagger_auto_schema(tags = ['wishlist'],request_body = WishListCreateDeleteSerializer)
     def post(self,request,*args, **kwargs):
         serializer = WishListCreateDeleteSerializer(data = request.data)
-        product = Product.objects.filter(id = request.data['product_id']).first()
         serializer.is_valid(raise_exception = True)
-        found_wishlist = Wishlist.objects.filter(product = product,user=request.user).first()
-        if found_wishlist:
-            found_wishlist.delete()
+        product_id = serializer.validated_data['product_id']
+        removed, _ = Wishlist.objects.filter(product_id = product_id,user = request.user).delete()
+        if removed:
             return Response({"status":"200","message":"Product removed from wishlist"},status=201)
 
-        serializer.save(user = self.request.user,product = product)
+        if not Product.objects.filter(id = product_id).exists():
+            return Response({"status": "404","message":"Product not found"},status = 404)
+        # A concurrent add of the same product is a no-op, not an IntegrityError
+        Wishlist.objects.bulk_create([Wishlist(user = request.user,product_id = product_id)],ignore_conflicts = True)
         return Response({"status": "200","message":"Product added into wishlist"},status =200)
     
     @swagger_auto_schema(tags = ['wishlist'],request_body = WishListCreateDeleteSerializer)
     def delete(self,request,*args, **kwargs):       
         serializer = WishListCreateDeleteSerializer(data = request.data)
         serializer.is_valid(raise_exception = True)
-        product = Product.objects.filter(id = request.data['product_id']).first()
-        if Wishlist.objects.filter(product = product,user = request.user).exists():
-            Wishlist.objects.filter(product = product,user = request.user).delete()
+        removed, _ = Wishlist.objects.filter(product_id = serializer.validated_data['product_id'],user = request.user).delete()
+        if removed:
             return Response({"status": "200","message":"Product removed from wishlist"},status = 203)
         return Response({"status": "400","message":"You dont have permission to remove product from wishlist"},status = 400)
 
 
+class WishListBulkView(APIView):
+    """Add and remove many products in one request: one INSERT and one DELETE ... IN."""
+    permission_classes = [IsAuthenticated]
+
+    @swagger_auto_schema(tags = ['wishlist'],request_body = WishListBulkSerializer)
+    def post(self,request,*args, **kwargs):
+        serializer = WishListBulkSerializer(data = request.data)
+        serializer.is_valid(raise_exception = True)
+        add, remove = serializer.validated_data['add'], serializer.validated_data['remove']
+        with transaction.atomic():
+            removed = 0
+            if remove:
+                removed, _ = Wishlist.objects.filter(user = request.user,product_id__in = remove).delete()
+            # Unknown product ids are skipped; ones already in the wishlist are left alone
+            product_ids = list(Product.objects.filter(id__in = add).order_by().values_list("id",flat = True)) if add else []
+            Wishlist.objects.bulk_create(
+                [Wishlist(user = request.user,product_id = product_id) for product_id in product_ids],
+                ignore_conflicts = True,
+            )
+        return Response({
+            "status": "200",
+            "message": "Wishlist updated",
+            "added": sorted(product_ids),
+            "removed": removed,
+        },status = 200)
+
+
+class WishListIdsView(APIView):
+    """Just the wishlisted product ids, for clients that mark hearts on cached listings."""
+    permission_classes = [IsAuthenticated]
+
+    @swagger_auto_schema(tags = ['wishlist'])
+    def get(self,request,*args, **kwargs):
+        product_ids = Wishlist.objects.filter(user = request.user).order_by("-created_at").values_list("product_id",flat = True)
+        return Response({"product_ids": list(product_ids)},status = 200)
+
+
 
 # TODO: Cart
 
 class CartView(APIView):
     permission_classes = [IsAuthenticated]
 
-    @swagger_auto_schema(tags=['cart'])
+    @swagger_auto_schema(tags=['cart'], manual_parameters=FIELDSET_PARAMETERS)
     def get(self, request):
         """Get user's cart."""
-        cart, _ = Cart.objects.get_or_create(user=request.user)
-        serializer = CartSerializer(cart)
+        cart, _ = CartSerializer.optimize_queryset(Cart.objects.all(), request).get_or_create(user=request.user)
+        serializer = CartSerializer(cart, context={"request": request})
         return Response(serializer.data)
 
     @swagger_auto_schema(tags=['cart'], request_body=AddCartItemInputSerializer)
@@ -225,7 +462,7 @@ class CartView(APIView):
         quantity = serializer.validated_data["quantity"]
 
         product = get_object_or_404(Product, id=product_id)
-        if product.quantity < quantity:
+        if product.available_quantity < quantity:
             return Response({"error": "Not enough stock"}, status=400)
 
         cart_item, _ = CartItem.objects.get_or_create(cart=cart, product=product)
@@ -242,7 +479,7 @@ class CartView(APIView):
         item_id = serializer.validated_data["item_id"]
         action = serializer.validated_data["action"]
 
-        cart_item = get_object_or_404(CartItem, id=item_id, cart__user=request.user)
+        cart_item = get_object_or_404(CartItem.objects.select_related("cart", "product"), id=item_id, cart__user=request.user)
 
         if action == "add":
             new_quantity = cart_item.quantity + 1
@@ -257,24 +494,192 @@ class CartView(APIView):
             return Response({"message": "Item removed successfully"})
 
         # Check stock
-        if cart_item.product.quantity < new_quantity:
+        if cart_item.product.available_quantity < new_quantity:
             return Response({"error": "Not enough stock available"}, status=400)
 
         cart_item.quantity = new_quantity
-        cart_item.save()
-
-        cart = cart_item.cart
-        total_price = cart.total_price
+        cart_item.save(update_fields=["quantity"])
 
         return Response({
             "message": "Cart updated successfully",
             "item_id": cart_item.id,
             "quantity": cart_item.quantity,
             "item_subtotal": cart_item.subtotal,
-            "cart_total": total_price
+            # One aggregate query, and it refills the header badge's cache
+            "cart_total": cart_summary_cache.get(request.user.id)["total_price"]
         })
 
 
+class CartBatchView(APIView):
+    """
+    Apply a list of cart operations at once, e.g. the taps a client
+    debounced. The operations run in order against the current quantities
+    in memory; the result is written with one DELETE ... IN for the lines
+    that reached zero and one upsert for the rest, in one transaction.
+    If any operation is invalid nothing is applied.
+    """
+    permission_classes = [IsAuthenticated]
+
+    @swagger_auto_schema(tags=['cart'], request_body=CartBatchInputSerializer, manual_parameters=FIELDSET_PARAMETERS)
+    def post(self, request):
+        serializer = CartBatchInputSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        operations = serializer.validated_data["operations"]
+        product_ids = {operation["product_id"] for operation in operations}
+
+        with transaction.atomic():
+            # The row lock serializes concurrent batches of the same user
+            cart, _ = Cart.objects.select_for_update().get_or_create(user=request.user)
+            quantities = dict(
+                CartItem.objects.filter(cart=cart, product_id__in=product_ids).values_list("product_id", "quantity")
+            )
+            stock = dict(Product.objects.filter(id__in=product_ids).values_list("id", AVAILABLE))
+
+            errors = []
+            for index, operation in enumerate(operations):
+                product_id, op = operation["product_id"], operation["op"]
+                if product_id not in stock:
+                    errors.append({"index": index, "error": f"Product {product_id} does not exist"})
+                    continue
+                current = quantities.get(product_id, 0)
+                if op == "set":
+                    new_quantity = operation["quantity"]
+                elif op == "increment":
+                    new_quantity = current + operation["quantity"]
+                elif op == "decrement":
+                    new_quantity = max(current - operation["quantity"], 0)
+                else:
+                    new_quantity = 0
+                if new_quantity > stock[product_id]:
+                    errors.append({"index": index, "error": f"Only {stock[product_id]} of product {product_id} in stock"})
+                    continue
+                quantities[product_id] = new_quantity
+            if errors:
+                return Response({"errors": errors}, status=400)
+
+            removed = [product_id for product_id in product_ids if quantities.get(product_id) == 0]
+            if removed:
+                CartItem.objects.filter(cart=cart, product_id__in=removed).delete()
+            CartItem.objects.bulk_create(
+                [
+                    CartItem(cart=cart, product_id=product_id, quantity=quantities[product_id])
+                    for product_id in sorted(product_ids) if quantities.get(product_id)
+                ],
+                update_conflicts=True,
+                unique_fields=["cart", "product"],
+                update_fields=["quantity"],
+            )
+        # bulk_create sends no signals
+        cart_summary_cache.invalidate(request.user.id)
+
+        cart = CartSerializer.optimize_queryset(Cart.objects.all(), request).get(pk=cart.pk)
+        return Response({"cart": CartSerializer(cart, context={"request": request}).data})
+
+
+class CartSummaryView(APIView):
+    """Line count, units and total for the header badge, cached until the cart changes."""
+    permission_classes = [IsAuthenticated]
+
+    @swagger_auto_schema(tags=['cart'])
+    def get(self, request):
+        response = Response(cart_summary_cache.get(request.user.id))
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
+
+
+
+CART_TOKEN_PARAMETERS = [
+    openapi.Parameter("X-Cart-Token", openapi.IN_HEADER, description="Guest cart token returned by an earlier write", type=openapi.TYPE_STRING),
+]
+
+
+class GuestCartView(APIView):
+    """
+    Cart of a signed-out visitor, kept in the cart store (store.cart_store)
+    under an opaque token instead of in Cart/CartItem rows. The first write
+    issues the token; the client sends it back in X-Cart-Token and hands it
+    to cart/merge/ after login.
+    """
+    permission_classes = [AllowAny]
+
+    def get_token(self, request):
+        return request.headers.get("X-Cart-Token")
+
+    @swagger_auto_schema(tags=['cart'], manual_parameters=CART_TOKEN_PARAMETERS)
+    def get(self, request):
+        token = self.get_token(request)
+        quantities = get_cart_store().get(guest_owner(token)) if token else {}
+        cards = ProductCard.objects.in_bulk(list(quantities))
+        items = [
+            {
+                "product": ProductCardSerializer(cards[product_id], context={"request": request}).data,
+                "quantity": quantity,
+                "subtotal": round(cards[product_id].price * quantity, 2),
+            }
+            for product_id, quantity in quantities.items() if product_id in cards
+        ]
+        return Response({
+            "token": token,
+            "items": items,
+            "item_count": len(items),
+            "total_quantity": sum(item["quantity"] for item in items),
+            "total_price": round(sum(item["subtotal"] for item in items), 2),
+        })
+
+    @swagger_auto_schema(tags=['cart'], request_body=AddCartItemInputSerializer, manual_parameters=CART_TOKEN_PARAMETERS)
+    def post(self, request):
+        """Set the quantity of a product."""
+        serializer = AddCartItemInputSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        product_id = serializer.validated_data["product_id"]
+        quantity = serializer.validated_data["quantity"]
+
+        stock = Product.objects.filter(id=product_id).values_list(AVAILABLE, flat=True).first()
+        if stock is None:
+            return Response({"error": "Product not found"}, status=404)
+        if stock < quantity:
+            return Response({"error": "Not enough stock"}, status=400)
+
+        token = self.get_token(request) or new_guest_token()
+        get_cart_store().set(guest_owner(token), product_id, quantity)
+        return Response({"message": "Product added to cart", "token": token})
+
+    @swagger_auto_schema(tags=['cart'], request_body=UpdateGuestCartItemInputSerializer, manual_parameters=CART_TOKEN_PARAMETERS)
+    def patch(self, request):
+        """Increment or decrement a product's quantity."""
+        serializer = UpdateGuestCartItemInputSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        token = self.get_token(request)
+        if not token:
+            return Response({"error": "X-Cart-Token is required"}, status=400)
+        product_id = serializer.validated_data["product_id"]
+        store = get_cart_store()
+
+        if serializer.validated_data["action"] == "remove":
+            quantity = store.incr(guest_owner(token), product_id, -1)
+        else:
+            stock = Product.objects.filter(id=product_id).values_list(AVAILABLE, flat=True).first()
+            if stock is None:
+                return Response({"error": "Product not found"}, status=404)
+            quantity = store.incr(guest_owner(token), product_id, 1)
+            if quantity > stock:
+                store.incr(guest_owner(token), product_id, -1)
+                return Response({"error": "Not enough stock available"}, status=400)
+
+        return Response({
+            "message": "Cart updated successfully",
+            "token": token,
+            "product_id": product_id,
+            "quantity": quantity,
+        })
+
+    @swagger_auto_schema(tags=['cart'], manual_parameters=CART_TOKEN_PARAMETERS)
+    def delete(self, request):
+        token = self.get_token(request)
+        if token:
+            get_cart_store().clear(guest_owner(token))
+        return Response({"message": "Cart cleared"})
+
 
 class MergeCartView(APIView):
     permission_classes = [IsAuthenticated]
@@ -290,32 +695,59 @@ class MergeCartView(APIView):
                 {"product_id": 3, "quantity": 1}
             ]
         }
+        or {"guest_token": "<token>"} for a cart kept by cart/guest/.
         """
         serializer = MergeCartInputSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
         guest_items = serializer.validated_data.get("items", [])
+        guest_token = serializer.validated_data.get("guest_token")
+        if guest_token:
+            # Quantities posted by the client win over the stored ones. Read now and
+            # cleared only once the merge commits, so a failed merge loses nothing
+            posted = {item["product_id"] for item in guest_items}
+            stored = get_cart_store().get(guest_owner(guest_token))
+            guest_items += [
+                {"product_id": product_id, "quantity": quantity}
+                for product_id, quantity in stored.items() if product_id not in posted
+            ]
 
-        cart, _ = Cart.objects.get_or_create(user=request.user)
+        # A product listed twice keeps its last quantity, as when the items were saved one by one
+        quantities = {item["product_id"]: item.get("quantity", 1) for item in guest_items}
+        products = Product.objects.only("id", "name", "quantity", "reserved_quantity").in_bulk(list(quantities))
 
         messages = []
+        cart_items = []
+        for product_id, quantity in quantities.items():
+            product = products.get(product_id)
+            if product is None:
+                messages.append(f"Product {product_id} does not exist and was not added.")
+                continue
 
-        for item in guest_items:
-            product = get_object_or_404(Product, id=item["product_id"])
-            quantity = item.get("quantity", 1)
-
-            if product.quantity <= 0:
+            if product.available_quantity <= 0:
                 messages.append(f"{product.name} is out of stock and was not added.")
                 continue
 
-            if product.quantity < quantity:
-                messages.append(f"{product.name} quantity reduced to {product.quantity} due to limited stock.")
-                quantity = product.quantity
+            if product.available_quantity < quantity:
+                messages.append(f"{product.name} quantity reduced to {product.available_quantity} due to limited stock.")
+                quantity = product.available_quantity
 
-            cart_item, _ = CartItem.objects.get_or_create(cart=cart, product=product)
-            cart_item.quantity = quantity
-            cart_item.save()
+            cart_items.append(CartItem(product_id=product_id, quantity=quantity))
+
+        with transaction.atomic():
+            cart, _ = Cart.objects.get_or_create(user=request.user)
+            for cart_item in cart_items:
+                cart_item.cart = cart
+            # One upsert on the (cart, product) key for the whole guest cart
+            CartItem.objects.bulk_create(
+                cart_items, update_conflicts=True, unique_fields=["cart", "product"], update_fields=["quantity"]
+            )
+            if guest_token:
+                transaction.on_commit(lambda: get_cart_store().clear(guest_owner(guest_token)))
+        # bulk_create sends no signals
+        cart_summary_cache.invalidate(request.user.id)
 
-        cart_serializer = CartSerializer(cart)
+        cart = CartSerializer.optimize_queryset(Cart.objects.all(), request).get(pk=cart.pk)
+        cart_serializer = CartSerializer(cart, context={"request": request})
         return Response({
             "cart": cart_serializer.data,
             "messages": messages
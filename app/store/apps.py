@@ -4,3 +4,22 @@ from django.apps import AppConfig
 class StoreConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'store'
+
+    def ready(self):
+        import store.signals  # noqa: F401
+        from store.cart_store import check_cart_store
+
+        check_cart_store()
+
+
+def start_worker_threads():
+    """
+    Start the background threads of a serving process. Called from
+    config.wsgi / config.asgi, so management commands and tests never run
+    them; each forked worker imports those modules and starts its own.
+    """
+    from store.recent_views import recent_views
+    from store.suggest import start_index_refresher
+
+    start_index_refresher()
+    recent_views.start_flusher()
@@ -0,0 +1,60 @@
+from django.db.models import OuterRef, Subquery
+
+from store.models import Image, Product, ProductCard
+from store.services import card_versions
+
+CARD_FIELDS = [
+    "name", "price", "old_price", "thumbnail", "brand_id", "brand_name", "category_id",
+    "category_name", "sub_category_id", "sub_category_name", "in_stock", "is_active", "created_at",
+]
+
+
+def primary_image(field="image"):
+    """A field of a product's first image, in the order the API lists them."""
+    return Subquery(
+        Image.objects.filter(products=OuterRef("pk")).order_by("-created_at", "-id").values(field)[:1]
+    )
+
+
+def card_thumbnail(product):
+    # The card-sized WebP once the image pipeline has rendered it, else the original
+    variant = (product.primary_image_variants or {}).get("card") or {}
+    return variant.get("webp") or product.primary_image or ""
+
+
+def build_card(product):
+    return ProductCard(
+        product=product,
+        name=product.name,
+        price=product.price,
+        old_price=product.old_price,
+        thumbnail=card_thumbnail(product),
+        brand_id=product.brand_id,
+        brand_name=product.brand.name if product.brand else "",
+        category_id=product.category_id,
+        category_name=product.category.name if product.category else "",
+        sub_category_id=product.sub_category_id,
+        sub_category_name=product.sub_category.name if product.sub_category else "",
+        in_stock=product.available_quantity > 0,
+        is_active=product.is_active,
+        created_at=product.created_at,
+    )
+
+
+def refresh_product_cards(product_ids):
+    """Rebuild the cards of product_ids with one read and one bulk upsert."""
+    products = (
+        Product.objects.filter(pk__in=product_ids)
+        .select_related("brand", "category", "sub_category")
+        .only(
+            "name", "price", "old_price", "quantity", "reserved_quantity", "is_active", "created_at",
+            "brand__name", "category__name", "sub_category__name",
+        )
+        .annotate(primary_image=primary_image(), primary_image_variants=primary_image("variants"))
+    )
+    cards = [build_card(product) for product in products]
+    ProductCard.objects.bulk_create(
+        cards, update_conflicts=True, unique_fields=["product"], update_fields=CARD_FIELDS + ["updated_at"]
+    )
+    card_versions.bump()
+    return len(cards)
@@ -0,0 +1,156 @@
+import secrets
+import threading
+import time
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.module_loading import import_string
+
+
+def guest_owner(token):
+    return f"guest:{token}"
+
+
+def new_guest_token():
+    return secrets.token_urlsafe(18)
+
+
+class BaseCartStore:
+    """
+    Active carts as {product_id: quantity} maps in a key-value store, keyed
+    by owner (e.g. "guest:<token>"). Every mutation is atomic on
+    the backend, so concurrent taps on the same item never lose an update;
+    quantities that drop to zero remove the item. Carts expire ttl seconds
+    after their last write.
+    """
+    def __init__(self, ttl=None, **options):
+        self.ttl = ttl or settings.CART_STORE_TTL
+
+    def get(self, owner):
+        raise NotImplementedError
+
+    def set(self, owner, product_id, quantity):
+        """Set one quantity (0 removes the item)."""
+        raise NotImplementedError
+
+    def incr(self, owner, product_id, delta):
+        """Add delta to one quantity and return the new one (0 once removed)."""
+        raise NotImplementedError
+
+    def clear(self, owner):
+        raise NotImplementedError
+
+
+class MemoryCartStore(BaseCartStore):
+    """In-process store for development and tests; carts are per worker."""
+
+    def __init__(self, **options):
+        super().__init__(**options)
+        self.lock = threading.Lock()
+        self.carts = {}
+
+    def _cart(self, owner):
+        cart, expires = self.carts.get(owner, ({}, None))
+        if expires is not None and expires < time.monotonic():
+            cart = {}
+        self.carts[owner] = (cart, time.monotonic() + self.ttl)
+        return cart
+
+    def get(self, owner):
+        with self.lock:
+            cart, expires = self.carts.get(owner, ({}, None))
+            return dict(cart) if expires is not None and expires >= time.monotonic() else {}
+
+    def set(self, owner, product_id, quantity):
+        with self.lock:
+            cart = self._cart(owner)
+            if quantity > 0:
+                cart[product_id] = quantity
+            else:
+                cart.pop(product_id, None)
+
+    def incr(self, owner, product_id, delta):
+        with self.lock:
+            cart = self._cart(owner)
+            quantity = cart.get(product_id, 0) + delta
+            if quantity > 0:
+                cart[product_id] = quantity
+            else:
+                cart.pop(product_id, None)
+            return max(quantity, 0)
+
+    def clear(self, owner):
+        with self.lock:
+            self.carts.pop(owner, None)
+
+
+class RedisCartStore(BaseCartStore):
+    """One Redis hash per cart (field: product id, value: quantity); needs redis-py."""
+
+    # HINCRBY and the removal at zero must not interleave with another tap
+    INCR_SCRIPT = """
+        local quantity = redis.call('HINCRBY', KEYS[1], ARGV[1], ARGV[2])
+        if quantity <= 0 then
+            redis.call('HDEL', KEYS[1], ARGV[1])
+            quantity = 0
+        end
+        redis.call('EXPIRE', KEYS[1], ARGV[3])
+        return quantity
+    """
+
+    def __init__(self, location, prefix="store:cart:", **options):
+        import redis
+
+        super().__init__(**options)
+        self.client = redis.Redis.from_url(location)
+        self.prefix = prefix
+        self.incr_script = self.client.register_script(self.INCR_SCRIPT)
+
+    def key(self, owner):
+        return f"{self.prefix}{owner}"
+
+    def get(self, owner):
+        return {int(product): int(quantity) for product, quantity in self.client.hgetall(self.key(owner)).items()}
+
+    def set(self, owner, product_id, quantity):
+        key = self.key(owner)
+        pipe = self.client.pipeline()
+        if quantity > 0:
+            pipe.hset(key, product_id, quantity)
+        else:
+            pipe.hdel(key, product_id)
+        pipe.expire(key, self.ttl)
+        pipe.execute()
+
+    def incr(self, owner, product_id, delta):
+        return int(self.incr_script(keys=[self.key(owner)], args=[product_id, delta, self.ttl]))
+
+    def clear(self, owner):
+        self.client.delete(self.key(owner))
+
+
+_cart_store = None
+
+
+def get_cart_store():
+    global _cart_store
+    if _cart_store is None:
+        options = dict(settings.CART_STORE)
+        _cart_store = import_string(options.pop("BACKEND"))(
+            **{name.lower(): value for name, value in options.items()}
+        )
+    return _cart_store
+
+
+def check_cart_store():
+    """
+    Refuse to run with DEBUG off on the in-process store: behind several
+    workers a guest cart would come and go with the worker that answers.
+    Called from StoreConfig.ready(), so a misconfigured deploy fails at startup.
+    """
+    backend = import_string(settings.CART_STORE["BACKEND"])
+    if not settings.DEBUG and issubclass(backend, MemoryCartStore):
+        raise ImproperlyConfigured(
+            "CART_STORE uses the per-process MemoryCartStore with DEBUG off; set CART_STORE_BACKEND to "
+            "store.cart_store.RedisCartStore and CART_STORE_LOCATION to a redis:// URL."
+        )
@@ -0,0 +1,160 @@
+import csv
+import io
+import json
+import zlib
+from xml.sax.saxutils import escape
+
+from django.conf import settings
+from django.db.models import F, Q
+
+from store.cards import primary_image
+from store.models import DeletedProduct, Product
+
+COLUMNS = [
+    "id", "sku", "title", "description", "link", "image_link", "price", "sale_price",
+    "availability", "brand", "product_type", "updated_at",
+]
+# Flush to the client (and the compressor) in chunks of about this many characters
+CHUNK_SIZE = 64 * 1024
+
+
+class ProductFeed:
+    """
+    The active catalog as a CSV, JSONL or RSS/XML shopping feed, generated
+    as a stream of text chunks. Products are read with a server-side cursor
+    and no row outlives its chunk, so memory stays flat however large the
+    catalog is. since= limits the feed to products whose own row or
+    listing card (images, brand/category names) changed after it; products
+    deactivated or deleted since then are listed as out of stock, so
+    aggregators stop selling them.
+    """
+    formats = {
+        "csv": "text/csv",
+        "jsonl": "application/x-ndjson",
+        "xml": "application/rss+xml",
+    }
+
+    def __init__(self, fmt="csv", since=None, media_base_url="", chunk_size=2000):
+        if fmt not in self.formats:
+            raise ValueError(f"Unknown feed format {fmt!r}")
+        self.format = fmt
+        self.since = since
+        self.media_base_url = media_base_url.rstrip("/")
+        self.chunk_size = chunk_size
+
+    @property
+    def content_type(self):
+        return self.formats[self.format]
+
+    def get_queryset(self):
+        if self.since is None:
+            queryset = Product.objects.filter(is_active=True)
+        else:
+            # Inactive ones too: a delta must carry the deactivations
+            queryset = Product.objects.filter(Q(updated_at__gt=self.since) | Q(card__updated_at__gt=self.since))
+        return (
+            queryset.annotate(
+                image=primary_image(),
+                image_variants=primary_image("variants"),
+                available=F("quantity") - F("reserved_quantity"),
+            )
+            .order_by("pk")
+            .values_list(
+                "id", "sku", "name", "description", "price", "old_price", "available", "is_active", "brand__name",
+                "category__name", "sub_category__name", "image", "image_variants", "updated_at",
+            )
+        )
+
+    def image_url(self, name, variants):
+        # Marketplaces want a large JPEG; fall back to the original upload
+        name = ((variants or {}).get("zoom") or {}).get("jpeg") or name
+        return f"{self.media_base_url}{settings.MEDIA_URL}{name}" if name else ""
+
+    def rows(self):
+        for (pk, sku, name, description, price, old_price, available, is_active, brand, category, sub_category,
+             image, variants, updated_at) in self.get_queryset().iterator(chunk_size=self.chunk_size):
+            on_sale = old_price and old_price > price
+            yield {
+                "id": pk,
+                "sku": sku,
+                "title": name,
+                "description": description,
+                "link": settings.FEED_PRODUCT_URL.format(id=pk),
+                "image_link": self.image_url(image, variants),
+                "price": f"{old_price if on_sale else price:.2f} {settings.FEED_CURRENCY}",
+                "sale_price": f"{price:.2f} {settings.FEED_CURRENCY}" if on_sale else "",
+                "availability": "in stock" if is_active and available > 0 else "out of stock",
+                "brand": brand or "",
+                "product_type": " > ".join(part for part in (category, sub_category) if part),
+                "updated_at": updated_at.isoformat(),
+            }
+        if self.since is not None:
+            yield from self.deleted_rows()
+
+    def deleted_rows(self):
+        deleted = DeletedProduct.objects.filter(deleted_at__gt=self.since).order_by("pk")
+        for pk, sku, deleted_at in deleted.values_list("product_id", "sku", "deleted_at").iterator(
+            chunk_size=self.chunk_size
+        ):
+            row = dict.fromkeys(COLUMNS, "")
+            row.update({
+                "id": pk,
+                "sku": sku,
+                "link": settings.FEED_PRODUCT_URL.format(id=pk),
+                "availability": "out of stock",
+                "updated_at": deleted_at.isoformat(),
+            })
+            yield row
+
+    def render_csv(self):
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=COLUMNS)
+        writer.writeheader()
+        for row in self.rows():
+            writer.writerow(row)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        yield buffer.getvalue()
+
+    def render_jsonl(self):
+        for row in self.rows():
+            yield json.dumps(row, ensure_ascii=False) + "\n"
+
+    def render_xml(self):
+        yield (
+            '<?xml version="1.0" encoding="UTF-8"?>\n'
+            '<rss version="2.0" xmlns:g="http://base.google.com/ns/1.0"><channel>\n'
+            f"<title>{escape(settings.FEED_TITLE)}</title>\n"
+        )
+        for row in self.rows():
+            fields = "".join(
+                f"<g:{column}>{escape(str(row[column]))}</g:{column}>" for column in COLUMNS if row[column] != ""
+            )
+            yield f"<item>{fields}</item>\n"
+        yield "</channel></rss>\n"
+
+    def __iter__(self):
+        """The feed as text chunks of roughly CHUNK_SIZE characters."""
+        pending, size = [], 0
+        for part in getattr(self, f"render_{self.format}")():
+            pending.append(part)
+            size += len(part)
+            if size >= CHUNK_SIZE:
+                yield "".join(pending)
+                pending, size = [], 0
+        if pending:
+            yield "".join(pending)
+
+    def iter_bytes(self, compress=False):
+        """The feed as UTF-8 bytes, gzipped on the fly when compress is set."""
+        if not compress:
+            for chunk in self:
+                yield chunk.encode()
+            return
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        for chunk in self:
+            data = compressor.compress(chunk.encode())
+            if data:
+                yield data
+        yield compressor.flush()
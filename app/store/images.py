@@ -0,0 +1,102 @@
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connections
+from django.utils import timezone
+
+from store.cards import refresh_product_cards
+from store.imaging import render_variants
+from store.models import Image
+from store.services import product_detail_cache
+
+logger = logging.getLogger(__name__)
+
+VARIANT_DIR = "images/products/variants/"
+
+_executor = None
+
+
+def get_executor():
+    """Process pool shared by the requests of this worker, started on first use."""
+    global _executor
+    if _executor is None:
+        # spawn: forked children would inherit open DB connections and threads
+        _executor = ProcessPoolExecutor(
+            max_workers=settings.IMAGE_PROCESS_WORKERS, mp_context=multiprocessing.get_context("spawn")
+        )
+    return _executor
+
+
+def variant_name(image_id, source_name, variant, fmt):
+    # Keyed by image as well: rows can share a source, e.g. the default fabfarm.jpg
+    stem = os.path.splitext(os.path.basename(source_name))[0]
+    return f"{VARIANT_DIR}{stem}-{image_id}-{variant}.{fmt}"
+
+
+def delete_variants(variants):
+    for name, entry in variants.items():
+        if name == "source":
+            continue
+        for fmt in settings.PRODUCT_IMAGE_FORMATS:
+            if entry.get(fmt):
+                default_storage.delete(entry[fmt])
+
+
+def store_variants(image_id, source_name, rendered):
+    """Save rendered variants and record them on the image, if it still shows source_name."""
+    variants = {"source": source_name}
+    for name, entry in rendered.items():
+        variants[name] = {"width": entry["width"], "height": entry["height"]}
+        for fmt in settings.PRODUCT_IMAGE_FORMATS:
+            target = variant_name(image_id, source_name, name, fmt)
+            default_storage.delete(target)
+            variants[name][fmt] = default_storage.save(target, ContentFile(entry[fmt]))
+
+    images = Image.objects.filter(pk=image_id, image=source_name)
+    product_ids = list(images.values_list("products_id", flat=True))
+    if not images.update(variants=variants, updated_at=timezone.now()):
+        # Replaced or deleted while we were rendering
+        delete_variants(variants)
+        return False
+    refresh_product_cards(product_ids)
+    for product_id in product_ids:
+        product_detail_cache.bump(product_id)
+    return True
+
+
+def process_image(image):
+    """Render and store the variants of image in this process."""
+    rendered = render_variants(
+        image.image.path, settings.PRODUCT_IMAGE_VARIANTS, settings.PRODUCT_IMAGE_FORMATS
+    )
+    return store_variants(image.pk, image.image.name, rendered)
+
+
+def _store_result(image_id, source_name, caller, future):
+    try:
+        store_variants(image_id, source_name, future.result())
+    except Exception:
+        logger.exception("Could not process product image %s (%s)", image_id, source_name)
+    finally:
+        # Normally this runs on the executor's result thread, which has its own
+        # DB connection; only an already finished future calls back inline.
+        if threading.get_ident() != caller:
+            connections.close_all()
+
+
+def schedule_image_processing(image):
+    """Render image's variants off the request path; call once the row is committed."""
+    if not settings.IMAGE_PROCESS_WORKERS:
+        return process_image(image)
+    future = get_executor().submit(
+        render_variants, image.image.path, settings.PRODUCT_IMAGE_VARIANTS, settings.PRODUCT_IMAGE_FORMATS
+    )
+    future.add_done_callback(partial(_store_result, image.pk, image.image.name, threading.get_ident()))
+    return future
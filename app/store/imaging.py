@@ -0,0 +1,48 @@
+"""
+Image resizing for the product image pipeline. Kept free of Django imports
+so it can run in freshly spawned pool processes.
+"""
+import io
+
+import PIL.Image
+import PIL.ImageOps
+
+PIL_FORMATS = {"webp": "WEBP", "jpeg": "JPEG"}
+SAVE_OPTIONS = {
+    "WEBP": {"quality": 80, "method": 4},
+    "JPEG": {"quality": 82, "optimize": True, "progressive": True},
+}
+
+
+def flatten(image):
+    """RGB copy of image, with any transparency composited onto white."""
+    if image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info):
+        image = image.convert("RGBA")
+        background = PIL.Image.new("RGB", image.size, "white")
+        background.paste(image, mask=image.getchannel("A"))
+        return background
+    return image.convert("RGB")
+
+
+def render_variants(path, sizes, formats):
+    """
+    Decode the original at path once and return every variant, encoded in
+    every format: {name: {"width", "height", format: bytes}}. Variants never
+    upscale, and each one is resized from the closest larger variant.
+    """
+    with PIL.Image.open(path) as original:
+        source = flatten(PIL.ImageOps.exif_transpose(original))
+
+    rendered = {}
+    for name, box in sorted(sizes.items(), key=lambda item: item[1][0] * item[1][1], reverse=True):
+        variant = source.copy()
+        variant.thumbnail(box, PIL.Image.LANCZOS)
+        source = variant
+        entry = {"width": variant.width, "height": variant.height}
+        for fmt in formats:
+            buffer = io.BytesIO()
+            pil_format = PIL_FORMATS[fmt]
+            variant.save(buffer, format=pil_format, **SAVE_OPTIONS[pil_format])
+            entry[fmt] = buffer.getvalue()
+        rendered[name] = entry
+    return rendered
@@ -0,0 +1,251 @@
+import csv
+import json
+import time
+from collections import defaultdict
+from dataclasses import dataclass, field
+from itertools import islice
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.utils import timezone
+
+from store.cards import refresh_product_cards
+from store.models import Brand, Category, Image, Product, SubCategory
+from store.search import get_product_search
+from store.services import cart_summary_cache, product_detail_cache
+from store.suggest import bump_generation
+
+# Product columns an import row may set; everything else comes from the name lookups
+PRODUCT_FIELDS = ["name", "price", "old_price", "quantity", "description", "is_active"]
+LOOKUP_FIELDS = ["category", "sub_category", "brand"]
+TRUE_VALUES = {"1", "true", "yes", "y"}
+
+
+class RowError(Exception):
+    pass
+
+
+def read_rows(path):
+    """Stream (line number, dict) pairs from a .csv or .jsonl file without loading it."""
+    with open(path, newline="", encoding="utf-8-sig") as handle:
+        if path.endswith(".jsonl"):
+            for line_number, line in enumerate(handle, 1):
+                if not line.strip():
+                    continue
+                try:
+                    row = json.loads(line)
+                except ValueError as exc:
+                    row = exc
+                yield line_number, row
+        else:
+            reader = csv.DictReader(handle)
+            for row in reader:
+                yield reader.line_num, row
+
+
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+@dataclass
+class ImportStats:
+    created: int = 0
+    updated: int = 0
+    images: int = 0
+    errors: list = field(default_factory=list)
+    started: float = field(default_factory=time.monotonic)
+
+    @property
+    def rows(self):
+        return self.created + self.updated + len(self.errors)
+
+    @property
+    def rate(self):
+        return self.rows / max(time.monotonic() - self.started, 1e-9)
+
+
+class CatalogImporter:
+    """
+    Upsert products by sku from an iterable of rows, a batch at a time.
+    Category, subcategory and brand names are resolved through maps loaded
+    once up front, which also checks subcategory/category consistency
+    without a query per row. A bad row is recorded and skipped; it never
+    aborts the run.
+
+    The writes bypass model signals, so after each batch the denormalized
+    copies (cards, search index, detail cache) are refreshed in bulk.
+    """
+
+    def __init__(self, batch_size=500, create_brands=False):
+        self.batch_size = batch_size
+        self.create_brands = create_brands
+        self.category_names = dict(Category.objects.values_list("id", "name"))
+        self.categories = {name.lower(): pk for pk, name in self.category_names.items()}
+        sub_categories = SubCategory.objects.values_list("id", "name", "category_id")
+        self.sub_categories = {(category_id, name.lower()): pk for pk, name, category_id in sub_categories}
+        self.sub_category_parents = {pk: category_id for pk, _, category_id in sub_categories}
+        self.brands = {name.lower(): pk for pk, name in Brand.objects.values_list("id", "name")}
+
+    def run(self, rows, on_batch=None):
+        stats = ImportStats()
+        for batch in batched(rows, self.batch_size):
+            self.import_batch(batch, stats)
+            if on_batch:
+                on_batch(stats)
+        bump_generation()
+        return stats
+
+    def import_batch(self, batch, stats):
+        products, images = {}, {}
+        # Rows updating an existing sku may leave columns out; their taxonomy is checked against the stored one
+        skus = [(row.get("sku") or "").strip() for _, row in batch if isinstance(row, dict)]
+        stored = {
+            sku: (category_id, sub_category_id)
+            for sku, category_id, sub_category_id in Product.objects.filter(sku__in=skus).values_list(
+                "sku", "category_id", "sub_category_id"
+            )
+        }
+        for line_number, row in batch:
+            try:
+                if isinstance(row, Exception):
+                    raise RowError(f"invalid JSON: {row}")
+                product, fields, image_names = self.build_product(row, stored)
+            except (RowError, ValidationError) as exc:
+                stats.errors.append((line_number, self.describe(exc)))
+                continue
+            # A sku repeated within a batch: the last row wins
+            products[product.sku] = (line_number, product, fields)
+            images[product.sku] = image_names
+
+        if not products:
+            return
+        try:
+            with transaction.atomic():
+                created, updated, repriced, product_ids = self.write_products(products)
+                image_count = self.write_images(images, product_ids)
+        except Exception as exc:
+            stats.errors.extend((line_number, f"batch failed: {exc}") for line_number, _, _ in products.values())
+            return
+
+        stats.created += created
+        stats.updated += updated
+        stats.images += image_count
+        self.refresh(list(product_ids.values()))
+        # bulk_update sends no signals; cart totals of repriced products are stale
+        cart_summary_cache.invalidate_products(repriced)
+
+    def build_product(self, row, stored=None):
+        """
+        (unsaved product, columns the row sets, image names). stored maps the
+        skus that already exist to their (category_id, sub_category_id);
+        rows for those only need the sku and the columns they change.
+        """
+        if not isinstance(row, dict):
+            raise RowError("expected an object per line")
+        sku = (row.get("sku") or "").strip()
+        if not sku:
+            raise RowError("sku is required")
+
+        values = {name: row[name] for name in PRODUCT_FIELDS if row.get(name) not in (None, "")}
+        if "is_active" in values and isinstance(values["is_active"], str):
+            values["is_active"] = values["is_active"].strip().lower() in TRUE_VALUES
+        existing = (stored or {}).get(sku)
+        resolved = self.resolve(row, existing)
+        product = Product(sku=sku, **values, **resolved)
+        # Field-level validation is in memory; FK and clean() checks were done by resolve()
+        if existing is None:
+            product.clean_fields(exclude=["category", "sub_category", "brand", "search_vector"])
+        else:
+            product.clean_fields(exclude=[f.name for f in Product._meta.fields if f.name not in {"sku", *values}])
+        # The columns this row sets; an existing product keeps the ones it leaves out
+        fields = list(values) + [name.removesuffix("_id") for name in resolved]
+
+        image_names = row.get("images") or []
+        if isinstance(image_names, str):
+            image_names = [name.strip() for name in image_names.split("|") if name.strip()]
+        return product, fields, image_names
+
+    def resolve(self, row, existing=None):
+        """
+        Ids of the lookup columns the row sets. A new product needs category
+        and sub_category; an existing one, given existing=(category_id,
+        sub_category_id), keeps whichever the row leaves out.
+        """
+        names = {name: (row.get(name) or "").strip() for name in LOOKUP_FIELDS}
+        resolved = {}
+        category_id, sub_category_id = existing or (None, None)
+        if names["category"] or existing is None:
+            category_id = resolved["category_id"] = self.categories.get(names["category"].lower())
+            if category_id is None:
+                raise RowError(f"unknown category {names['category']!r}")
+        # Same rule as Product.clean(): the subcategory must belong to the category
+        if names["sub_category"] or existing is None:
+            sub_category_id = self.sub_categories.get((category_id, names["sub_category"].lower()))
+            if sub_category_id is None:
+                category = names["category"] or self.category_names.get(category_id, "")
+                raise RowError(f"sub_category {names['sub_category']!r} does not belong to category {category!r}")
+            resolved["sub_category_id"] = sub_category_id
+        elif sub_category_id is not None and self.sub_category_parents[sub_category_id] != category_id:
+            raise RowError(f"the stored sub_category does not belong to category {names['category']!r}")
+
+        if names["brand"]:
+            resolved["brand_id"] = self.resolve_brand(names["brand"])
+        return resolved
+
+    def resolve_brand(self, name):
+        pk = self.brands.get(name.lower())
+        if pk is None:
+            if not self.create_brands:
+                raise RowError(f"unknown brand {name!r}")
+            pk = self.brands[name.lower()] = Brand.objects.create(name=name).pk
+        return pk
+
+    def write_products(self, products):
+        existing = dict(
+            Product.objects.filter(sku__in=list(products)).values_list("sku", "id")
+        )
+        to_create, to_update = [], defaultdict(list)
+        now = timezone.now()
+        for sku, (_, product, fields) in products.items():
+            if sku in existing:
+                product.pk = existing[sku]
+                product.updated_at = now  # bulk_update skips auto_now
+                to_update[tuple(fields)].append(product)
+            else:
+                to_create.append(product)
+
+        Product.objects.bulk_create(to_create)
+        # One UPDATE per column set: rows that leave out brand, is_active etc. don't overwrite them
+        for fields, group in to_update.items():
+            Product.objects.bulk_update(group, [*fields, "updated_at"])
+
+        repriced = [product.pk for fields, group in to_update.items() if "price" in fields for product in group]
+        product_ids = dict(Product.objects.filter(sku__in=list(products)).values_list("sku", "id"))
+        return len(to_create), sum(map(len, to_update.values())), repriced, product_ids
+
+    def write_images(self, images, product_ids):
+        wanted = {
+            (product_ids[sku], name) for sku, names in images.items() for name in names
+        }
+        if not wanted:
+            return 0
+        existing = set(
+            Image.objects.filter(products_id__in={pk for pk, _ in wanted}).values_list("products_id", "image")
+        )
+        new_images = [Image(products_id=pk, image=name) for pk, name in sorted(wanted - existing)]
+        Image.objects.bulk_create(new_images)
+        return len(new_images)
+
+    def refresh(self, product_ids):
+        refresh_product_cards(product_ids)
+        get_product_search().index(Product.objects.filter(pk__in=product_ids))
+        for pk in product_ids:
+            product_detail_cache.bump(pk)
+
+    @staticmethod
+    def describe(exc):
+        if isinstance(exc, ValidationError) and hasattr(exc, "message_dict"):
+            return "; ".join(f"{name}: {' '.join(messages)}" for name, messages in exc.message_dict.items())
+        return " ".join(exc.messages) if isinstance(exc, ValidationError) else str(exc)
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from store.trending import refresh_trending
+
+
+class Command(BaseCommand):
+    help = "Recompute the time-decayed trending product rankings (run periodically, e.g. every 15 minutes)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--size", type=int, default=None, help="Products kept per ranking")
+
+    def handle(self, *args, **options):
+        rows = refresh_trending(options["size"])
+        lists = len({row.category_id for row in rows})
+        self.stdout.write(self.style.SUCCESS(f"Ranked {len(rows)} products across {lists} trending lists"))
@@ -0,0 +1,46 @@
+import os
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from store.feeds import ProductFeed
+
+
+class Command(BaseCommand):
+    help = "Write the active catalog as a CSV, JSONL or XML shopping feed, e.g. hourly from cron."
+
+    def add_arguments(self, parser):
+        parser.add_argument("output", help="File to write; replaced atomically when the feed is complete")
+        parser.add_argument("--format", choices=sorted(ProductFeed.formats), default="csv")
+        parser.add_argument("--since", help="Only products changed after this ISO timestamp")
+        parser.add_argument("--gzip", action="store_true")
+        parser.add_argument("--base-url", default=settings.SITE_URL, help="Public URL media links are built on")
+
+    def handle(self, *args, **options):
+        since = None
+        if options["since"]:
+            since = parse_datetime(options["since"])
+            if since is None:
+                raise CommandError("--since must be an ISO 8601 timestamp")
+            if timezone.is_naive(since):
+                since = timezone.make_aware(since)
+
+        feed = ProductFeed(options["format"], since=since, media_base_url=options["base_url"])
+        generated_at = timezone.now()
+        started = time.monotonic()
+        output = options["output"]
+        partial = f"{output}.partial"
+        written = 0
+        with open(partial, "wb") as handle:
+            for chunk in feed.iter_bytes(compress=options["gzip"]):
+                handle.write(chunk)
+                written += len(chunk)
+        os.replace(partial, output)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Wrote {written} bytes to {output} in {time.monotonic() - started:.1f}s; "
+            f"pass --since {generated_at.isoformat()} for the next incremental feed"
+        ))
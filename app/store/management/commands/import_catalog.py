@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand
+
+from store.importer import CatalogImporter, read_rows
+
+
+class Command(BaseCommand):
+    help = (
+        "Create or update products (matched by sku) from a CSV or JSONL file. Columns: sku, name, "
+        "price, old_price, quantity, description, is_active, category, sub_category, brand and "
+        "images (storage names, separated by | in CSV or a list in JSONL). Rows for an existing sku "
+        "only need the columns they change."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="A .csv or .jsonl file")
+        parser.add_argument("--batch-size", type=int, default=500)
+        parser.add_argument("--create-brands", action="store_true", help="Create brands that don't exist yet")
+
+    def handle(self, *args, **options):
+        importer = CatalogImporter(batch_size=options["batch_size"], create_brands=options["create_brands"])
+        reported = 0
+
+        def progress(stats):
+            nonlocal reported
+            for line_number, message in stats.errors[reported:]:
+                self.stderr.write(f"line {line_number}: {message}")
+            reported = len(stats.errors)
+            self.stdout.write(f"{stats.rows} rows ({stats.rate:.0f} rows/s)")
+
+        stats = importer.run(read_rows(options["path"]), on_batch=progress)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Created {stats.created}, updated {stats.updated} products and added {stats.images} images "
+            f"at {stats.rate:.0f} rows/s; {len(stats.errors)} rows failed"
+        ))
+        if stats.images:
+            self.stdout.write("Run process_images to render the new images' variants")
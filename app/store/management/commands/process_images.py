@@ -0,0 +1,43 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from store.images import store_variants
+from store.imaging import render_variants
+from store.models import Image
+
+
+class Command(BaseCommand):
+    help = "Render the size/format variants of product images that are missing or out of date."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--all", action="store_true", help="Re-render every image, not just stale ones")
+        parser.add_argument("--workers", type=int, default=os.cpu_count())
+
+    def handle(self, *args, **options):
+        images = [
+            image for image in Image.objects.only("id", "image", "variants").order_by("id").iterator()
+            if options["all"] or image.needs_processing
+        ]
+        sizes, formats = settings.PRODUCT_IMAGE_VARIANTS, settings.PRODUCT_IMAGE_FORMATS
+
+        pool = ProcessPoolExecutor(max_workers=options["workers"], mp_context=multiprocessing.get_context("spawn"))
+        done = failed = 0
+        with pool:
+            # Rendering happens in the pool; results are stored from this thread
+            futures = {pool.submit(render_variants, image.image.path, sizes, formats): image for image in images}
+            for future in as_completed(futures):
+                image = futures[future]
+                try:
+                    store_variants(image.pk, image.image.name, future.result())
+                    done += 1
+                except Exception as exc:
+                    failed += 1
+                    self.stderr.write(f"Image {image.pk} ({image.image.name}): {exc}")
+                if (done + failed) % 100 == 0:
+                    self.stdout.write(f"Processed {done + failed}/{len(images)} images")
+
+        self.stdout.write(self.style.SUCCESS(f"Processed {done} images, {failed} failed"))
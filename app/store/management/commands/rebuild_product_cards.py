@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from store.cards import refresh_product_cards
+from store.models import Product
+
+
+class Command(BaseCommand):
+    help = "Rebuild the denormalized product cards used by listing endpoints."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        ids = list(Product.objects.order_by("id").values_list("id", flat=True))
+        built = 0
+        for start in range(0, len(ids), batch_size):
+            built += refresh_product_cards(ids[start:start + batch_size])
+            self.stdout.write(f"Built {built}/{len(ids)} cards")
+
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {built} product cards"))
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from store.models import Product
+from store.search import get_product_search
+
+
+class Command(BaseCommand):
+    help = "Reindex every product, e.g. after changing PRODUCT_SEARCH_CONFIG or the weights."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        search = get_product_search()
+        search.ensure_schema()
+
+        ids = list(Product.objects.order_by("id").values_list("id", flat=True))
+        indexed = 0
+        for start in range(0, len(ids), batch_size):
+            indexed += search.index(Product.objects.filter(pk__in=ids[start:start + batch_size]))
+            self.stdout.write(f"Indexed {indexed}/{len(ids)} products")
+
+        self.stdout.write(self.style.SUCCESS(f"Search index rebuilt for {indexed} products"))
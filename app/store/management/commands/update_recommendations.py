@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from store.recommendations import update_recommendations
+
+
+class Command(BaseCommand):
+    help = "Fold new orders into the \"also bought\" co-occurrence matrix and re-rank affected products."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rebuild", action="store_true", help="Start over from the first order")
+
+    def handle(self, *args, **options):
+        orders, products = update_recommendations(rebuild=options["rebuild"])
+        self.stdout.write(self.style.SUCCESS(f"Processed {orders} orders; re-ranked {products} products"))
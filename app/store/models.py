@@ -1,11 +1,13 @@
 from django.db import models
+from django.db.models.functions import Coalesce
 from django.urls import reverse
 from django.utils.text import slugify
 from config.base import TimeStampModel
-import PIL.Image
 from accounts.models import User
 from django.core.validators import MaxValueValidator, MinValueValidator
 from django.core.exceptions import ValidationError
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 from django.db.models.signals import post_save,pre_save
 from django.dispatch import receiver
 
@@ -46,24 +48,81 @@ class Brand(TimeStampModel):
     def __str__(self):
         return self.name
 
+class ProductQuerySet(models.QuerySet):
+    def active(self):
+        return self.filter(is_active=True)
+
+    def for_listing(self):
+        """
+        Load everything ProductSerializer reads (sub_category, its category and
+        the images) up front, so a page costs a fixed number of queries.
+        """
+        return (
+            self.select_related("sub_category__category")
+            .prefetch_related("images")
+            .defer("search_vector")
+        )
+
+
+class SearchVectorIndex(GinIndex):
+    """
+    GIN index for full-text search on Postgres. Other backends search an
+    FTS5 table instead (store.search) and get a plain index, so the same
+    migrations run on the SQLite test setup.
+    """
+    def create_sql(self, model, schema_editor, using="", **kwargs):
+        if schema_editor.connection.vendor != "postgresql":
+            return models.Index.create_sql(self, model, schema_editor, **kwargs)
+        return super().create_sql(model, schema_editor, using=using, **kwargs)
+
+
 class Product(TimeStampModel):
     name = models.CharField(max_length=64)
-    sku = models.CharField(max_length=64)
+    sku = models.CharField(max_length=64, unique=True)
     price = models.FloatField(validators=[MinValueValidator(0.0)],default=0.0)
     old_price = models.FloatField(validators=[MinValueValidator(0.0)],default=0.0,blank=True)
     is_active = models.BooleanField(default=True)
     quantity = models.PositiveIntegerField()
+    # Units held for unpaid online orders (orders.StockReservation); kept by conditional UPDATEs
+    reserved_quantity = models.PositiveIntegerField(default=0, editable=False)
     description = models.TextField()
     category = models.ForeignKey('Category',on_delete=models.CASCADE,related_name="products",null=True,blank=True)
     sub_category = models.ForeignKey('SubCategory',on_delete=models.CASCADE,related_name="products",null=True,blank=True)
     brand = models.ForeignKey(Brand,on_delete=models.CASCADE,related_name="products",null=True,blank=True)
+    # Maintained by store.search; NULL rows are filled in after every migrate
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    objects = ProductQuerySet.as_manager()
+
     class Meta:
         db_table = "products"
         ordering = ["-created_at"]
+        indexes = [SearchVectorIndex(fields=["search_vector"], name="products_search_gin")]
 
     def __str__(self):
         return f"{self.id} -> {self.name} -> {self.sub_category.name} -> {self.category.name}"
 
+    @property
+    def available_quantity(self):
+        return max(self.quantity - self.reserved_quantity, 0)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # The price as loaded; lets the cart summary signal skip saves that keep it
+        instance.loaded_price = instance.__dict__.get("price")
+        return instance
+
+    def save(self, *args, **kwargs):
+        # reserved_quantity is only ever moved by the UPDATEs in orders.services;
+        # a full save of an instance loaded before a hold must not write it back
+        if not self._state.adding and kwargs.get("update_fields") is None and not kwargs.get("force_insert"):
+            kwargs["update_fields"] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name != "reserved_quantity"
+            ]
+        super().save(*args, **kwargs)
+
     def clean(self):
         sub_category_list = SubCategory.objects.filter(category = self.category).values_list("id",flat = True)
         if not self.sub_category_id in sub_category_list:
@@ -75,17 +134,120 @@ class Product(TimeStampModel):
 class Image(TimeStampModel):
     image = models.ImageField(upload_to='images/products/main/',default = "fabfarm.jpg")
     products = models.ForeignKey("Product",on_delete=models.CASCADE,related_name='images')
+    # Resized copies of the untouched original, filled in by store.images:
+    # {"source": image name, "<variant>": {"width", "height", "<format>": storage name}}
+    variants = models.JSONField(default=dict, blank=True, editable=False)
 
     class Meta:
         ordering = ['-created_at']
-         
-    def save(self,*args,**kwargs):
-        super().save(*args,**kwargs)
-        img = PIL.Image.open(self.image.path)
-        output_size = (500,400)
-        img.thumbnail(output_size)
-        img.save(self.image.path)
 
+    @property
+    def needs_processing(self):
+        return bool(self.image) and self.variants.get("source") != self.image.name
+
+
+
+class ProductCard(models.Model):
+    """
+    Denormalized listing tile: exactly what a product list renders, kept in
+    step with Product/Image/Brand/Category/SubCategory writes by store.cards.
+    """
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, primary_key=True, related_name="card")
+    name = models.CharField(max_length=64)
+    price = models.FloatField(default=0.0)
+    old_price = models.FloatField(default=0.0)
+    thumbnail = models.CharField(max_length=255, blank=True)
+    brand_id = models.PositiveIntegerField(null=True)
+    brand_name = models.CharField(max_length=64, blank=True)
+    category_id = models.PositiveIntegerField(null=True)
+    category_name = models.CharField(max_length=64, blank=True)
+    sub_category_id = models.PositiveIntegerField(null=True)
+    sub_category_name = models.CharField(max_length=64, blank=True)
+    in_stock = models.BooleanField(default=False)
+    is_active = models.BooleanField(default=True)
+    created_at = models.DateTimeField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = "product_cards"
+        ordering = ["-created_at"]
+        # One partial index per listing scan; keyset pages walk them with (field, product)
+        indexes = [
+            models.Index(fields=["category_id", "-created_at", "-product"], condition=models.Q(is_active=True), name="card_category_recent"),
+            models.Index(fields=["category_id", "price", "product"], condition=models.Q(is_active=True), name="card_category_price"),
+            models.Index(fields=["sub_category_id", "-created_at", "-product"], condition=models.Q(is_active=True), name="card_subcategory_recent"),
+            models.Index(fields=["sub_category_id", "price", "product"], condition=models.Q(is_active=True), name="card_subcategory_price"),
+            models.Index(fields=["-created_at", "-product"], condition=models.Q(is_active=True), name="card_recent"),
+            models.Index(fields=["price", "product"], condition=models.Q(is_active=True), name="card_price"),
+        ]
+
+    def __str__(self):
+        return self.name
+
+
+class DeletedProduct(models.Model):
+    """Tombstone of a deleted product, so incremental feeds can tell aggregators it is gone."""
+    product_id = models.PositiveIntegerField()
+    sku = models.CharField(max_length=64)
+    deleted_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        db_table = "deleted_products"
+
+    def __str__(self):
+        return f"{self.sku} (deleted)"
+
+
+class TrendingProduct(models.Model):
+    """Precomputed trending ranking written by store.trending; category is null for the global list."""
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name="trending", null=True, blank=True)
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name="trending")
+    rank = models.PositiveIntegerField()
+    score = models.FloatField()
+    computed_at = models.DateTimeField()
+
+    class Meta:
+        db_table = "trending_products"
+        ordering = ["category", "rank"]
+        indexes = [models.Index(fields=["category", "rank"], name="trending_category_rank")]
+
+    def __str__(self):
+        return f"#{self.rank} {self.product_id}"
+
+
+class ProductCooccurrence(models.Model):
+    """
+    Sparse item-item matrix of store.recommendations: in how many orders
+    product and other were bought together, stored in both directions.
+    The diagonal (other == product) counts the orders containing product.
+    """
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name="cooccurrences")
+    other = models.ForeignKey(Product, on_delete=models.CASCADE, related_name="+")
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        db_table = "product_cooccurrences"
+        constraints = [models.UniqueConstraint(fields=["product", "other"], name="unique_cooccurrence")]
+
+
+class ProductNeighbour(models.Model):
+    """Top-K "also bought" products per product, ranked by cosine similarity."""
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name="neighbours")
+    neighbour = models.ForeignKey(Product, on_delete=models.CASCADE, related_name="neighbour_of")
+    rank = models.PositiveSmallIntegerField()
+    score = models.FloatField()
+
+    class Meta:
+        db_table = "product_neighbours"
+        ordering = ["product", "rank"]
+        indexes = [models.Index(fields=["product", "rank"], name="neighbour_product_rank")]
+
+
+class RecommenderState(models.Model):
+    """Progress of incremental jobs over the order history, one row per job."""
+    name = models.CharField(max_length=64, unique=True)
+    last_order_id = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
 
 
 class Wishlist(TimeStampModel):
@@ -94,18 +256,46 @@ class Wishlist(TimeStampModel):
 
     class Meta:
         ordering = ['-created_at']
+        constraints = [
+            models.UniqueConstraint(fields=["user", "product"], name="unique_wishlist_item"),
+        ]
+        indexes = [
+            # The wishlist page and the id list read only this index
+            models.Index(fields=["user", "-created_at"], include=["product"], name="wishlist_user_latest"),
+        ]
     
     def __str__(self):
         return f"{self.product.name}"
 
 
 
+class CartItemQuerySet(models.QuerySet):
+    def with_subtotals(self):
+        return self.annotate(line_subtotal=models.F("quantity") * models.F("product__price"))
+
+    def totals(self):
+        """Line count, units and total price of these items in one aggregate query."""
+        totals = self.aggregate(
+            item_count=models.Count("id"),
+            total_quantity=Coalesce(models.Sum("quantity"), 0),
+            total_price=Coalesce(
+                models.Sum(models.F("quantity") * models.F("product__price"), output_field=models.FloatField()), 0.0
+            ),
+        )
+        totals["total_price"] = round(totals["total_price"], 2)
+        return totals
+
+
 class Cart(TimeStampModel):
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name="cart")
 
     @property
     def total_price(self):
-        return sum(item.subtotal for item in self.items.all())
+        prefetched = getattr(self, "_prefetched_objects_cache", {}).get("items")
+        if prefetched is not None:
+            # The items are being serialized anyway
+            return round(sum(item.subtotal for item in prefetched), 2)
+        return self.items.totals()["total_price"]
 
     def __str__(self):
         return f"Cart ({self.user})"
@@ -116,18 +306,17 @@ class CartItem(models.Model):
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
     quantity = models.PositiveIntegerField(default=1)
 
+    objects = CartItemQuerySet.as_manager()
+
     class Meta:
         unique_together = ('cart', 'product')
 
     @property
     def subtotal(self):
+        if hasattr(self, "line_subtotal"):
+            return self.line_subtotal
         return self.product.price * self.quantity
     
-    # Add this property
-    @property
-    def subtotal(self):
-        return self.quantity * self.price
-    
     def __str__(self):
         return f"{self.product.name} ({self.quantity})"
 
@@ -138,4 +327,11 @@ class RecentView(TimeStampModel):
 
     class Meta:
         ordering = ["-created_at"]
+        constraints = [
+            models.UniqueConstraint(fields=["user", "product"], name="unique_recent_view"),
+        ]
+        indexes = [
+            # "Recently viewed" reads a user's latest rows
+            models.Index(fields=["user", "-updated_at"], name="recent_view_user_latest"),
+        ]
 
@@ -0,0 +1,136 @@
+import atexit
+import logging
+import os
+import threading
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import Case, DateTimeField, F, IntegerField, Value, When
+from django.utils import timezone
+
+from accounts.models import User
+from store.models import Product, RecentView
+
+logger = logging.getLogger(__name__)
+
+FLUSH_BATCH_SIZE = 500
+
+
+def write_views(pending):
+    """
+    Add buffered views to RecentView: {(user_id, product_id): (count, last_seen)}.
+    Per batch: one insert of the missing rows, one read of their ids and one
+    UPDATE that adds each row's count with F() and moves updated_at forward.
+    """
+    pending = dict(pending)
+    user_ids = set(User.objects.filter(pk__in={user for user, _ in pending}).values_list("pk", flat=True))
+    product_ids = set(Product.objects.filter(pk__in={product for _, product in pending}).values_list("pk", flat=True))
+    # Views of products or users deleted since are dropped
+    keys = sorted(key for key in pending if key[0] in user_ids and key[1] in product_ids)
+
+    for start in range(0, len(keys), FLUSH_BATCH_SIZE):
+        batch = keys[start:start + FLUSH_BATCH_SIZE]
+        with transaction.atomic():
+            RecentView.objects.bulk_create(
+                [RecentView(user_id=user, product_id=product, views_counter=0) for user, product in batch],
+                ignore_conflicts=True,
+            )
+            rows = RecentView.objects.filter(
+                user_id__in={user for user, _ in batch}, product_id__in={product for _, product in batch}
+            ).values_list("pk", "user_id", "product_id")
+            ids = {(user, product): pk for pk, user, product in rows}
+            counts = [When(pk=ids[key], then=Value(pending[key][0])) for key in batch]
+            seen = [When(pk=ids[key], then=Value(pending[key][1])) for key in batch]
+            RecentView.objects.filter(pk__in=[ids[key] for key in batch]).update(
+                views_counter=F("views_counter") + Case(*counts, output_field=IntegerField()),
+                updated_at=Case(*seen, output_field=DateTimeField()),
+            )
+    return len(keys)
+
+
+class RecentViewBuffer:
+    """
+    In-process write-behind buffer for product views. record() only touches
+    a dict under a lock, so the request path never writes; repeat views of
+    a product by the same user coalesce into one counter. The flusher
+    thread, started by the serving process (see start_flusher), writes the
+    buffer out every flush_interval seconds, or sooner when it holds
+    max_size pairs; without it a full buffer is written inline. Whatever
+    is left is written once more at interpreter exit.
+    """
+
+    def __init__(self, flush_interval, max_size):
+        self.flush_interval = flush_interval
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.wakeup = threading.Event()
+        self.pid = None
+
+    def record(self, user_id, product_id):
+        with self.lock:
+            count, _ = self.pending.get((user_id, product_id), (0, None))
+            self.pending[(user_id, product_id)] = (count + 1, timezone.now())
+            full = len(self.pending) >= self.max_size
+        if full:
+            if self.pid == os.getpid():
+                self.wakeup.set()
+            else:
+                self.flush()
+
+    def pending_for(self, user_id):
+        """{product_id: last_seen} of this user's views not written yet."""
+        with self.lock:
+            return {product: seen for (user, product), (_, seen) in self.pending.items() if user == user_id}
+
+    def take(self):
+        with self.lock:
+            pending, self.pending = self.pending, {}
+        return pending
+
+    def flush(self):
+        pending = self.take()
+        if not pending:
+            return 0
+        try:
+            return write_views(pending)
+        except Exception:
+            logger.exception("Could not write %s buffered product views", len(pending))
+            return 0
+
+    def start_flusher(self):
+        """Start the flusher thread of this process, unless flush_interval is 0."""
+        # Threads don't survive a fork, so a forked worker starts its own
+        if not self.flush_interval or self.pid == os.getpid():
+            return
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            self.pid = os.getpid()
+            threading.Thread(target=self.run, name="recent-views-flusher", daemon=True).start()
+
+    def run(self):
+        while True:
+            self.wakeup.wait(self.flush_interval)
+            self.wakeup.clear()
+            self.flush()
+            connections.close_all()
+
+
+recent_views = RecentViewBuffer(
+    flush_interval=settings.RECENT_VIEWS_FLUSH_INTERVAL, max_size=settings.RECENT_VIEWS_BUFFER_SIZE
+)
+atexit.register(recent_views.flush)
+
+
+def recently_viewed_ids(user_id, limit=None):
+    """The user's most recently viewed product ids, newest first, buffered views included."""
+    limit = min(limit or settings.RECENT_VIEWS_LIMIT, settings.RECENT_VIEWS_LIMIT)
+    seen = dict(
+        RecentView.objects.filter(user_id=user_id)
+        .order_by("-updated_at")
+        .values_list("product_id", "updated_at")[:limit]
+    )
+    for product_id, last_seen in recent_views.pending_for(user_id).items():
+        seen[product_id] = max(last_seen, seen.get(product_id, last_seen))
+    return sorted(seen, key=seen.get, reverse=True)[:limit]
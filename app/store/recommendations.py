@@ -0,0 +1,151 @@
+import heapq
+import math
+from collections import Counter
+from datetime import timedelta
+from itertools import combinations, groupby
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, Exists, F, IntegerField, Max, Min, OuterRef, Q, Value, When
+from django.utils import timezone
+
+from orders.models import Order, OrderItem, StockReservation
+from store.models import ProductCooccurrence, ProductNeighbour, RecommenderState
+
+STATE_NAME = "also-bought"
+NON_SALE_STATUSES = ["CANCELLED", "FAILED"]
+# Unpaid online orders; they may still be paid, fail or be cancelled by the reservation sweeper
+UNSETTLED = Q(status="PENDING") & ~Q(payment_method="COD")
+BATCH_SIZE = 500
+
+
+def awaiting_settlement(now=None):
+    """
+    Unsettled orders whose outcome is still coming: they hold stock the
+    sweeper will release, or are too young to have lost it. Older ones
+    without holds (placed before reservations existed) are never swept,
+    so they are counted as non-sales instead of being waited for.
+    """
+    cutoff = (now or timezone.now()) - timedelta(seconds=settings.STOCK_RESERVATION_TTL)
+    holds = StockReservation.objects.filter(order_id=OuterRef("pk"))
+    return UNSETTLED & (Exists(holds) | Q(created_at__gt=cutoff))
+
+
+def count_pairs(first_order_id, last_order_id):
+    """Co-occurrence deltas {(product, other): count} of the orders in (first, last]."""
+    items = (
+        OrderItem.objects.filter(order_id__gt=first_order_id, order_id__lte=last_order_id)
+        .exclude(order__status__in=NON_SALE_STATUSES)
+        # Below the bound every unsettled order is a stale one
+        .exclude(Q(order__status="PENDING") & ~Q(order__payment_method="COD"))
+        .order_by("order_id")
+        .values_list("order_id", "product_id")
+    )
+    deltas = Counter()
+    for _, rows in groupby(items.iterator(chunk_size=5000), key=lambda row: row[0]):
+        products = sorted({product for _, product in rows})
+        if len(products) > settings.RECOMMENDATION_MAX_ORDER_SIZE:
+            # Bulk orders say little about what goes together and cost O(n^2) pairs
+            continue
+        for product in products:
+            deltas[product, product] += 1
+        for a, b in combinations(products, 2):
+            deltas[a, b] += 1
+            deltas[b, a] += 1
+    return deltas
+
+
+def add_counts(deltas):
+    """Add deltas to the stored matrix: per batch one insert, one id read and one UPDATE ... + CASE."""
+    keys = sorted(deltas)
+    for start in range(0, len(keys), BATCH_SIZE):
+        batch = keys[start:start + BATCH_SIZE]
+        ProductCooccurrence.objects.bulk_create(
+            [ProductCooccurrence(product_id=a, other_id=b) for a, b in batch], ignore_conflicts=True
+        )
+        rows = ProductCooccurrence.objects.filter(
+            product_id__in={a for a, _ in batch}, other_id__in={b for _, b in batch}
+        ).values_list("pk", "product_id", "other_id")
+        ids = {(a, b): pk for pk, a, b in rows}
+        ProductCooccurrence.objects.filter(pk__in=[ids[key] for key in batch]).update(
+            count=F("count") + Case(
+                *[When(pk=ids[key], then=Value(deltas[key])) for key in batch], output_field=IntegerField()
+            )
+        )
+
+
+def rank_neighbours(product_ids):
+    """
+    Rebuild the top-K lists of product_ids. Similarity is cosine over the
+    order vectors: together(a, b) / sqrt(orders(a) * orders(b)).
+    """
+    product_ids = sorted(product_ids)
+    for start in range(0, len(product_ids), BATCH_SIZE):
+        batch = product_ids[start:start + BATCH_SIZE]
+        rows = list(
+            ProductCooccurrence.objects.filter(product_id__in=batch).values_list("product_id", "other_id", "count")
+        )
+        others = {other for _, other, _ in rows}
+        totals = dict(
+            ProductCooccurrence.objects.filter(product_id__in=others | set(batch), other_id=F("product_id"))
+            .values_list("product_id", "count")
+        )
+
+        candidates = {}
+        for product, other, count in rows:
+            if other != product and count >= settings.RECOMMENDATION_MIN_SUPPORT:
+                score = count / math.sqrt(totals[product] * totals[other])
+                candidates.setdefault(product, []).append((score, other))
+
+        neighbours = []
+        for product, scored in candidates.items():
+            best = heapq.nlargest(settings.RECOMMENDATION_NEIGHBOURS, scored)
+            neighbours += [
+                ProductNeighbour(product_id=product, neighbour_id=other, rank=rank, score=score)
+                for rank, (score, other) in enumerate(best, 1)
+            ]
+        ProductNeighbour.objects.filter(product_id__in=batch).delete()
+        ProductNeighbour.objects.bulk_create(neighbours)
+
+
+def update_recommendations(rebuild=False):
+    """
+    Fold the orders placed since the last run into the co-occurrence matrix
+    and re-rank the products whose similarities changed. Orders awaiting
+    an online payment, and the ones after them, wait for a later run;
+    see awaiting_settlement().
+    Returns (orders processed, products re-ranked).
+    """
+    with transaction.atomic():
+        state, _ = RecommenderState.objects.select_for_update().get_or_create(name=STATE_NAME)
+        if rebuild:
+            ProductCooccurrence.objects.all().delete()
+            ProductNeighbour.objects.all().delete()
+            state.last_order_id = 0
+
+        # Fixed upper bound, so orders placed during the run wait for the next one.
+        # It stops short of the oldest unsettled order: counts are never taken back,
+        # so an order is only counted once it is known whether it is a sale
+        last_order_id = Order.objects.aggregate(last=Max("id"))["last"] or 0
+        first_unsettled = (
+            Order.objects.filter(awaiting_settlement(), id__gt=state.last_order_id)
+            .aggregate(first=Min("id"))["first"]
+        )
+        if first_unsettled is not None:
+            last_order_id = min(last_order_id, first_unsettled - 1)
+        if last_order_id <= state.last_order_id:
+            return 0, 0
+        deltas = count_pairs(state.last_order_id, last_order_id)
+        add_counts(deltas)
+
+        # A product's order total is in every similarity of its partners too
+        touched = {product for product, _ in deltas}
+        affected = touched | set(
+            ProductCooccurrence.objects.filter(other_id__in=touched).values_list("product_id", flat=True)
+        )
+        rank_neighbours(affected)
+
+        orders = Order.objects.filter(id__gt=state.last_order_id, id__lte=last_order_id).count()
+        state.last_order_id = last_order_id
+        state.save()
+    return orders, len(affected)
@@ -0,0 +1,137 @@
+import re
+
+from django.conf import settings
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector
+from django.db import connection
+from django.db.models import Case, F, FloatField, OuterRef, Subquery, Value, When
+
+from store.models import Brand, Product
+
+TERM_RE = re.compile(r"\w+")
+MAX_TERMS = 8
+
+
+def search_terms(text: str):
+    """Split user input into at most MAX_TERMS lowercase word tokens."""
+    return TERM_RE.findall(text.lower())[:MAX_TERMS]
+
+
+class PostgresProductSearch:
+    """
+    Full-text search on the products.search_vector tsvector column.
+    Name, brand and description are weighted A, B and C, matching is by
+    prefix on every term and results are ranked with ts_rank.
+    """
+    # Created by hand by earlier versions of rebuild_search_index; the GIN
+    # index is now declared on Product.Meta
+    legacy_index_name = "products_search_vector_gin"
+
+    def __init__(self, config: str):
+        self.config = config
+
+    def ensure_schema(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f"DROP INDEX IF EXISTS {self.legacy_index_name}")
+
+    def backfill(self, batch_size=1000):
+        """Index the products whose vector is still NULL, e.g. ones saved before the column existed."""
+        missing = Product.objects.filter(search_vector__isnull=True).order_by("pk").values_list("pk", flat=True)
+        indexed, last = 0, 0
+        while ids := list(missing.filter(pk__gt=last)[:batch_size]):
+            indexed += self.index(Product.objects.filter(pk__in=ids))
+            last = ids[-1]
+        return indexed
+
+    def index(self, queryset):
+        brand_name = Subquery(Brand.objects.filter(pk=OuterRef("brand_id")).values("name")[:1])
+        return queryset.update(
+            search_vector=(
+                SearchVector("name", weight="A", config=self.config)
+                + SearchVector(brand_name, weight="B", config=self.config)
+                + SearchVector("description", weight="C", config=self.config)
+            )
+        )
+
+    def remove(self, ids):
+        # The vector lives on the product row itself
+        pass
+
+    def search(self, queryset, text: str, vector_field: str = "search_vector"):
+        terms = search_terms(text)
+        if not terms:
+            return queryset
+        query = SearchQuery(
+            " & ".join(f"{term}:*" for term in terms), search_type="raw", config=self.config
+        )
+        return queryset.filter(**{vector_field: query}).annotate(
+            search_rank=SearchRank(F(vector_field), query)
+        )
+
+
+class SqliteProductSearch:
+    """
+    FTS5 fallback so the test suite can run without Postgres. Ranked with
+    bm25 using the same name > brand > description weighting.
+    """
+    table = "products_fts"
+    weights = (10.0, 5.0, 1.0)
+
+    def ensure_schema(self):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {self.table} USING fts5(name, brand, description)"
+            )
+
+    def index(self, queryset):
+        self.ensure_schema()
+        rows = list(queryset.values_list("id", "name", "brand__name", "description"))
+        with connection.cursor() as cursor:
+            cursor.executemany(f"DELETE FROM {self.table} WHERE rowid = %s", [(row[0],) for row in rows])
+            cursor.executemany(
+                f"INSERT INTO {self.table} (rowid, name, brand, description) VALUES (%s, %s, %s, %s)",
+                [(pk, name, brand or "", description) for pk, name, brand, description in rows],
+            )
+        return len(rows)
+
+    def backfill(self, batch_size=1000):
+        """Index the products missing from the FTS table."""
+        self.ensure_schema()
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT rowid FROM {self.table}")
+            present = {pk for pk, in cursor.fetchall()}
+        missing = [pk for pk in Product.objects.order_by("pk").values_list("pk", flat=True) if pk not in present]
+        for start in range(0, len(missing), batch_size):
+            self.index(Product.objects.filter(pk__in=missing[start:start + batch_size]))
+        return len(missing)
+
+    def remove(self, ids):
+        self.ensure_schema()
+        with connection.cursor() as cursor:
+            cursor.executemany(f"DELETE FROM {self.table} WHERE rowid = %s", [(pk,) for pk in ids])
+
+    def search(self, queryset, text: str, vector_field: str = None):
+        # FTS5 rowids are product ids, which is also the pk of a ProductCard
+        terms = search_terms(text)
+        if not terms:
+            return queryset
+        self.ensure_schema()
+        match = " ".join(f'"{term}"*' for term in terms)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT rowid, bm25({self.table}, %s, %s, %s) FROM {self.table} WHERE {self.table} MATCH %s",
+                [*self.weights, match],
+            )
+            # bm25 is lower-is-better; flip it so both backends sort rank descending
+            scores = {pk: -score for pk, score in cursor.fetchall()}
+        rank = Case(
+            *[When(pk=pk, then=Value(score)) for pk, score in scores.items()],
+            default=Value(0.0),
+            output_field=FloatField(),
+        )
+        return queryset.filter(pk__in=list(scores)).annotate(search_rank=rank)
+
+
+def get_product_search():
+    if connection.vendor == "postgresql":
+        return PostgresProductSearch(settings.PRODUCT_SEARCH_CONFIG)
+    return SqliteProductSearch()
@@ -0,0 +1,235 @@
+import hashlib
+import random
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Q
+
+from store.models import Brand, CartItem, Category, SubCategory
+
+
+class VersionedCache:
+    """
+    Read-through cache whose entries are invalidated all at once by bumping
+    a version counter instead of deleting keys one by one.
+    """
+    def __init__(self, namespace: str, timeout: int = None):
+        self.namespace = namespace
+        self.timeout = timeout
+
+    @property
+    def version_key(self):
+        return f"store:{self.namespace}:version"
+
+    def get_version(self):
+        version = cache.get(self.version_key)
+        if version is None:
+            # Seed with a timestamp so an evicted counter never falls back to
+            # a version that still has entries cached under it.
+            cache.add(self.version_key, time.time_ns(), timeout=None)
+            version = cache.get(self.version_key)
+        return version
+
+    def bump(self):
+        try:
+            cache.incr(self.version_key)
+        except ValueError:
+            cache.add(self.version_key, time.time_ns(), timeout=None)
+
+    def make_key(self, key: str):
+        return f"store:{self.namespace}:v{self.get_version()}:{key}"
+
+    def get_or_set(self, key: str, producer):
+        """Return the cached value for key, calling producer() on a miss."""
+        cache_key = self.make_key(key)
+        value = cache.get(cache_key)
+        if value is None:
+            value = producer()
+            cache.set(cache_key, value, self.timeout)
+        return value
+
+
+taxonomy_cache = VersionedCache("taxonomy", timeout=settings.TAXONOMY_CACHE_TIMEOUT)
+facets_cache = VersionedCache("facets", timeout=settings.FACETS_CACHE_TIMEOUT)
+# Bumped by every product card write; the validator of the card listings
+card_versions = VersionedCache("cards")
+
+
+class ProductDetailCache:
+    """
+    One cache entry per product and response shape, tagged with the product
+    and taxonomy versions it was rendered at. A version bump or the soft
+    expiry makes an entry stale. Only the request that takes the rebuild
+    lock goes to the database; the others keep serving the stale copy, so a
+    hot product expiring or being edited doesn't stampede Postgres.
+    """
+    lock_timeout = 10
+    lock_wait = 0.05
+
+    def __init__(self, timeout: int, grace: int):
+        self.timeout = timeout
+        self.grace = grace
+
+    def version_key(self, pk):
+        return f"store:product:{pk}:version"
+
+    def bump(self, pk):
+        try:
+            cache.incr(self.version_key(pk))
+        except ValueError:
+            cache.add(self.version_key(pk), time.time_ns(), timeout=None)
+
+    def get_versions(self, pk):
+        product_key = self.version_key(pk)
+        found = cache.get_many([product_key, taxonomy_cache.version_key])
+        if product_key not in found:
+            cache.add(product_key, time.time_ns(), timeout=None)
+            found[product_key] = cache.get(product_key)
+        taxonomy_version = found.get(taxonomy_cache.version_key) or taxonomy_cache.get_version()
+        return found[product_key], taxonomy_version
+
+    def get_or_build(self, pk, shape: str, build):
+        """
+        Return the entry for product pk, calling build() on a miss. build()
+        returns a dict, which is cached as-is along with its versions.
+        """
+        key = f"store:product:{pk}:{shape}"
+        # Read the versions before building, so a write racing the build
+        # leaves the entry tagged as stale rather than the other way round
+        versions = self.get_versions(pk)
+        entry = cache.get(key)
+        if entry is not None and entry["versions"] == versions and entry["fresh_until"] > time.time():
+            return entry
+
+        lock_key = f"{key}:lock"
+        if cache.add(lock_key, 1, self.lock_timeout):
+            try:
+                entry = self.store(key, versions, build())
+            finally:
+                cache.delete(lock_key)
+            return entry
+        if entry is not None:
+            return entry
+
+        # Nothing to fall back on: give the lock holder a moment, then build anyway
+        deadline = time.monotonic() + self.lock_timeout / 10
+        while time.monotonic() < deadline:
+            time.sleep(self.lock_wait)
+            entry = cache.get(key)
+            if entry is not None and entry["versions"] == versions:
+                return entry
+        return {"versions": versions, **build()}
+
+    def store(self, key, versions, value):
+        # Jitter the soft expiry so entries written together don't expire together
+        fresh_for = self.timeout * random.uniform(0.9, 1.0)
+        entry = {"versions": versions, "fresh_until": time.time() + fresh_for, **value}
+        cache.set(key, entry, self.timeout + self.grace)
+        return entry
+
+
+product_detail_cache = ProductDetailCache(
+    timeout=settings.PRODUCT_DETAIL_CACHE_TIMEOUT, grace=settings.PRODUCT_DETAIL_CACHE_GRACE
+)
+
+
+class CartSummaryCache:
+    """
+    Per-user cart totals (lines, units, price) for the header badge. Built
+    with one aggregate query on a miss and deleted by every cart write, so
+    polling it is a cache hit until the cart actually changes.
+    """
+    def __init__(self, timeout):
+        self.timeout = timeout
+
+    def make_key(self, user_id):
+        return f"store:cart:{user_id}:summary"
+
+    def get(self, user_id):
+        key = self.make_key(user_id)
+        summary = cache.get(key)
+        if summary is None:
+            summary = CartItem.objects.filter(cart__user_id=user_id).totals()
+            cache.set(key, summary, self.timeout)
+        return summary
+
+    def invalidate(self, *user_ids):
+        cache.delete_many([self.make_key(user_id) for user_id in user_ids])
+
+    def invalidate_products(self, product_ids):
+        """Drop the summaries of every cart holding one of product_ids, e.g. after a price change."""
+        self.invalidate(*CartItem.objects.filter(product_id__in=product_ids).values_list("cart__user_id", flat=True))
+
+
+cart_summary_cache = CartSummaryCache(timeout=settings.CART_SUMMARY_CACHE_TIMEOUT)
+
+
+class ProductFacets:
+    """
+    Brand, category, subcategory and price-bucket counts for a filtered
+    product queryset, computed in a single aggregate query with one
+    conditional COUNT per facet value.
+    """
+    dimensions = (
+        ("brands", "brand_id", Brand),
+        ("categories", "category_id", Category),
+        ("sub_categories", "sub_category_id", SubCategory),
+    )
+    # Query parameters that change the page but not the result set
+    ignored_params = {"cursor", "page", "page_size", "ordering", "facets", "fields", "expand", "user_state"}
+
+    def __init__(self, price_buckets=None):
+        self.price_buckets = price_buckets or settings.FACET_PRICE_BUCKETS
+
+    def get_candidates(self):
+        """Active facet values per dimension; cached with the taxonomy."""
+        def load():
+            return {
+                name: list(model.objects.filter(is_active=True).order_by("name").values_list("id", "name"))
+                for name, _, model in self.dimensions
+            }
+        return taxonomy_cache.get_or_set("facet-candidates", load)
+
+    def get_price_ranges(self):
+        bounds = list(self.price_buckets)
+        return list(zip(bounds, bounds[1:] + [None]))
+
+    def compute(self, queryset):
+        candidates = self.get_candidates()
+        aggregates = {}
+        for name, field, _ in self.dimensions:
+            for pk, _ in candidates[name]:
+                aggregates[f"{name}_{pk}"] = Count("pk", filter=Q(**{field: pk}))
+        for i, (low, high) in enumerate(self.get_price_ranges()):
+            bucket = Q(price__gte=low) if high is None else Q(price__gte=low, price__lt=high)
+            aggregates[f"price_{i}"] = Count("pk", filter=bucket)
+
+        counts = queryset.order_by().aggregate(**aggregates)
+
+        facets = {
+            name: [
+                {"id": pk, "name": label, "count": counts[f"{name}_{pk}"]}
+                for pk, label in candidates[name]
+                if counts[f"{name}_{pk}"]
+            ]
+            for name, _, _ in self.dimensions
+        }
+        facets["price"] = [
+            {"min": low, "max": high, "count": counts[f"price_{i}"]}
+            for i, (low, high) in enumerate(self.get_price_ranges())
+        ]
+        return facets
+
+    def get_cache_key(self, query_params):
+        params = sorted(
+            (key, value.strip().lower())
+            for key, values in query_params.lists()
+            if key not in self.ignored_params
+            for value in values
+        )
+        return hashlib.sha1(repr(params).encode()).hexdigest()
+
+    def get(self, queryset, query_params):
+        """Facets for queryset, shared briefly between requests with the same filters."""
+        return facets_cache.get_or_set(self.get_cache_key(query_params), lambda: self.compute(queryset))
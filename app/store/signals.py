@@ -0,0 +1,153 @@
+from django.db import DEFAULT_DB_ALIAS, connection, transaction
+from django.db.models.signals import post_delete, post_migrate, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from store.cards import refresh_product_cards
+from store.images import delete_variants, schedule_image_processing
+from store.models import Brand, Cart, CartItem, Category, DeletedProduct, Image, Product, ProductCard, SubCategory
+from store.search import get_product_search
+from store.services import card_versions, cart_summary_cache, product_detail_cache, taxonomy_cache
+from store.suggest import update_suggestion
+
+SEARCH_FIELDS = {"name", "description", "brand", "brand_id"}
+SUGGESTION_KINDS = {Product: "product", Brand: "brand", SubCategory: "category"}
+CARD_NAME_FIELDS = {Brand: "brand", Category: "category", SubCategory: "sub_category"}
+
+
+@receiver([post_save, post_delete], sender=Category)
+@receiver([post_save, post_delete], sender=SubCategory)
+@receiver([post_save, post_delete], sender=Brand)
+def invalidate_taxonomy_cache(sender, **kwargs):
+    """Any category/subcategory/brand write makes every cached taxonomy response stale,
+    product detail entries included: their version contains the taxonomy version."""
+    taxonomy_cache.bump()
+
+
+@receiver([post_save, post_delete], sender=Product)
+def invalidate_product_detail(sender, instance, **kwargs):
+    product_detail_cache.bump(instance.pk)
+
+
+@receiver([post_save, post_delete], sender=Image)
+def invalidate_product_detail_images(sender, instance, **kwargs):
+    product_detail_cache.bump(instance.products_id)
+
+
+@receiver([post_save, post_delete], sender=CartItem)
+def invalidate_cart_summary(sender, instance, **kwargs):
+    if CartItem.cart.is_cached(instance):
+        user_id = instance.cart.user_id
+    else:
+        user_id = Cart.objects.filter(pk=instance.cart_id).values_list("user_id", flat=True).first()
+    if user_id is not None:
+        cart_summary_cache.invalidate(user_id)
+
+
+@receiver(post_save, sender=Product)
+def invalidate_cart_summaries(sender, instance, created, update_fields=None, **kwargs):
+    """A price change moves the total of every cart holding the product."""
+    if update_fields is not None and "price" not in update_fields:
+        return
+    # Instances not loaded from the database have no loaded_price and always invalidate
+    loaded_price, instance.loaded_price = getattr(instance, "loaded_price", None), instance.price
+    if not created and loaded_price != instance.price:
+        cart_summary_cache.invalidate_products([instance.pk])
+
+
+@receiver(post_save, sender=Product)
+def index_product_for_search(sender, instance, update_fields=None, **kwargs):
+    if update_fields and not SEARCH_FIELDS.intersection(update_fields):
+        return
+    get_product_search().index(Product.objects.filter(pk=instance.pk))
+
+
+@receiver(post_delete, sender=Product)
+def remove_product_from_search(sender, instance, **kwargs):
+    get_product_search().remove([instance.pk])
+
+
+@receiver(post_delete, sender=Product)
+def record_deleted_product(sender, instance, **kwargs):
+    # Incremental feeds list deletions after their since=; see store.feeds
+    DeletedProduct.objects.create(product_id=instance.pk, sku=instance.sku)
+
+
+@receiver(post_save, sender=Brand)
+def reindex_brand_products(sender, instance, created, **kwargs):
+    # The brand name is part of every one of its products' search documents
+    if not created:
+        get_product_search().index(Product.objects.filter(brand=instance))
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_save, sender=Brand)
+@receiver(post_save, sender=SubCategory)
+def update_suggestion_index(sender, instance, **kwargs):
+    update_suggestion(SUGGESTION_KINDS[sender], instance.pk, instance.name, instance.is_active)
+
+
+@receiver(post_delete, sender=Product)
+@receiver(post_delete, sender=Brand)
+@receiver(post_delete, sender=SubCategory)
+def remove_from_suggestion_index(sender, instance, **kwargs):
+    update_suggestion(SUGGESTION_KINDS[sender], instance.pk, instance.name, active=False)
+
+
+@receiver(post_save, sender=Product)
+def refresh_product_card(sender, instance, **kwargs):
+    refresh_product_cards([instance.pk])
+
+
+@receiver(post_delete, sender=Product)
+def invalidate_card_listings(sender, instance, **kwargs):
+    # The card goes with the product through the cascade
+    card_versions.bump()
+
+
+@receiver(post_save, sender=Image)
+def refresh_card_thumbnail(sender, instance, **kwargs):
+    refresh_product_cards([instance.products_id])
+
+
+@receiver(post_save, sender=Image)
+def process_product_image(sender, instance, **kwargs):
+    if instance.needs_processing:
+        transaction.on_commit(lambda: schedule_image_processing(instance), robust=True)
+
+
+@receiver(post_delete, sender=Image)
+def delete_image_variants(sender, instance, **kwargs):
+    variants = instance.variants
+    transaction.on_commit(lambda: delete_variants(variants), robust=True)
+
+
+@receiver(post_delete, sender=Image)
+def refresh_card_thumbnail_after_delete(sender, instance, **kwargs):
+    # Deferred: when the product itself is being deleted its card must not be recreated
+    transaction.on_commit(lambda: refresh_product_cards([instance.products_id]))
+
+
+@receiver(post_save, sender=Brand)
+@receiver(post_save, sender=Category)
+@receiver(post_save, sender=SubCategory)
+def rename_on_product_cards(sender, instance, created, **kwargs):
+    if created:
+        return
+    field = CARD_NAME_FIELDS[sender]
+    ProductCard.objects.filter(**{f"{field}_id": instance.pk}).update(
+        **{f"{field}_name": instance.name}, updated_at=timezone.now()
+    )
+    card_versions.bump()
+
+
+@receiver(post_migrate)
+def backfill_search_index(sender, using, **kwargs):
+    """Index the products saved before the search column or table existed; no manual step on deploy."""
+    if sender.name != "store" or using != DEFAULT_DB_ALIAS:
+        return
+    if Product._meta.db_table not in connection.introspection.table_names():
+        return  # store migrated back to zero
+    search = get_product_search()
+    search.ensure_schema()
+    search.backfill()
@@ -0,0 +1,309 @@
+import heapq
+import logging
+import os
+import re
+import threading
+import time
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+
+from store.models import Brand, Product, SubCategory
+
+logger = logging.getLogger(__name__)
+
+WORD_RE = re.compile(r"\w+")
+GENERATION_KEY = "store:suggest:generation"
+CANDIDATES = 50
+# Word prefixes up to this length are indexed; longer query words are checked against those hits
+PREFIX_LENGTH = 6
+
+
+def normalize(text: str):
+    return WORD_RE.findall(text.lower())
+
+
+def word_trigrams(word: str, prefix: bool = False):
+    """Trigrams of a word padded like pg_trgm; a prefix gets no trailing pad."""
+    padded = f"  {word}" if prefix else f"  {word} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def levenshtein(a: str, b: str, bound: int = None):
+    """Edit distance of a and b; past bound, any value above it (bound + 1) is returned early."""
+    if bound is not None and abs(len(a) - len(b)) > bound:
+        return bound + 1
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb)))
+        if bound is not None and min(current) > bound:
+            return bound + 1
+        previous = current
+    return previous[-1]
+
+
+def allowed_typos(word: str):
+    if len(word) < 3:
+        return 0
+    return 1 if len(word) <= 5 else 2
+
+
+def prefix_distance(query_word: str, word: str, bound: int = None):
+    """Edit distance between query_word and the closest-length prefix of word."""
+    if word.startswith(query_word):
+        return 0
+    n = len(query_word)
+    return min(levenshtein(query_word, word[:length], bound) for length in (n - 1, n, n + 1) if length > 0)
+
+
+def word_prefixes(words):
+    return {word[:length] for word in words for length in range(1, min(len(word), PREFIX_LENGTH) + 1)}
+
+
+class SuggestionIndex:
+    """
+    Compact in-process trigram index over product, brand and subcategory
+    names, plus a map from word prefixes to entries so exact prefix hits
+    are a lookup rather than a scan. Entries are keyed by (kind, id); the
+    index refuses new entries once max_entries is reached so its footprint
+    stays bounded.
+    """
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self.built_at = time.monotonic()
+        self.generation = None
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._postings = defaultdict(set)
+        self._prefixes = defaultdict(set)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def add(self, kind: str, pk: int, name: str):
+        key = (kind, pk)
+        words = tuple(normalize(name))
+        with self._lock:
+            self._discard(key)
+            if not words:
+                return
+            if len(self._entries) >= self.max_entries:
+                logger.warning("Suggestion index is full (%s entries); skipping %s", self.max_entries, key)
+                return
+            self._entries[key] = (words, name)
+            for gram in {gram for word in words for gram in word_trigrams(word)}:
+                self._postings[gram].add(key)
+            for prefix in word_prefixes(words):
+                self._prefixes[prefix].add(key)
+
+    def remove(self, kind: str, pk: int):
+        with self._lock:
+            self._discard((kind, pk))
+
+    def _discard(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for gram in {gram for word in entry[0] for gram in word_trigrams(word)}:
+            postings = self._postings[gram]
+            postings.discard(key)
+            if not postings:
+                del self._postings[gram]
+        for prefix in word_prefixes(entry[0]):
+            keys = self._prefixes[prefix]
+            keys.discard(key)
+            if not keys:
+                del self._prefixes[prefix]
+
+    def _typo_candidates(self, query_words):
+        """
+        {key: shared trigrams} of the entries that can match every query
+        word within its allowed typos. An edit changes at most three
+        trigrams, so such an entry shares one of the 3 * typos + 1 rarest
+        trigrams of each word; only those postings are read, not the long
+        ones of common trigrams.
+        """
+        plans = []
+        for query_word in query_words:
+            grams = word_trigrams(query_word, prefix=True)
+            postings = sorted((self._postings.get(gram, set()) for gram in grams), key=len)
+            plans.append(postings[:3 * allowed_typos(query_word) + 1])
+        # Count the cheapest word's postings; later words only check the keys still in the running
+        plans.sort(key=lambda postings: sum(map(len, postings)))
+        scores = Counter()
+        for postings in plans[:1]:
+            for keys in postings:
+                scores.update(keys)
+        for postings in plans[1:]:
+            scores = Counter({
+                key: score + shared for key, score in scores.items()
+                if (shared := sum(key in keys for keys in postings))
+            })
+            if not scores:
+                break
+        return scores
+
+    def _hit_score(self, key, first_word):
+        name = self._entries[key][1]
+        return name.lower().startswith(first_word), -len(name)
+
+    def _prefix_hits(self, query_words):
+        """Keys of the entries with a word starting with each query word."""
+        hits = None
+        for query_word in sorted(query_words, key=len, reverse=True):
+            keys = self._prefixes.get(query_word[:PREFIX_LENGTH], set())
+            if len(query_word) > PREFIX_LENGTH:
+                keys = {key for key in keys if any(word.startswith(query_word) for word in self._entries[key][0])}
+            hits = keys if hits is None else hits & keys
+            if not hits:
+                break
+        return hits or set()
+
+    def suggest(self, text: str, limit: int):
+        query_words = normalize(text)
+        if not query_words or sum(map(len, query_words)) < 2:
+            return []
+
+        grams = {gram for word in query_words for gram in word_trigrams(word, prefix=True)}
+        with self._lock:
+            # Exact prefix hits first: for a short query many names tie on
+            # overlap, and a cut by overlap alone could drop the best ones.
+            # They all share every trigram, so names starting with the query
+            # and shorter ones go first
+            hits = self._prefix_hits(query_words)
+            shortlist = heapq.nlargest(CANDIDATES, hits, key=lambda key: self._hit_score(key, query_words[0]))
+            if len(shortlist) < CANDIDATES:
+                scores = self._typo_candidates(query_words)
+                shortlist += heapq.nlargest(
+                    CANDIDATES - len(shortlist), scores.keys() - hits, key=scores.__getitem__
+                )
+            overlap = {key: sum(key in self._postings.get(gram, ()) for gram in grams) for key in shortlist}
+            candidates = [(key, self._entries[key]) for key in shortlist]
+
+        ranked = []
+        for (kind, pk), (words, name) in candidates:
+            distance = 0
+            for query_word in query_words:
+                allowed = allowed_typos(query_word)
+                best = min(prefix_distance(query_word, word, allowed) for word in words)
+                if best > allowed:
+                    break
+                distance += best
+            else:
+                # Fewer typos first, then names starting with the query, then shorter names
+                starts = not name.lower().startswith(query_words[0])
+                ranked.append(((distance, starts, -overlap[(kind, pk)], len(name)), kind, pk, name))
+
+        ranked.sort(key=lambda item: item[0])
+        return [{"type": kind, "id": pk, "name": name} for _, kind, pk, name in ranked[:limit]]
+
+    @classmethod
+    def build(cls, max_entries: int):
+        index = cls(max_entries)
+        for pk, name in Product.objects.active().values_list("id", "name").iterator():
+            index.add("product", pk, name)
+        for pk, name in Brand.objects.filter(is_active=True).values_list("id", "name"):
+            index.add("brand", pk, name)
+        for pk, name in SubCategory.objects.filter(is_active=True).values_list("id", "name"):
+            index.add("category", pk, name)
+        return index
+
+
+_index = None
+_build_lock = threading.Lock()
+_refresher_pid = None
+
+
+def get_generation():
+    generation = cache.get(GENERATION_KEY)
+    if generation is None:
+        cache.add(GENERATION_KEY, time.time_ns(), timeout=None)
+        generation = cache.get(GENERATION_KEY)
+    return generation
+
+
+def bump_generation():
+    """Ask every worker to rebuild its index."""
+    try:
+        cache.incr(GENERATION_KEY)
+    except ValueError:
+        cache.add(GENERATION_KEY, time.time_ns(), timeout=None)
+
+
+def is_stale(index, generation):
+    return (
+        index is None
+        or index.generation != generation
+        or time.monotonic() - index.built_at > settings.SUGGEST_INDEX_MAX_AGE
+    )
+
+
+def refresh_suggestion_index():
+    """Build a new index and swap it in; lookups keep using the old one meanwhile."""
+    global _index
+    # Read first, so a bump during the build leaves the new index stale
+    generation = get_generation()
+    index = SuggestionIndex.build(settings.SUGGEST_INDEX_MAX_ENTRIES)
+    index.generation = generation
+    _index = index
+    return index
+
+
+def start_index_refresher():
+    """
+    Build this process's index in a daemon thread, then poll every
+    SUGGEST_INDEX_POLL_INTERVAL seconds and rebuild it once it is older
+    than SUGGEST_INDEX_MAX_AGE or another process bumped the generation.
+    Call it from the serving process at startup (see config.wsgi).
+    """
+    global _refresher_pid
+    with _build_lock:
+        # Threads don't survive a fork, so a forked worker starts its own
+        if _refresher_pid == os.getpid():
+            return
+        _refresher_pid = os.getpid()
+    threading.Thread(target=_refresh_forever, name="suggest-index-refresher", daemon=True).start()
+
+
+def _refresh_forever():
+    while True:
+        try:
+            if is_stale(_index, get_generation()):
+                refresh_suggestion_index()
+        except Exception:
+            logger.exception("Could not rebuild the suggestion index")
+        finally:
+            connections.close_all()
+        time.sleep(settings.SUGGEST_INDEX_POLL_INTERVAL)
+
+
+def get_suggestion_index():
+    """
+    Return this process's index. Where the refresher runs, lookups never
+    build: they get the current index, stale or not, and an empty one
+    until the first build is done. Elsewhere (shell, management commands,
+    tests) a missing or stale index is rebuilt here.
+    """
+    index = _index
+    if _refresher_pid == os.getpid():
+        return index if index is not None else SuggestionIndex(0)
+    if is_stale(index, get_generation()):
+        with _build_lock:
+            if _index is index:
+                refresh_suggestion_index()
+            index = _index
+    return index
+
+
+def update_suggestion(kind: str, pk: int, name: str, active: bool = True):
+    """Apply a single write to this process's index if it has been built."""
+    if _index is None:
+        return
+    if active:
+        _index.add(kind, pk, name)
+    else:
+        _index.remove(kind, pk)
@@ -1,3 +1,1182 @@
-from django.test import TestCase
+import csv
+import gzip
+import io
+import json
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+from unittest import mock
+from xml.etree import ElementTree
 
-# Create your tests here.
+import PIL.Image
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.management.sql import emit_post_migrate_signal
+from django.db import DatabaseError, connection
+from django.test import Client, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from accounts.models import Address, User
+from orders.models import Order, OrderItem, StockReservation
+from store.cart_store import MemoryCartStore, check_cart_store
+from store.imaging import render_variants
+from store.importer import CatalogImporter
+from store.models import (
+    Brand, Cart, CartItem, Category, Image, Product, ProductCard, ProductNeighbour, RecentView, SubCategory,
+    TrendingProduct, Wishlist,
+)
+from store.recent_views import recent_views
+from store import suggest
+from store.recommendations import update_recommendations
+from store.search import get_product_search
+from store.trending import refresh_trending
+
+MEDIA_ROOT = tempfile.mkdtemp()
+
+
+def make_image_file(name="product.png"):
+    buffer = io.BytesIO()
+    PIL.Image.new("RGB", (800, 600), "white").save(buffer, format="PNG")
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type="image/png")
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class CatalogTestCase(TestCase):
+    """Shared catalog fixture: one category tree, one brand and a few products."""
+
+    def setUp(self):
+        cache.clear()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name="Medicines")
+        cls.sub_category = SubCategory.objects.create(name="Tablets", category=cls.category)
+        cls.brand = Brand.objects.create(name="Cipla")
+        cls.products = [cls.make_product(f"Paracetamol {i}", price=10 + i) for i in range(5)]
+
+    @classmethod
+    def make_product(cls, name, price=10, images=2, **kwargs):
+        fields = {
+            "sku": name.upper().replace(" ", "-"),
+            "quantity": 10,
+            "description": f"{name} description",
+            "category": cls.category,
+            "sub_category": cls.sub_category,
+            "brand": cls.brand,
+        }
+        fields.update(kwargs)
+        product = Product.objects.create(name=name, price=price, **fields)
+        for _ in range(images):
+            Image.objects.create(products=product, image=make_image_file())
+        return product
+
+
+class TaxonomyCacheTests(CatalogTestCase):
+
+    def names(self, url):
+        return sorted(item["name"] for item in self.client.get(url).json())
+
+    def test_second_get_runs_no_queries(self):
+        for url in (reverse("category-list"), reverse("subcategory-list")):
+            first = self.client.get(url).content
+            with self.assertNumQueries(0):
+                self.assertEqual(self.client.get(url).content, first)
+
+    def test_category_writes_bump_the_version(self):
+        url = reverse("category-list")
+        self.assertEqual(self.names(url), ["Medicines"])
+        self.category.name = "Medicine"
+        self.category.save()
+        self.assertEqual(self.names(url), ["Medicine"])
+        Category.objects.create(name="Devices").delete()
+        self.assertEqual(self.names(url), ["Medicine"])
+        self.category.delete()
+        self.assertEqual(self.names(url), [])
+
+    def test_subcategory_writes_bump_the_version(self):
+        url = reverse("subcategory-list")
+        self.assertEqual(self.names(url), ["Tablets"])
+        syrups = SubCategory.objects.create(name="Syrups", category=self.category)
+        self.assertEqual(self.names(url), ["Syrups", "Tablets"])
+        syrups.delete()
+        self.assertEqual(self.names(url), ["Tablets"])
+
+
+class ProductQueryCountTests(CatalogTestCase):
+    """Query budgets for the product endpoints; they must not grow with the page size."""
+
+    def assertBudget(self, url, queries):
+        with self.assertNumQueries(queries):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_product_list_by_category(self):
+        # a single scan of the product cards; the validators come from the card version
+        response = self.assertBudget(reverse("product-by-category", args=[self.category.id]), 1)
+        card = response.json()["results"][0]
+        self.assertEqual(card["brand"], self.brand.name)
+        self.assertTrue(card["thumbnail"].startswith("http://testserver/media/images/products/main/"))
+
+    def test_product_list_by_subcategory(self):
+        self.assertBudget(reverse("product-by-subcategory", args=[self.sub_category.id]), 1)
+
+    def test_product_search(self):
+        # cards only; the full-text match is part of that query on Postgres, while
+        # the SQLite stand-in first checks its FTS5 table and queries it separately
+        queries = 1 if connection.vendor == "postgresql" else 3
+        response = self.assertBudget(reverse("product-search") + "?search=paracetamol", queries)
+        self.assertEqual(len(response.json()["results"]), 5)
+
+    def test_product_filters(self):
+        # cards only; keyset pagination needs no COUNT(*)
+        self.assertBudget(reverse("product-search") + f"?category={self.category.id}&min_price=0", 1)
+
+    def test_product_search_page_numbers(self):
+        # count and cards
+        self.assertBudget(reverse("product-search") + f"?category={self.category.id}&page=1", 2)
+
+    def test_product_detail(self):
+        # validators, product (+ sub_category + category) and images
+        response = self.assertBudget(reverse("product-detail", args=[self.products[0].id]), 3)
+        self.assertEqual(response.json()["category"], self.category.name)
+        self.assertEqual(len(response.json()["images"]), 2)
+
+
+@mock.patch.object(suggest, "_index", None)
+class SuggestTests(CatalogTestCase):
+
+    def names(self, query, limit=10):
+        return [result["name"] for result in suggest.get_suggestion_index().suggest(query, limit)]
+
+    def test_typos_and_prefixes(self):
+        response = self.client.get(reverse("product-suggest") + "?q=paracetmol&limit=3")
+        self.assertEqual(len(response.json()["results"]), 3)
+        self.assertTrue(all(name.startswith("Paracetamol") for name in self.names("paracetmol")))
+        self.assertEqual(self.names("cipl"), ["Cipla"])
+        self.assertEqual(self.names("xyzzy"), [])
+
+    def test_prefix_hits_survive_the_shortlist(self):
+        index = suggest.SuggestionIndex(max_entries=1000)
+        # Near misses sharing every trigram of the query outnumber the shortlist
+        for i in range(suggest.CANDIDATES * 4):
+            index.add("product", i, f"Spara par {i}")
+        for i in range(20):
+            index.add("product", 10_000 + i, f"Paracetamol {i}")
+        names = [result["name"] for result in index.suggest("para", 20)]
+        self.assertEqual(sorted(names), sorted(f"Paracetamol {i}" for i in range(20)))
+        # Query words longer than the indexed prefixes
+        self.assertEqual([result["name"] for result in index.suggest("paracetamol 7", 5)], ["Paracetamol 7"])
+        for i in range(20):
+            index.remove("product", 10_000 + i)
+        self.assertFalse(index._prefixes.get("parace"))
+
+    def test_lookups_serve_the_stale_index_while_the_refresher_rebuilds(self):
+        with mock.patch.object(suggest, "_refresher_pid", os.getpid()):
+            self.assertEqual(self.names("para"), [])  # not built yet
+            suggest.refresh_suggestion_index()
+            Product.objects.filter(pk=self.products[0].pk).update(name="Zincovit")
+            suggest.bump_generation()
+            with self.assertNumQueries(0):
+                self.assertEqual(self.names("zinc"), [])
+            suggest.refresh_suggestion_index()
+            self.assertEqual(self.names("zinc"), ["Zincovit"])
+
+    def test_signals_update_the_index_incrementally(self):
+        self.names("para")  # build it
+        product = self.make_product("Dolo 650", images=0)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.names("dolo"), ["Dolo 650"])
+
+        product.is_active = False
+        product.save()
+        self.assertEqual(self.names("dolo"), [])
+        self.brand.delete()
+        self.assertEqual(self.names("cipla"), [])
+
+    def test_rebuild_command_reaches_every_worker(self):
+        self.names("para")
+        # bypasses the signals, so this process's index can't know
+        Product.objects.filter(pk=self.products[0].pk).update(name="Zincovit")
+        self.assertEqual(self.names("zinc"), [])
+        call_command("rebuild_suggest_index", stdout=io.StringIO())
+        self.assertEqual(self.names("zinc"), ["Zincovit"])
+
+
+class ProductCardTests(CatalogTestCase):
+
+    def test_card_follows_product_and_taxonomy_writes(self):
+        product = self.products[0]
+        product.quantity = 0
+        product.save()
+        self.brand.name = "Sun Pharma"
+        self.brand.save()
+        self.category.name = "Medicine"
+        self.category.save()
+
+        card = ProductCard.objects.get(product=product)
+        self.assertFalse(card.in_stock)
+        self.assertEqual((card.brand_name, card.category_name), ("Sun Pharma", "Medicine"))
+
+    def test_thumbnail_is_the_newest_image(self):
+        product = self.make_product("Crocin", images=1)
+        newest = Image.objects.create(products=product, image=make_image_file("newest.png"))
+        self.assertEqual(ProductCard.objects.get(product=product).thumbnail, newest.image.name)
+
+
+@override_settings(IMAGE_PROCESS_WORKERS=0)
+class ImagePipelineTests(CatalogTestCase):
+
+    def test_variants_are_rendered_next_to_the_original(self):
+        product = self.make_product("Crocin", images=0)
+        with self.captureOnCommitCallbacks(execute=True):
+            image = Image.objects.create(products=product, image=make_image_file())
+        image.refresh_from_db()
+
+        with PIL.Image.open(image.image.path) as original:
+            self.assertEqual(original.size, (800, 600))
+        sizes = {name: (entry["width"], entry["height"]) for name, entry in image.variants.items() if name != "source"}
+        # never upscaled past the original
+        self.assertEqual(sizes, {"thumb": (160, 120), "card": (500, 375), "zoom": (800, 600)})
+        with PIL.Image.open(image.image.storage.path(image.variants["thumb"]["webp"])) as thumb:
+            self.assertEqual((thumb.format, thumb.size), ("WEBP", (160, 120)))
+        self.assertEqual(ProductCard.objects.get(product=product).thumbnail, image.variants["card"]["webp"])
+
+        payload = self.client.get(reverse("product-detail", args=[product.id])).json()["images"][0]
+        self.assertTrue(payload["image"].endswith(image.image.name))
+        self.assertRegex(payload["srcset"]["webp"], r"thumb\.webp 160w, .*card\.webp 500w, .*zoom\.webp 800w$")
+        self.assertIn("jpeg", payload["srcset"])
+
+    def test_images_sharing_a_source_keep_their_own_variants(self):
+        first, second = self.products[:2]
+        source = first.images.first().image.name
+        with self.captureOnCommitCallbacks(execute=True):
+            images = [Image.objects.create(products=product, image=source) for product in (first, second)]
+        kept, deleted = [Image.objects.get(pk=image.pk) for image in images]
+        self.assertNotEqual(kept.variants["thumb"]["webp"], deleted.variants["thumb"]["webp"])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            deleted.delete()
+        self.assertTrue(kept.image.storage.exists(kept.variants["thumb"]["webp"]))
+        self.assertFalse(kept.image.storage.exists(deleted.variants["thumb"]["webp"]))
+
+    def test_variants_render_in_a_process_pool(self):
+        image = self.products[0].images.first()
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as pool:
+            rendered = pool.submit(render_variants, image.image.path, {"thumb": (160, 160)}, ["jpeg"]).result()
+        self.assertEqual((rendered["thumb"]["width"], rendered["thumb"]["height"]), (160, 120))
+        self.assertTrue(rendered["thumb"]["jpeg"].startswith(b"\xff\xd8"))
+
+
+class KeysetPaginationTests(CatalogTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        # Price ties force the pk tie-breaker to do its job
+        cls.products += [cls.make_product(f"Ibuprofen {i}", price=12, images=0) for i in range(4)]
+
+    def walk(self, url):
+        ids, pages = [], 0
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotIn("count", response.json())
+            ids += [product["id"] for product in response.json()["results"]]
+            url, pages = response.json()["next"], pages + 1
+        return ids, pages
+
+    def test_walks_every_product_once_in_order(self):
+        url = reverse("product-by-category", args=[self.category.id])
+        for ordering, key, descending in (
+            ("-created_at", lambda p: (p.created_at, p.id), True),
+            ("price", lambda p: (p.price, p.id), False),
+        ):
+            ids, pages = self.walk(f"{url}?ordering={ordering}&page_size=2")
+            expected = [p.id for p in sorted(self.products, key=key, reverse=descending)]
+            self.assertEqual(ids, expected)
+            self.assertEqual(pages, 5)
+
+    def test_previous_link_returns_the_previous_page(self):
+        url = reverse("product-search") + "?ordering=price&page_size=3"
+        first = self.client.get(url).json()
+        second = self.client.get(first["next"]).json()
+        self.assertEqual(self.client.get(second["previous"]).json()["results"], first["results"])
+
+    def test_cursor_is_bound_to_its_ordering(self):
+        url = reverse("product-search")
+        next_url = self.client.get(url + "?page_size=2").json()["next"]
+        self.assertEqual(self.client.get(next_url + "&ordering=price").status_code, 400)
+
+
+class ProductSearchTests(CatalogTestCase):
+    """Runs against the SQLite FTS5 fallback locally and the tsvector column on Postgres."""
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.ointment = cls.make_product("Burnol Ointment", price=50, images=0,
+                                        description="Soothing cream for burns")
+        cls.mentions = cls.make_product("Antiseptic Cream", price=80, images=0,
+                                        description="Works well alongside burnol")
+
+    def search(self, query):
+        response = self.client.get(reverse("product-search") + query)
+        self.assertEqual(response.status_code, 200)
+        return [product["id"] for product in response.json()["results"]]
+
+    def test_name_match_ranks_above_description_match(self):
+        self.assertEqual(self.search("?search=burnol"), [self.ointment.id, self.mentions.id])
+
+    def test_prefix_match(self):
+        self.assertEqual(self.search("?search=ointm"), [self.ointment.id])
+
+    def test_brand_is_searchable_and_follows_renames(self):
+        self.assertEqual(len(self.search("?search=cipla")), 7)
+        self.brand.name = "Sun Pharma"
+        self.brand.save()
+        self.assertEqual(self.search("?search=cipla"), [])
+        self.assertEqual(len(self.search("?search=sun")), 7)
+
+    def test_migrate_indexes_products_missing_from_the_index(self):
+        # As if saved before the index existed
+        get_product_search().remove([self.ointment.id])
+        emit_post_migrate_signal(verbosity=0, interactive=False, db="default")
+        self.assertEqual(self.search("?search=burnol"), [self.ointment.id, self.mentions.id])
+
+    def test_composes_with_filters_and_ordering(self):
+        self.assertEqual(self.search("?search=burnol&min_price=60"), [self.mentions.id])
+        self.assertEqual(self.search("?search=cream&ordering=-price"), [self.mentions.id, self.ointment.id])
+
+
+class ProductFacetTests(CatalogTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.other_brand = Brand.objects.create(name="Himalaya")
+        cls.make_product("Neem Face Wash", price=150, images=0, brand=cls.other_brand)
+
+    def test_facets_cover_the_whole_result_set_in_one_query(self):
+        url = reverse("product-search") + "?facets=true&page_size=1"
+        self.client.get(url)  # warm the taxonomy cache
+        with self.assertNumQueries(2):  # cards and the facet aggregate
+            facets = self.client.get(url + "&min_price=11").json()["facets"]
+        self.assertEqual(
+            {brand["name"]: brand["count"] for brand in facets["brands"]},
+            {"Cipla": 4, "Himalaya": 1},
+        )
+        self.assertEqual(facets["categories"], [{"id": self.category.id, "name": "Medicines", "count": 5}])
+        self.assertEqual([bucket["count"] for bucket in facets["price"][:2]], [4, 1])
+
+    def test_facets_are_cached_per_filter_set(self):
+        url = reverse("product-search") + "?facets=1&brand=%s"
+        first = self.client.get(url % self.other_brand.id).json()["facets"]
+        with self.assertNumQueries(1):  # the page of cards only
+            again = self.client.get(url % self.other_brand.id + "&ordering=price").json()["facets"]
+        self.assertEqual(first, again)
+
+
+class ConditionalGetTests(CatalogTestCase):
+
+    def assertRevalidates(self, url, queries, change):
+        etag = self.client.get(url)["ETag"]
+        with self.assertNumQueries(queries):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        change()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+    def test_category_tree_uses_the_taxonomy_version(self):
+        self.assertRevalidates(
+            reverse("category-list"), 0,
+            lambda: SubCategory.objects.create(name="Syrups", category=self.category),
+        )
+
+    def test_product_listing(self):
+        product = self.products[0]
+
+        def reprice():
+            product.price = 99
+            product.save()
+
+        self.assertRevalidates(reverse("product-by-category", args=[self.category.id]), 0, reprice)
+
+    def test_product_listing_follows_renames_and_deletes(self):
+        url = reverse("product-search") + "?search=paracetamol"
+        self.assertRevalidates(url, 0, lambda: Brand.objects.filter(pk=self.brand.pk).first().save())
+        self.assertRevalidates(url, 0, lambda: self.products[1].delete())
+
+    def test_user_state_listings_vary_on_authorization(self):
+        url = reverse("product-by-category", args=[self.category.id]) + "?user_state=1"
+        self.assertIn("Authorization", self.client.get(url)["Vary"])
+
+    def test_product_detail_follows_its_images(self):
+        product = self.products[0]
+        url = reverse("product-detail", args=[product.id])
+        # served from the product detail cache, validators included
+        self.assertRevalidates(url, 0, lambda: product.images.first().delete())
+        self.assertIn("Last-Modified", self.client.get(url))
+
+
+class SparseFieldsetTests(CatalogTestCase):
+
+    def test_fields_limit_the_payload_and_the_joins(self):
+        url = reverse("product-detail", args=[self.products[0].id])
+        # validators and the bare product row: no category join, no images
+        with self.assertNumQueries(2):
+            response = self.client.get(url + "?fields=id,name,price")
+        self.assertEqual(set(response.json()), {"id", "name", "price"})
+
+    def test_unexpanded_relations_are_not_fetched(self):
+        url = reverse("product-detail", args=[self.products[0].id])
+        with self.assertNumQueries(2):
+            response = self.client.get(url + "?expand=")
+        self.assertNotIn("images", response.json())
+        self.assertEqual(response.json()["category"], self.category.name)
+
+    def test_listing_fields(self):
+        response = self.client.get(reverse("product-search") + "?fields=id,price")
+        self.assertEqual(set(response.json()["results"][0]), {"id", "price"})
+
+    def test_nested_fields_and_expansion(self):
+        user = User.objects.create_user(mobile="9000000000", password=None)
+        Wishlist.objects.create(user=user, product=self.products[0])
+        client = APIClient()
+        client.force_authenticate(user)
+
+        item = client.get(reverse("add-to-wishlist") + "?fields=id,user,product.name&expand=product").json()["results"][0]
+        self.assertEqual(item["user"], user.id)
+        self.assertEqual(item["product"], {"name": self.products[0].name})
+
+        item = client.get(reverse("add-to-wishlist") + "?expand=user").json()["results"][0]
+        self.assertEqual(item["user"]["id"], user.id)
+        self.assertEqual(item["product"], self.products[0].id)
+
+
+class UserProductStateTests(CatalogTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(mobile="9000000006", password=None)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        first, second = self.products[:2]
+        Wishlist.objects.create(user=self.user, product=first)
+        cart = Cart.objects.create(user=self.user)
+        CartItem.objects.create(cart=cart, product=second, quantity=3)
+
+    def test_user_state_is_annotated_in_the_listing_query(self):
+        first, second = self.products[:2]
+        url = reverse("product-by-category", args=[self.category.id])
+        # no validators: the cards and their user state come from one SELECT
+        with self.assertNumQueries(1):
+            response = self.client.get(url + "?user_state=1")
+        self.assertNotIn("ETag", response)
+        self.assertIn("private", response["Cache-Control"])
+        state = {card["id"]: (card["is_wishlisted"], card["cart_quantity"]) for card in response.json()["results"]}
+        self.assertEqual(state[first.id], (True, 0))
+        self.assertEqual(state[second.id], (False, 3))
+        self.assertEqual(state[self.products[2].id], (False, 0))
+
+        # opt-in, and never for anonymous requests
+        self.assertNotIn("is_wishlisted", self.client.get(url).json()["results"][0])
+        self.assertNotIn("cart_quantity", Client().get(url + "?user_state=1").json()["results"][0])
+
+    def test_trending_with_user_state_skips_the_shared_cache(self):
+        first, second = self.products[:2]
+        TrendingProduct.objects.bulk_create([
+            TrendingProduct(product=product, rank=rank, score=1, computed_at=timezone.now())
+            for rank, product in enumerate((second, first), 1)
+        ])
+        url = reverse("product-trending")
+        self.assertNotIn("is_wishlisted", self.client.get(url).json()[0])  # fills the shared cache
+
+        response = self.client.get(url + "?user_state=1")
+        self.assertIn("private", response["Cache-Control"])
+        self.assertEqual(
+            [(card["id"], card["is_wishlisted"], card["cart_quantity"]) for card in response.json()],
+            [(second.id, False, 3), (first.id, True, 0)],
+        )
+        self.assertNotIn("is_wishlisted", Client().get(url + "?user_state=1").json()[0])
+
+    def test_search_facets_ignore_user_state(self):
+        response = self.client.get(reverse("product-search") + "?user_state=1&facets=1")
+        self.assertEqual(len(response.json()["results"]), 5)
+        self.assertEqual(response.json()["facets"]["brands"][0]["count"], 5)
+
+    def test_wishlist_ids(self):
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse("wishlist-ids"))
+        self.assertEqual(response.json(), {"product_ids": [self.products[0].id]})
+
+
+class WishlistTests(CatalogTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(mobile="9000000007", password=None)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_pages_of_product_cards(self):
+        Wishlist.objects.bulk_create([Wishlist(user=self.user, product=product) for product in self.products])
+        url = reverse("add-to-wishlist") + "?page_size=3"
+        # one join of wishlist and cards per page, whatever its size
+        with self.assertNumQueries(1):
+            first = self.client.get(url).json()
+        self.assertEqual(len(first["results"]), 3)
+        self.assertEqual(set(first["results"][0]["product"]), {
+            "id", "name", "price", "old_price", "thumbnail", "brand", "category", "sub_category", "in_stock",
+        })
+        second = self.client.get(first["next"]).json()
+        seen = [item["product"]["id"] for item in first["results"] + second["results"]]
+        self.assertEqual(sorted(seen), sorted(product.id for product in self.products))
+        self.assertIsNone(second["next"])
+
+    def test_bulk_add_and_remove(self):
+        first, second, third = self.products[:3]
+        Wishlist.objects.create(user=self.user, product=first)
+        url = reverse("wishlist-bulk")
+        # the product lookup and one insert, inside a savepoint
+        with self.assertNumQueries(4):
+            response = self.client.post(url, {"add": [first.id, second.id, third.id, 999999]}, format="json")
+        self.assertEqual(response.json()["added"], sorted([first.id, second.id, third.id]))
+        self.assertEqual(Wishlist.objects.filter(user=self.user).count(), 3)
+
+        response = self.client.post(url, {"add": [self.products[3].id], "remove": [first.id, second.id]}, format="json")
+        self.assertEqual(response.json()["removed"], 2)
+        self.assertEqual(
+            set(Wishlist.objects.filter(user=self.user).values_list("product_id", flat=True)),
+            {third.id, self.products[3].id},
+        )
+        response = self.client.post(url, {"add": [first.id], "remove": [first.id]}, format="json")
+        self.assertEqual(response.status_code, 400)
+
+    def test_toggle(self):
+        url = reverse("add-to-wishlist")
+        product = self.products[0]
+        self.assertEqual(self.client.post(url, {"product_id": product.id}, format="json").status_code, 200)
+        self.assertEqual(self.client.post(url, {"product_id": product.id}, format="json").status_code, 201)
+        self.assertFalse(Wishlist.objects.exists())
+        self.assertEqual(self.client.post(url, {"product_id": 999999}, format="json").status_code, 404)
+
+
+class CartTotalsTests(CatalogTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(mobile="9000000008", password=None)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.cart = Cart.objects.create(user=self.user)
+        first, second = self.products[:2]  # priced 10 and 11
+        self.item = CartItem.objects.create(cart=self.cart, product=first, quantity=2)
+        CartItem.objects.create(cart=self.cart, product=second, quantity=1)
+
+    def test_totals_are_one_aggregate(self):
+        with self.assertNumQueries(1):
+            totals = self.cart.items.totals()
+        self.assertEqual(totals, {"item_count": 2, "total_quantity": 3, "total_price": 31.0})
+        cart = Cart.objects.get(pk=self.cart.pk)
+        with self.assertNumQueries(1):
+            self.assertEqual(cart.total_price, 31.0)
+        item = CartItem.objects.with_subtotals().get(pk=self.item.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(item.subtotal, 20.0)
+
+    def test_summary_is_cached_until_the_cart_changes(self):
+        url = reverse("cart-summary")
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get(url).json()["total_price"], 31.0)
+        with self.assertNumQueries(0):
+            self.client.get(url)
+
+        response = self.client.patch(reverse("cart"), {"item_id": self.item.id, "action": "add"}, format="json")
+        self.assertEqual(response.json()["cart_total"], 41.0)
+        self.assertEqual(response.json()["item_subtotal"], 30.0)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(url).json()["total_quantity"], 4)
+
+        product = self.products[1]
+        product.price = 20
+        product.save()
+        self.assertEqual(self.client.get(url).json()["total_price"], 50.0)
+
+    def test_saves_that_keep_the_price_skip_the_cart_lookup(self):
+        product = Product.objects.get(pk=self.products[1].pk)
+        with CaptureQueriesContext(connection) as queries:
+            product.save(update_fields=["name"])
+            product.description = "Unchanged price"
+            product.save()
+        self.assertFalse([query for query in queries if CartItem._meta.db_table in query["sql"]])
+        self.assertEqual(self.client.get(reverse("cart-summary")).json()["total_price"], 31.0)
+
+    def test_imported_price_changes_refresh_the_summary(self):
+        url = reverse("cart-summary")
+        self.assertEqual(self.client.get(url).json()["total_price"], 31.0)
+        product = self.products[1]
+        self.assertEqual(CatalogImporter().run([(1, {"sku": product.sku, "price": "20"})]).updated, 1)
+        self.assertEqual(self.client.get(url).json()["total_price"], 40.0)
+
+
+class GuestCartTests(CatalogTestCase):
+
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch("store.cart_store._cart_store", MemoryCartStore())
+        self.store = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client = APIClient()
+
+    def test_guest_cart_lives_in_the_store_until_merged(self):
+        first, second = self.products[:2]
+        url = reverse("guest-cart")
+        token = self.client.post(url, {"product_id": first.id, "quantity": 2}, format="json").json()["token"]
+        self.client.credentials(HTTP_X_CART_TOKEN=token)
+        self.client.post(url, {"product_id": second.id}, format="json")
+        self.assertEqual(self.client.patch(url, {"product_id": first.id, "action": "add"}, format="json").json()["quantity"], 3)
+        self.client.patch(url, {"product_id": second.id, "action": "remove"}, format="json")
+        self.assertFalse(CartItem.objects.exists())
+
+        with self.assertNumQueries(1):
+            cart = self.client.get(url).json()
+        self.assertEqual([(item["product"]["id"], item["quantity"]) for item in cart["items"]], [(first.id, 3)])
+        self.assertEqual(cart["total_price"], 30.0)
+
+        user = User.objects.create_user(mobile="9000000009", password=None)
+        client = APIClient()
+        client.force_authenticate(user)
+        with mock.patch.object(CartItem.objects, "bulk_create", side_effect=DatabaseError("boom")):
+            with self.assertRaises(DatabaseError):
+                client.post(reverse("merge-cart"), {"guest_token": token}, format="json")
+        # the failed merge left the stored cart alone
+        self.assertEqual(self.store.get(f"guest:{token}"), {first.id: 3})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            client.post(reverse("merge-cart"), {"guest_token": token}, format="json")
+        self.assertEqual(list(CartItem.objects.filter(cart__user=user).values_list("product_id", "quantity")), [(first.id, 3)])
+        self.assertEqual(self.store.get(f"guest:{token}"), {})
+
+    def test_memory_store_is_refused_without_debug(self):
+        with override_settings(DEBUG=False):
+            with self.assertRaises(ImproperlyConfigured):
+                check_cart_store()
+            with override_settings(CART_STORE={"BACKEND": "store.cart_store.RedisCartStore"}):
+                check_cart_store()
+        with override_settings(DEBUG=True):
+            check_cart_store()
+
+    def test_stock_is_checked_on_increment(self):
+        product = self.products[0]  # 10 in stock
+        url = reverse("guest-cart")
+        token = self.client.post(url, {"product_id": product.id, "quantity": 10}, format="json").json()["token"]
+        self.client.credentials(HTTP_X_CART_TOKEN=token)
+        self.assertEqual(self.client.patch(url, {"product_id": product.id, "action": "add"}, format="json").status_code, 400)
+        self.assertEqual(self.store.get(f"guest:{token}"), {product.id: 10})
+
+    def test_increments_are_atomic(self):
+        def tap():
+            for _ in range(200):
+                self.store.incr("guest:race", 1, 1)
+
+        threads = [threading.Thread(target=tap) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.store.get("guest:race"), {1: 800})
+        self.assertEqual(self.store.incr("guest:race", 1, -800), 0)
+        self.assertEqual(self.store.get("guest:race"), {})
+
+
+class MergeCartTests(CatalogTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(mobile="9000000010", password=None)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def merge(self, items):
+        return self.client.post(reverse("merge-cart"), {"items": items}, format="json")
+
+    def test_merge_is_one_upsert_and_reports_per_item(self):
+        first, second, third = self.products[:3]
+        cart = Cart.objects.create(user=self.user)
+        CartItem.objects.create(cart=cart, product=first, quantity=1)
+        Product.objects.filter(pk=third.pk).update(quantity=0)
+
+        response = self.merge([
+            {"product_id": first.id, "quantity": 4},
+            {"product_id": second.id, "quantity": 50},
+            {"product_id": third.id},
+            {"product_id": 999999},
+        ])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()["messages"]), 3)
+        self.assertIn("999999", response.json()["messages"][-1])
+        self.assertEqual(
+            dict(CartItem.objects.filter(cart=cart).values_list("product_id", "quantity")), {first.id: 4, second.id: 10}
+        )
+
+    def test_query_count_does_not_grow_with_the_guest_cart(self):
+        def merge_queries(products):
+            CartItem.objects.all().delete()
+            with CaptureQueriesContext(connection) as queries:
+                self.merge([{"product_id": product.id} for product in products])
+            return len(queries)
+
+        Cart.objects.create(user=self.user)
+        self.assertEqual(merge_queries(self.products[:1]), merge_queries(self.products))
+
+
+class CartBatchTests(CatalogTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(mobile="9000000011", password=None)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.cart = Cart.objects.create(user=self.user)
+        first, second = self.products[:2]
+        CartItem.objects.create(cart=self.cart, product=first, quantity=2)
+        CartItem.objects.create(cart=self.cart, product=second, quantity=1)
+
+    def batch(self, *operations):
+        return self.client.post(reverse("cart-batch") + "?fields=total_price,items.quantity",
+                                {"operations": list(operations)}, format="json")
+
+    def quantities(self):
+        return dict(CartItem.objects.filter(cart=self.cart).values_list("product_id", "quantity"))
+
+    def test_operations_apply_in_order(self):
+        first, second, third = self.products[:3]
+        response = self.batch(
+            {"op": "increment", "product_id": first.id},
+            {"op": "increment", "product_id": first.id, "quantity": 2},
+            {"op": "decrement", "product_id": second.id},
+            {"op": "set", "product_id": third.id, "quantity": 4},
+            {"op": "decrement", "product_id": third.id},
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.quantities(), {first.id: 5, third.id: 3})
+        self.assertEqual(response.json()["cart"]["total_price"], 5 * 10 + 3 * 12)
+
+        self.batch({"op": "remove", "product_id": first.id})
+        self.assertEqual(self.quantities(), {third.id: 3})
+
+    def test_an_invalid_operation_rejects_the_batch(self):
+        first, second = self.products[:2]
+        response = self.batch(
+            {"op": "increment", "product_id": first.id},
+            {"op": "set", "product_id": second.id, "quantity": 11},
+            {"op": "set", "product_id": 999999, "quantity": 1},
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual([error["index"] for error in response.json()["errors"]], [1, 2])
+        self.assertEqual(self.quantities(), {first.id: 2, second.id: 1})
+
+
+class ProductDetailCacheTests(CatalogTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.product = self.products[0]
+        self.url = reverse("product-detail", args=[self.product.id])
+        self.client.get(self.url)
+
+    def entry_key(self):
+        return f"store:product:{self.product.id}:testserver:*:*"
+
+    def test_hit_runs_no_queries(self):
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url)
+        self.assertEqual(response.json()["name"], self.product.name)
+        self.assertIn("ETag", response)
+
+    def test_writes_invalidate_the_entry(self):
+        self.product.price = 42
+        self.product.save()
+        self.assertEqual(self.client.get(self.url).json()["price"], 42)
+
+        self.product.images.first().delete()
+        self.assertEqual(len(self.client.get(self.url).json()["images"]), 1)
+
+        self.category.name = "Medicine"
+        self.category.save()
+        self.assertEqual(self.client.get(self.url).json()["category"], "Medicine")
+
+    def test_stale_entry_is_served_while_another_request_rebuilds(self):
+        old_price = self.product.price
+        self.product.price = 42
+        self.product.save()
+        cache.add(self.entry_key() + ":lock", 1)
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url)
+        self.assertEqual(response.json()["price"], old_price)
+
+        cache.delete(self.entry_key() + ":lock")
+        self.assertEqual(self.client.get(self.url).json()["price"], 42)
+
+    def test_parameter_permutations_share_an_entry(self):
+        response = self.client.get(self.url + "?fields=name,id&expand=images")
+        self.assertEqual(response.json(), {"id": self.product.id, "name": self.product.name})
+        for query in ("?fields=id,name,,id&expand=images", "?fields=id, name,bogus&expand=bogus,images"):
+            with self.assertNumQueries(0):
+                self.assertEqual(self.client.get(self.url + query).json(), response.json())
+        self.assertEqual(self.client.get(self.url + "?fields=bogus").json(), {})
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(self.url + "?fields=").json()["name"], self.product.name)
+
+    def test_cold_miss_waits_for_the_lock_holder_then_builds(self):
+        cache.delete(self.entry_key())
+        cache.add(self.entry_key() + ":lock", 1)
+        self.assertEqual(self.client.get(self.url).json()["id"], self.product.id)
+
+
+class CatalogImportTests(CatalogTestCase):
+
+    def write_file(self, suffix, content):
+        handle = tempfile.NamedTemporaryFile("w", suffix=suffix, delete=False, dir=MEDIA_ROOT)
+        with handle:
+            handle.write(content)
+        return handle.name
+
+    def run_import(self, path, *args):
+        out, err = io.StringIO(), io.StringIO()
+        call_command("import_catalog", path, *args, stdout=out, stderr=err)
+        return out.getvalue(), err.getvalue()
+
+    def test_csv_creates_and_updates_by_sku_and_reports_bad_rows(self):
+        existing = self.products[0]
+        path = self.write_file(".csv", "\n".join([
+            "sku,name,price,quantity,description,category,sub_category,brand,images",
+            f"{existing.sku},Paracetamol 650,55,3,Updated,medicines,tablets,Cipla,",
+            "NEW-1,Dolo 650,30,5,Fever,Medicines,Tablets,Cipla,images/products/main/dolo.png",
+            "NEW-2,Bad price,abc,5,x,Medicines,Tablets,Cipla,",
+            "NEW-3,Wrong tree,10,5,x,Medicines,Syrups,Cipla,",
+            "NEW-4,New brand,10,5,x,Medicines,Tablets,Micro Labs,",
+        ]))
+        out, err = self.run_import(path, "--batch-size", "2")
+
+        self.assertIn("Created 1, updated 1 products and added 1 images", out)
+        self.assertIn("3 rows failed", out)
+        self.assertIn("line 4: price:", err)
+        self.assertIn("line 5: sub_category 'Syrups' does not belong to category 'Medicines'", err)
+        self.assertIn("line 6: unknown brand 'Micro Labs'", err)
+
+        existing.refresh_from_db()
+        self.assertEqual((existing.name, existing.price, existing.quantity), ("Paracetamol 650", 55, 3))
+        created = Product.objects.get(sku="NEW-1")
+        self.assertEqual(created.images.get().image.name, "images/products/main/dolo.png")
+        # signals were bypassed; cards and search are refreshed by the importer
+        self.assertEqual(ProductCard.objects.get(product=created).thumbnail, "images/products/main/dolo.png")
+        response = self.client.get(reverse("product-search") + "?search=dolo")
+        self.assertEqual([card["id"] for card in response.json()["results"]], [created.id])
+
+    def test_columns_missing_from_the_file_are_kept(self):
+        existing = self.products[0]
+        Product.objects.filter(pk=existing.pk).update(is_active=False, old_price=99)
+        path = self.write_file(".csv", "\n".join([
+            "sku,name,price,quantity,description,category,sub_category",
+            f"{existing.sku},Paracetamol 650,55,3,Updated,Medicines,Tablets",
+        ]))
+        out, _ = self.run_import(path)
+
+        self.assertIn("updated 1 products", out)
+        existing.refresh_from_db()
+        self.assertEqual((existing.name, existing.price, existing.quantity), ("Paracetamol 650", 55, 3))
+        self.assertEqual((existing.brand_id, existing.is_active, existing.old_price), (self.brand.id, False, 99))
+
+    def test_rows_for_existing_skus_only_need_the_changed_columns(self):
+        first, second, third = self.products[:3]
+        personal = Category.objects.create(name="Personal care")
+        SubCategory.objects.create(name="Syrups", category=self.category)
+        soaps = SubCategory.objects.create(name="Soaps", category=personal)
+        path = self.write_file(".jsonl", "\n".join(json.dumps(row) for row in [
+            {"sku": first.sku, "price": 99},
+            {"sku": second.sku, "sub_category": "Syrups"},
+            {"sku": third.sku, "category": "Personal care"},
+            {"sku": third.sku.lower(), "price": 5},
+        ]))
+        out, err = self.run_import(path)
+
+        self.assertIn("updated 2 products", out)
+        self.assertIn("line 3: the stored sub_category does not belong to category 'Personal care'", err)
+        # A new sku still needs the full row
+        self.assertIn("line 4: unknown category ''", err)
+        first.refresh_from_db()
+        self.assertEqual((first.name, first.price, first.quantity, first.description), (
+            "Paracetamol 0", 99, 10, "Paracetamol 0 description",
+        ))
+        second.refresh_from_db()
+        self.assertEqual((second.category_id, second.sub_category.name), (self.category.id, "Syrups"))
+        Product.objects.filter(pk=third.pk).update(sub_category=soaps)
+        self.run_import(self.write_file(".jsonl", json.dumps({"sku": third.sku, "category": "Personal care"})))
+        third.refresh_from_db()
+        self.assertEqual((third.category_id, third.sub_category_id), (personal.id, soaps.id))
+
+    def test_jsonl_can_create_brands(self):
+        path = self.write_file(".jsonl", "\n".join([
+            '{"sku": "NEW-1", "name": "Dolo", "price": 30, "quantity": 5, "description": "x",'
+            ' "category": "Medicines", "sub_category": "Tablets", "brand": "Micro Labs", "images": []}',
+            "not json",
+        ]))
+        out, err = self.run_import(path, "--create-brands")
+        self.assertIn("1 rows failed", out)
+        self.assertIn("line 2: invalid JSON", err)
+        self.assertEqual(Product.objects.get(sku="NEW-1").brand.name, "Micro Labs")
+
+
+class ProductFeedTests(CatalogTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user(mobile="9000000001", password=None, is_staff=True))
+
+    def fetch(self, fmt, query="", **headers):
+        response = self.client.get(reverse("product-feed", args=[fmt]) + query, **headers)
+        self.assertEqual(response.status_code, 200)
+        body = b"".join(response.streaming_content)
+        if response.get("Content-Encoding") == "gzip":
+            body = gzip.decompress(body)
+        return response, body.decode()
+
+    def test_csv_feed_is_gzipped_when_accepted(self):
+        Product.objects.filter(pk=self.products[0].pk).update(is_active=False)
+        response, body = self.fetch("csv", HTTP_ACCEPT_ENCODING="gzip, deflate")
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        rows = list(csv.DictReader(io.StringIO(body)))
+        self.assertEqual(sorted(int(row["id"]) for row in rows), [p.id for p in self.products[1:]])
+        self.assertEqual(rows[0]["product_type"], "Medicines > Tablets")
+        self.assertEqual(rows[0]["availability"], "in stock")
+
+    def test_incremental_feed(self):
+        since = timezone.now() - timedelta(seconds=1)
+        Product.objects.exclude(pk=self.products[0].pk).update(updated_at=since - timedelta(hours=1))
+        ProductCard.objects.update(updated_at=since - timedelta(hours=1))
+        _, body = self.fetch("jsonl", "?since=" + since.isoformat().replace("+", "%2B"))
+        self.assertEqual([json.loads(line)["id"] for line in body.splitlines()], [self.products[0].id])
+
+    def test_incremental_feed_lists_deactivated_and_deleted_products(self):
+        since = timezone.now() - timedelta(seconds=1)
+        Product.objects.update(updated_at=since - timedelta(hours=1))
+        ProductCard.objects.update(updated_at=since - timedelta(hours=1))
+        deactivated, deleted = self.products[:2]
+        deactivated.is_active = False
+        deactivated.save()
+        Product.objects.filter(pk=deleted.pk).delete()
+
+        _, body = self.fetch("jsonl", "?since=" + since.isoformat().replace("+", "%2B"))
+        rows = {row["id"]: row for row in map(json.loads, body.splitlines())}
+        self.assertEqual(set(rows), {deactivated.id, deleted.id})
+        self.assertEqual(rows[deactivated.id]["availability"], "out of stock")
+        self.assertEqual((rows[deleted.id]["sku"], rows[deleted.id]["availability"]), (deleted.sku, "out of stock"))
+        # a full feed still lists only what is for sale
+        _, body = self.fetch("jsonl")
+        self.assertEqual(len(body.splitlines()), len(self.products) - 2)
+
+    def test_xml_feed_and_bad_input(self):
+        _, body = self.fetch("xml")
+        items = ElementTree.fromstring(body).findall("channel/item")
+        self.assertEqual(len(items), len(self.products))
+        self.assertEqual(self.client.get(reverse("product-feed", args=["pdf"])).status_code, 400)
+        self.assertEqual(self.client.get(reverse("product-feed", args=["csv"]) + "?since=yesterday").status_code, 400)
+
+    def test_requires_staff(self):
+        self.client.force_authenticate(User.objects.create_user(mobile="9000000002", password=None))
+        self.assertEqual(self.client.get(reverse("product-feed", args=["csv"])).status_code, 403)
+
+    def test_command_writes_the_feed(self):
+        output = f"{MEDIA_ROOT}/feed.jsonl.gz"
+        call_command("export_feed", output, "--format", "jsonl", "--gzip", stdout=io.StringIO())
+        with gzip.open(output, "rt") as handle:
+            self.assertEqual(len(handle.readlines()), len(self.products))
+
+
+class RecentViewTests(CatalogTestCase):
+
+    def setUp(self):
+        super().setUp()
+        recent_views.take()
+        self.user = User.objects.create_user(mobile="9000000003", password=None)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def view(self, *products):
+        for product in products:
+            self.client.get(reverse("product-detail", args=[product.id]))
+
+    def test_views_are_buffered_and_flushed_as_increments(self):
+        first, second = self.products[:2]
+        Client().get(reverse("product-detail", args=[first.id]))  # warm the detail cache
+        # recording a view doesn't write
+        with self.assertNumQueries(0):
+            self.view(first)
+        self.view(second, first)
+        self.assertFalse(RecentView.objects.exists())
+
+        self.assertEqual(recent_views.flush(), 2)
+        counters = dict(RecentView.objects.values_list("product_id", "views_counter"))
+        self.assertEqual(counters, {first.id: 2, second.id: 1})
+
+        self.view(second)
+        recent_views.flush()
+        self.assertEqual(RecentView.objects.get(product=second).views_counter, 2)
+
+    @mock.patch.object(recent_views, "flush_interval", 10)
+    @mock.patch.object(recent_views, "max_size", 2)
+    def test_requests_never_start_the_flusher(self):
+        first, second = self.products[:2]
+        self.view(first)
+        self.assertIsNone(recent_views.pid)
+        self.assertNotIn("recent-views-flusher", [thread.name for thread in threading.enumerate()])
+        # Without a flusher a full buffer is written inline
+        self.view(second)
+        self.assertEqual(RecentView.objects.count(), 2)
+
+    def test_recently_viewed_includes_unflushed_views(self):
+        first, second, third = self.products[:3]
+        self.view(first, second)
+        recent_views.flush()
+        self.view(third, first)
+        response = self.client.get(reverse("recently-viewed") + "?limit=2")
+        self.assertEqual([card["id"] for card in response.json()["results"]], [first.id, third.id])
+
+
+class TrendingTests(CatalogTestCase):
+
+    def test_ranking_decays_and_weights_signals(self):
+        viewed, sold, wishlisted, cancelled, inactive = self.products
+        user = User.objects.create_user(mobile="9000000004", password=None)
+        address = Address.objects.create(
+            user=user, name="A", phone="9000000004", pincode="110001", address="x", city="Delhi", state="Delhi"
+        )
+        other = User.objects.create_user(mobile="9000000009", password=None)
+        RecentView.objects.create(user=user, product=viewed, views_counter=10)
+        RecentView.objects.create(user=other, product=viewed, views_counter=1)
+        # One heavy viewer counts once, however many views they piled up
+        RecentView.objects.create(user=user, product=cancelled, views_counter=1000)
+        RecentView.objects.create(user=user, product=inactive, views_counter=50)
+        Product.objects.filter(pk=inactive.pk).update(is_active=False)
+        ProductCard.objects.filter(pk=inactive.pk).update(is_active=False)
+        order = Order.objects.create(user=user, shipping_address=address, status="PLACED")
+        OrderItem.objects.create(order=order, product=sold, quantity=3, price=10)
+        failed = Order.objects.create(user=user, shipping_address=address, status="CANCELLED")
+        OrderItem.objects.create(order=failed, product=cancelled, quantity=9, price=10)
+        wish = Wishlist.objects.create(user=user, product=wishlisted)
+        # one half-life old: weight 3 counts as 1.5
+        Wishlist.objects.filter(pk=wish.pk).update(created_at=timezone.now() - timedelta(hours=72))
+
+        rows = refresh_trending()
+        global_rows = [row for row in rows if row.category_id is None]
+        ranking = [sold.id, viewed.id, wishlisted.id, cancelled.id]
+        self.assertEqual([row.product_id for row in global_rows], ranking)
+        self.assertAlmostEqual(global_rows[2].score, 1.5, places=2)
+        self.assertAlmostEqual(global_rows[3].score, 1.0, places=2)
+        self.assertEqual([row.product_id for row in rows if row.category_id == self.category.id], ranking)
+
+        url = reverse("product-trending") + f"?category={self.category.id}&limit=2"
+        with self.assertNumQueries(1):
+            response = self.client.get(url)
+        self.assertEqual([card["id"] for card in response.json()], [sold.id, viewed.id])
+        with self.assertNumQueries(0):
+            self.client.get(url)
+
+
+@override_settings(RECOMMENDATION_MIN_SUPPORT=1)
+class AlsoBoughtTests(CatalogTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(mobile="9000000005", password=None)
+        self.address = Address.objects.create(
+            user=self.user, name="A", phone="9000000005", pincode="110001", address="x", city="Delhi", state="Delhi"
+        )
+
+    def order(self, *products, status="PLACED", payment_method="COD"):
+        order = Order.objects.create(
+            user=self.user, shipping_address=self.address, status=status, payment_method=payment_method
+        )
+        OrderItem.objects.bulk_create([OrderItem(order=order, product=p, quantity=1, price=p.price) for p in products])
+        return order
+
+    def neighbours(self, product):
+        return list(ProductNeighbour.objects.filter(product=product).values_list("neighbour_id", flat=True))
+
+    def test_incremental_updates_match_a_rebuild(self):
+        a, b, c, d, _ = self.products
+        self.order(a, b)
+        self.order(a, b, c)
+        self.order(a, d, status="CANCELLED")
+        self.assertEqual(update_recommendations(), (3, 3))
+        # b shares 2 of a's 2 orders, c only 1
+        self.assertEqual(self.neighbours(a), [b.id, c.id])
+
+        self.order(a, c)
+        self.order(a, c)
+        self.assertEqual(update_recommendations()[0], 2)
+        self.assertEqual(update_recommendations(), (0, 0))
+        incremental = {p.id: self.neighbours(p) for p in (a, b, c)}
+        self.assertEqual(incremental[a.id], [c.id, b.id])
+
+        update_recommendations(rebuild=True)
+        self.assertEqual({p.id: self.neighbours(p) for p in (a, b, c)}, incremental)
+
+        url = reverse("product-also-bought", args=[a.id])
+        with self.assertNumQueries(1):
+            response = self.client.get(url)
+        self.assertEqual([card["id"] for card in response.json()], [c.id, b.id])
+
+    def test_unpaid_online_orders_wait_until_settled(self):
+        a, b, c, _, _ = self.products
+        self.order(a, b)
+        unpaid = self.order(a, c, status="PENDING", payment_method="RAZORPAY")
+        self.order(a, b)
+        self.order(b, c, status="PENDING")  # cash on delivery: a sale already
+        self.assertEqual(update_recommendations()[0], 1)
+
+        # the payment never comes; the sweeper cancels the order
+        Order.objects.filter(pk=unpaid.pk).update(status="CANCELLED")
+        self.assertEqual(update_recommendations()[0], 3)
+        self.assertEqual(self.neighbours(a), [b.id])
+
+    def test_stale_unpaid_orders_without_holds_are_skipped(self):
+        a, b, c, _, _ = self.products
+        # Placed before stock reservations existed: nothing will ever settle it
+        stale = self.order(a, c, status="PENDING", payment_method="RAZORPAY")
+        yesterday = timezone.now() - timedelta(days=1)
+        Order.objects.filter(pk=stale.pk).update(created_at=yesterday)
+        self.order(a, b, status="PAID")
+        # An expired hold the sweeper has yet to cancel
+        held = self.order(b, c, status="PENDING", payment_method="RAZORPAY")
+        Order.objects.filter(pk=held.pk).update(created_at=yesterday)
+        StockReservation.objects.create(order=held, product=b, quantity=1, expires_at=yesterday)
+        self.order(a, c)
+
+        # The paid order behind the stale one is counted; held still waits for the sweeper
+        self.assertEqual(update_recommendations()[0], 2)
+        self.assertEqual(self.neighbours(a), [b.id])
+        Order.objects.filter(pk=held.pk).update(status="CANCELLED")
+        self.assertEqual(update_recommendations()[0], 2)
+        # One order each with b and c: the stale order added nothing for c
+        scores = dict(ProductNeighbour.objects.filter(product=a).values_list("neighbour_id", "score"))
+        self.assertEqual(scores, {b.id: scores[c.id], c.id: scores[c.id]})
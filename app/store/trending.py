@@ -0,0 +1,109 @@
+from datetime import timedelta
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from orders.models import OrderItem
+from store.models import ProductCard, RecentView, TrendingProduct, Wishlist
+from store.services import VersionedCache
+
+trending_cache = VersionedCache("trending", timeout=settings.TRENDING_CACHE_TIMEOUT)
+
+# Orders that never turned into a sale don't count
+NON_SALE_STATUSES = ["CANCELLED", "FAILED"]
+NO_CATEGORY = -1
+
+
+def signal_events(since):
+    """Per signal: a values_list of (product_id, event time, amount) since the cut-off."""
+    return {
+        # RecentView keeps one row per user and product, dated at the last view; its
+        # views_counter spans the row's whole life, so each row counts once: a viewer
+        "views": RecentView.objects.filter(updated_at__gte=since).values_list("product_id", "updated_at", "id"),
+        "wishlist": Wishlist.objects.filter(created_at__gte=since).values_list("product_id", "created_at", "id"),
+        "sales": OrderItem.objects.filter(created_at__gte=since)
+        .exclude(order__status__in=NON_SALE_STATUSES)
+        .values_list("product_id", "created_at", "quantity"),
+    }
+
+
+def load_events(rows, count_rows=False):
+    """(product ids, unix times, amounts) arrays; count_rows makes every row count once."""
+    data = np.array(
+        [(pk, at.timestamp(), 1 if count_rows else amount) for pk, at, amount in rows.iterator(chunk_size=5000)],
+        dtype=float,
+    ).reshape(-1, 3)
+    return data[:, 0].astype(np.int64), data[:, 1], data[:, 2]
+
+
+def compute_scores(now=None):
+    """
+    Decayed popularity of every active product,
+        score = sum over events of weight[signal] * amount * 2 ** (-age / half-life),
+    as (product ids, category ids, scores) arrays of the products that scored.
+    """
+    now = now or timezone.now()
+    since = now - timedelta(days=settings.TRENDING_WINDOW_DAYS)
+    half_life = settings.TRENDING_HALF_LIFE_HOURS * 3600
+
+    products = list(
+        ProductCard.objects.filter(is_active=True).order_by("product_id").values_list("product_id", "category_id")
+    )
+    product_ids = np.fromiter((pk for pk, _ in products), np.int64, len(products))
+    category_ids = np.fromiter(
+        (NO_CATEGORY if category is None else category for _, category in products), np.int64, len(products)
+    )
+    scores = np.zeros(len(product_ids))
+    if not len(product_ids):
+        return product_ids, category_ids, scores
+
+    for signal, rows in signal_events(since).items():
+        event_products, times, amounts = load_events(rows, count_rows=signal in ("views", "wishlist"))
+        # Position of each event's product in product_ids; inactive products drop out
+        positions = np.minimum(np.searchsorted(product_ids, event_products), len(product_ids) - 1)
+        active = product_ids[positions] == event_products
+        decay = np.exp2((times[active] - now.timestamp()) / half_life)
+        scores += settings.TRENDING_WEIGHTS[signal] * np.bincount(
+            positions[active], weights=amounts[active] * decay, minlength=len(product_ids)
+        )
+
+    scored = scores > 0
+    return product_ids[scored], category_ids[scored], scores[scored]
+
+
+def rank(product_ids, category_ids, scores, size):
+    """Top size products overall and per category as TrendingProduct rows (unsaved)."""
+    computed_at = timezone.now()
+    # Best first; ties go to the newer product
+    order = np.lexsort((-product_ids, -scores))
+    rows = [
+        TrendingProduct(category_id=None, product_id=int(product_ids[i]), rank=position, score=float(scores[i]),
+                        computed_at=computed_at)
+        for position, i in enumerate(order[:size], 1)
+    ]
+
+    # Stable sort by category keeps the score order inside each category
+    by_category = order[np.argsort(category_ids[order], kind="stable")]
+    categories = category_ids[by_category]
+    starts = np.flatnonzero(np.r_[True, categories[1:] != categories[:-1]]) if len(categories) else []
+    for start, end in zip(starts, list(starts[1:]) + [len(categories)]):
+        if categories[start] == NO_CATEGORY:
+            continue
+        for position, i in enumerate(by_category[start:min(end, start + size)], 1):
+            rows.append(TrendingProduct(
+                category_id=int(categories[start]), product_id=int(product_ids[i]), rank=position,
+                score=float(scores[i]), computed_at=computed_at,
+            ))
+    return rows
+
+
+def refresh_trending(size=None):
+    """Recompute the ranking table and invalidate cached trending responses."""
+    rows = rank(*compute_scores(), size or settings.TRENDING_SIZE)
+    with transaction.atomic():
+        TrendingProduct.objects.all().delete()
+        TrendingProduct.objects.bulk_create(rows, batch_size=1000)
+    trending_cache.bump()
+    return rows